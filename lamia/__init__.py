@@ -3,12 +3,21 @@ supports blogs, status updates, and polls.
 """
 from starlette.applications import Starlette
 # from lamia.database import setup_db
+from lamia.cache import setup_cache
 from lamia.email import setup_email
+from lamia.federation import setup_federation
+from lamia.invalidation import setup_invalidation
 from lamia.routes import setup_routes
+from lamia.settings import setup_settings
+from lamia.stats import setup_stats
 from lamia.logging import logging
 import lamia.config as CONFIG
 
 app = Starlette(debug=CONFIG.DEBUG)  # pylint: disable=invalid-name
 setup_email(app)
-# TODO: Setup redis here
+setup_federation(app)
+setup_stats(app)
+setup_cache(app)
+setup_invalidation(app)
+setup_settings(app)
 setup_routes(app)
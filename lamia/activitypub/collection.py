@@ -0,0 +1,190 @@
+"""Reading remote activitypub collections (outboxes, followers, following,
+featured posts and friends).
+
+Remote collections can hold thousands of items spread over many pages, so
+CollectionWalk walks them a page at a time: it follows a collection's
+first/next links, validates each item as it gets to it, and hands back
+schemas (or plain urls, for collections of links like followers) one at a
+time. Only the page currently being read is held in memory, pages are size
+limited, and a caller that stops iterating early stops the walk, so no more
+pages get fetched.
+
+Usage:
+
+walk = CollectionWalk(actor.outbox, max_items=200)
+async for activity in walk:
+    ...
+walk.stats()  # {'pages': 4, 'items': 200, 'invalid': 3, ...}
+"""
+from typing import Any, AsyncIterator, Type
+
+import ujson as json
+
+from lamia.activitypub.schema import Schema, ActivitySchema, ObjectSchema
+from lamia.federation import http_client
+from lamia.utilities.http import HttpClient
+
+# The most pages that one walk will fetch
+MAX_PAGES = 100
+# The largest page (in bytes) that we'll read
+MAX_PAGE_SIZE = 4 * 1024 * 1024
+# Pages are read off of the connection in chunks of this many bytes
+PAGE_CHUNK_SIZE = 64 * 1024
+
+ACTIVITY_HEADERS = {
+    'Accept': ('application/activity+json, application/ld+json; '
+               'profile="https://www.w3.org/ns/activitystreams"'),
+}
+
+
+class CollectionException(Exception):
+    """Raised when a collection (or one of its pages) can't be read."""
+
+
+async def fetch_page(url: str, client: HttpClient = None,
+                     max_size: int = MAX_PAGE_SIZE) -> dict:
+    """Fetches a collection or collection page, reading no more than
+    max_size bytes of it.
+    """
+    client = http_client if client is None else client
+
+    async with await client.request(
+            'GET', url, headers=ACTIVITY_HEADERS) as response:
+        if response.status != 200:
+            raise CollectionException(
+                f'{url} responded with status {response.status}')
+        if (response.content_length is not None
+                and response.content_length > max_size):
+            raise CollectionException(f'{url} is larger than {max_size} bytes')
+
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(PAGE_CHUNK_SIZE):
+            body.extend(chunk)
+            if len(body) > max_size:
+                raise CollectionException(
+                    f'{url} is larger than {max_size} bytes')
+
+    try:
+        page = json.loads(bytes(body))
+    except ValueError:
+        raise CollectionException(f'{url} is not valid json')
+    if not isinstance(page, dict):
+        raise CollectionException(f'{url} is not a json object')
+    return page
+
+
+def schema_for(item: dict) -> Type[Schema]:
+    """Guesses whether a collection item is an activity or an object."""
+    if 'actor' in item:
+        return ActivitySchema
+    return ObjectSchema
+
+
+class CollectionWalk:
+    """An async iterator over the items of a remote collection.
+
+    url - the collection's url
+    schema_cls - the schema to validate items against (by default, items
+        with an actor are activities and anything else is an object)
+    max_pages - the most pages to fetch
+    max_items - the most items to yield (None for no limit)
+    max_page_size - the largest page to read, in bytes
+    client - the http client to use (the shared federation client if None)
+
+    Items that fail validation are skipped and counted. Items that are
+    just urls (as in followers and following) are yielded as strings.
+    """
+
+    def __init__(self,
+                 url: str,
+                 schema_cls: Type[Schema] = None,
+                 max_pages: int = MAX_PAGES,
+                 max_items: int = None,
+                 max_page_size: int = MAX_PAGE_SIZE,
+                 client: HttpClient = None) -> None:
+        self.url = url
+        self.schema_cls = schema_cls
+        self.max_pages = max_pages
+        self.max_items = max_items
+        self.max_page_size = max_page_size
+        self.client = client
+
+        self.total_items = None
+        self.pages = 0
+        self.items = 0
+        self.invalid = 0
+
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self._walk()
+
+    async def _fetch(self, url: str) -> dict:
+        """Fetches one page, counting it against max_pages."""
+        self.pages += 1
+        return await fetch_page(url, self.client, self.max_page_size)
+
+    def _item(self, item: Any) -> Any:
+        """Returns a validated schema (or url) for an item, or None if the
+        item should be skipped.
+        """
+        if isinstance(item, str):
+            return item
+        if not isinstance(item, dict):
+            self.invalid += 1
+            return None
+
+        schema_cls = self.schema_cls or schema_for(item)
+        if schema_cls.COMPILED_FIELDS.validate(item) is not None:
+            self.invalid += 1
+            return None
+        return schema_cls.from_validated(item)
+
+    async def _walk(self) -> AsyncIterator[Any]:
+        """Yields the collection's items, page by page."""
+        page = await self._fetch(self.url)
+        self.total_items = page.get('totalItems')
+        seen = {self.url}
+
+        # Small collections inline their items; big ones hand over a first
+        # page (as a url, or embedded)
+        next_page = page.get('first')
+
+        while page is not None:
+            items = page.get('orderedItems', page.get('items'))
+            if items is None:
+                items = ()
+            elif not isinstance(items, list):
+                items = (items, )
+
+            for item in items:
+                result = self._item(item)
+                if result is None:
+                    continue
+                yield result
+                self.items += 1
+                if self.max_items is not None and self.items >= self.max_items:
+                    return
+
+            if next_page is None:
+                next_page = page.get('next')
+            # Only ever hold onto the one page
+            page = items = None
+
+            if isinstance(next_page, dict):
+                page, next_page = next_page, None
+                continue
+
+            if (not isinstance(next_page, str) or next_page in seen
+                    or self.pages >= self.max_pages):
+                return
+
+            seen.add(next_page)
+            page, next_page = await self._fetch(next_page), None
+
+    def stats(self) -> dict:
+        """Returns a dictionary of counters for the walk so far."""
+        return {
+            'pages': self.pages,
+            'items': self.items,
+            'invalid': self.invalid,
+            'total_items': self.total_items,
+        }
@@ -1,5 +1,6 @@
 """This module stores the @context data that will be applied to our internal
 lamia objects (and included when they get federated)."""
+import ujson as json
 
 # In a json-ld world, the @context dictates the shared language between
 # lamia and other activitypub implementations.
@@ -47,6 +48,30 @@ LAMIA_CONTEXT = [
         #       "value": "they/them"
         #   }
         'PropertyValue': 'schema:PropertyValue',
-        'value': 'schema:value'
+        'value': 'schema:value',
+        # Multikeys, for publishing ed25519 keys alongside the rsa publicKey
+        # https://www.w3.org/TR/controller-document/#multikey
+        'sec': 'https://w3id.org/security#',
+        'Multikey': 'sec:Multikey',
+        'assertionMethod': {
+            '@id': 'sec:assertionMethod',
+            '@type': '@id',
+            '@container': '@set',
+        },
+        'controller': {
+            '@id': 'sec:controller',
+            '@type': '@id',
+        },
+        'publicKeyMultibase': {
+            '@id': 'sec:publicKeyMultibase',
+            '@type': 'sec:multibase',
+        },
     }
 ]
+
+# LAMIA_CONTEXT encoded once at import, as the "@context" member of a JSON
+# object, so that serializing a schema to bytes can splice it in rather than
+# encoding the same context into every response and delivery
+LAMIA_CONTEXT_JSON = json.dumps(
+    LAMIA_CONTEXT, escape_forward_slashes=False).encode('utf-8')
+LAMIA_CONTEXT_MEMBER = b'"@context":' + LAMIA_CONTEXT_JSON
@@ -1,7 +1,14 @@
 """This module contains the fieldsets commonly associated with ActivityPub
 objects. This fieldset data will be used to keep our schemata clean.
+
+Walking a fieldset (looking up each field, looping over its types and
+indexing its validation functions) for every field of every incoming
+document adds up, so each fieldset is also compiled, once, into a
+CompiledFields: a check function per field, plus a single function that
+checks a whole document in one pass. See compile_fields.
 """
 from collections import namedtuple
+from typing import Any, Callable
 from lamia.activitypub.validation import contains_only_strings
 from lamia.activitypub.validation import validate_loose_struct
 from lamia.activitypub.validation import validate_list_of_loose_structs
@@ -111,6 +118,12 @@ ACTOR_FIELDS = {
         'owner': str,
         'publicKeyPem': str
     }), )),
+    # additional keys (like ed25519 multikeys) that can verify signatures
+    'assertionMethod':
+    Field((list, ), False, (validate_list_of_loose_structs({
+        'id': str,
+        'type': str,
+    }), )),
     # a url for a collection of pinned objects
     'featured':
     Field((str, ), False, (None, )),
@@ -141,3 +154,101 @@ ACTOR_FIELDS = {
     'image':
     Field((dict, ), False, (None, )),
 }
+
+
+# Reasons that a field can fail, as returned by compiled checks
+INVALID_REQUIRED = 'required'
+INVALID_TYPE = 'type'
+INVALID_VALIDATION = 'validation'
+# (and when the document isn't even a dictionary)
+INVALID_DOCUMENT = 'document'
+
+# checks - maps each field name to a function that takes a value and returns
+#     None if it is valid or one of the INVALID_* reasons if it is not
+# validate - a function that takes a whole document and returns None if it
+#     is valid or a tuple of (field, reason) for the first invalid field
+CompiledFields = namedtuple('CompiledFields', 'fields checks validate')
+
+
+def compile_field(meta: Field) -> Callable[[Any], str]:
+    """Turns a single Field into a function that checks a value. The common
+    cases (one type, no validation) get a closure with nothing else in it.
+    """
+    types = meta[FIELD_TYPE]
+    validations = meta[FIELD_VALIDATION]
+
+    if not any(validations):
+        # Only the type matters, isinstance can take the whole tuple
+        def check_type(value: Any) -> str:
+            if isinstance(value, types):
+                return None
+            return INVALID_TYPE
+
+        return check_type
+
+    if len(types) == 1:
+        _type, validation = types[0], validations[0]
+
+        def check_type_and_value(value: Any) -> str:
+            if not isinstance(value, _type):
+                return INVALID_TYPE
+            if not validation(value):
+                return INVALID_VALIDATION
+            return None
+
+        return check_type_and_value
+
+    # Several types, the first one that matches picks the validation
+    pairs = tuple(zip(types, validations))
+
+    def check_types_and_values(value: Any) -> str:
+        for _type, validation in pairs:
+            if isinstance(value, _type):
+                if validation is None or validation(value):
+                    return None
+                return INVALID_VALIDATION
+        return INVALID_TYPE
+
+    return check_types_and_values
+
+
+def compile_fields(fields: dict) -> CompiledFields:
+    """Compiles a fieldset into a CompiledFields. This should be done once,
+    when the fieldset is defined, rather than per document.
+    """
+    checks = {name: compile_field(meta) for name, meta in fields.items()}
+    plan = tuple((name, meta[FIELD_REQUIRED], checks[name])
+                 for name, meta in fields.items())
+
+    def validate(document: dict) -> tuple:
+        for name, required, check in plan:
+            if name in document:
+                reason = check(document[name])
+                if reason is not None:
+                    return (name, reason)
+            elif required:
+                return (name, INVALID_REQUIRED)
+        return None
+
+    return CompiledFields(fields, checks, validate)
+
+
+# Compiled fieldsets, by the id of the fieldset that they were compiled from
+_COMPILED_FIELDS = {}
+
+
+def get_compiled_fields(fields: dict) -> CompiledFields:
+    """Returns the CompiledFields for a fieldset, compiling it only the
+    first time that we see it.
+    """
+    compiled = _COMPILED_FIELDS.get(id(fields))
+    # The identity check guards against a recycled id
+    if compiled is None or compiled.fields is not fields:
+        compiled = compile_fields(fields)
+        _COMPILED_FIELDS[id(fields)] = compiled
+    return compiled
+
+
+COMPILED_ACTIVITY_FIELDS = get_compiled_fields(ACTIVTY_FIELDS)
+COMPILED_OBJECT_FIELDS = get_compiled_fields(OBJECT_FIELDS)
+COMPILED_ACTOR_FIELDS = get_compiled_fields(ACTOR_FIELDS)
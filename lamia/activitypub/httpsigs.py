@@ -18,13 +18,378 @@ code, so we will be doing the same thing that mastodon does:
 `"SHA-256=#{Digest::SHA256.base64digest(request_body)}"`
 
 There's no date header in the mastodon source code, so I'm not sure that we
-need to go that route.
+need to go that route. (Update: mastodon does check the date header these
+days, so sign_deliveries adds one.)
+
+Parsing a PEM encoded key is a surprisingly large chunk of the work done when
+verifying a signature, and a busy remote instance will send us the same key
+thousands of times. Imported keys are held in KEY_CACHE, keyed by the keyId
+and a fingerprint of the PEM itself, so a rotated key never matches a stale
+entry. invalidate_key() can be used to drop a key early (say, when an actor
+sends an Update with a new publicKey).
+
+RSA is slow enough that doing it inline in an async handler stalls every
+other request on the worker during a federation burst. sign_async,
+verify_async and verify_many_async run the same functions on the executor
+configured in POOL (a thread pool by default, or a process pool) instead.
+
+Newer fediverse software also speaks Ed25519, which is several times
+cheaper to verify than RSA. Signatures are negotiated from the algorithm
+field and the type of key: rsa-sha256 for RSA keys, ed25519 for Ed25519 keys,
+and hs2019 means "whatever the key says". Ed25519 public keys are published
+as Multikeys (https://codeberg.org/fediverse/fep/src/branch/main/fep/521a),
+so import_key understands publicKeyMultibase values as well as PEMs.
+
+Remote servers retry, and shared inboxes mean the same signed request can
+show up more than once. Results from verify are remembered in
+VERIFIED_CACHE, keyed by the keyId, the key, the algorithm, the signature
+and a hash of the full signing string (so a signature replayed against
+another path, body or algorithm is a miss). Only requests with a signed
+date header are cached, and never for longer than that date stays inside
+VERIFIED_CACHE_WINDOW.
+
+Inbox POSTs can be big, so read_body hashes the body as it streams in from
+starlette (rejecting anything over MAX_BODY_SIZE as early as possible) and
+hands back the digest alongside the bytes. Passing that digest to verify
+means the body never has to be decoded, re-encoded or hashed a second time.
 """
 
+import asyncio
 import base64
-from Crypto.Signature import pkcs1_15
+import hashlib
+import hmac
+import sys
+import time
+from collections import namedtuple
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlparse
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterable, List, Tuple, Union
+from starlette.applications import Starlette
+from starlette.config import Config
+from starlette.requests import Request
+from Crypto.Signature import eddsa, pkcs1_15
 from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
+from Crypto.PublicKey import ECC, RSA
+from lamia.utilities.lru import LRUCache
+
+# How many imported keys to hold on to, and for how long (in seconds)
+KEY_CACHE_SIZE = 1024
+KEY_CACHE_TTL = 60 * 60
+
+
+# How many verification results to remember, and how far (in seconds) a
+# signed date header may drift from our clock before we stop caching
+VERIFIED_CACHE_SIZE = 4096
+VERIFIED_CACHE_WINDOW = 5 * 60
+
+# The largest request body (in bytes) that read_body will accept
+MAX_BODY_SIZE = 1024 * 1024
+
+# The multicodec prefix for an ed25519 public key, and the base58 alphabet
+# used by multibase's 'z' (base58btc) encoding
+ED25519_MULTICODEC = b'\xed\x01'
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def multibase_encode(public_key: ECC.EccKey) -> str:
+    """Returns the publicKeyMultibase value for an Ed25519 public key."""
+    raw = ED25519_MULTICODEC + public_key.export_key(format='raw')
+    number = int.from_bytes(raw, 'big')
+    encoded = ''
+    while number:
+        number, remainder = divmod(number, 58)
+        encoded = BASE58_ALPHABET[remainder] + encoded
+    # Leading zero bytes are encoded as leading ones
+    padding = len(raw) - len(raw.lstrip(b'\x00'))
+    return 'z' + BASE58_ALPHABET[0] * padding + encoded
+
+
+def multibase_decode(value: str) -> ECC.EccKey:
+    """Imports an Ed25519 public key from a publicKeyMultibase value."""
+    if not value.startswith('z'):
+        raise ValueError('only base58btc multibase keys are supported')
+    number = 0
+    for character in value[1:]:
+        number = number * 58 + BASE58_ALPHABET.index(character)
+    raw = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    padding = len(value[1:]) - len(value[1:].lstrip(BASE58_ALPHABET[0]))
+    raw = b'\x00' * padding + raw
+    if not raw.startswith(ED25519_MULTICODEC):
+        raise ValueError('multibase value is not an ed25519 public key')
+    return eddsa.import_public_key(raw[len(ED25519_MULTICODEC):])
+
+
+def _import_key(key_data: Union[str, bytes]):
+    """Imports an RSA or Ed25519 key from a PEM, or an Ed25519 public key
+    from a publicKeyMultibase value.
+    """
+    if isinstance(key_data, str) and key_data.startswith('z'):
+        return multibase_decode(key_data)
+    try:
+        return RSA.import_key(key_data)
+    except ValueError:
+        return ECC.import_key(key_data)
+
+
+def is_ed25519_key(key) -> bool:
+    """Is this an imported Ed25519 key (as opposed to an RSA key)?"""
+    return isinstance(key, ECC.EccKey) and key.curve == 'Ed25519'
+
+
+def key_fingerprint(pem: Union[str, bytes]) -> str:
+    """Returns a short, stable fingerprint for a PEM encoded key. Hashing the
+    PEM is a lot cheaper than parsing it, which is the whole point.
+    """
+    if isinstance(pem, str):
+        pem = pem.encode('ascii')
+    return hashlib.sha256(pem).hexdigest()
+
+
+class KeyCache:
+    """A bounded cache of imported key objects.
+
+    Entries are keyed by (key_id, fingerprint) so that the same keyId
+    with a different PEM (a rotated key) is a cache miss rather than a
+    wrong answer.
+    """
+
+    def __init__(self, max_size: int = KEY_CACHE_SIZE,
+                 ttl: float = KEY_CACHE_TTL) -> None:
+        self.keys = LRUCache(max_size=max_size, ttl=ttl)
+
+    def import_key(self,
+                   pem: Union[str, bytes],
+                   key_id: str = None,
+                   fingerprint: str = None):
+        """Returns the imported key for a PEM string, parsing it only if
+        we haven't seen it (recently).
+        """
+        cache_key = (key_id, fingerprint or key_fingerprint(pem))
+        key = self.keys.get(cache_key)
+        if key is None:
+            key = _import_key(pem)
+            self.keys.set(cache_key, key)
+        return key
+
+    def invalidate(self, key_id: str) -> int:
+        """Drops every cached key associated with a keyId. Returns the
+        number of entries removed.
+        """
+        return self.keys.invalidate_many(
+            [k for k in self.keys.keys() if k[0] == key_id])
+
+    def clear(self) -> None:
+        """Drops every cached key."""
+        self.keys.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss counters for the key cache."""
+        return self.keys.stats()
+
+
+KEY_CACHE = KeyCache()
+
+
+def invalidate_key(key_id: str) -> int:
+    """The key rotation hook. Call this when a keyId should no longer be
+    trusted to map onto whatever we have cached for it.
+    """
+    return KEY_CACHE.invalidate(key_id)
+
+
+class VerificationCache:
+    """A short lived cache of signature verification results.
+
+    An entry lives until the signed date header falls outside of the window
+    (or it is evicted), so a replayed request is never accepted from the
+    cache after the point where it would look stale anyway.
+    """
+
+    def __init__(self,
+                 max_size: int = VERIFIED_CACHE_SIZE,
+                 window: float = VERIFIED_CACHE_WINDOW) -> None:
+        self.results = LRUCache(max_size=max_size)
+        self.window = window
+        # Requests that couldn't be cached (no signed date, or a stale one),
+        # counted under the results' lock since verify runs in threads
+        self.skipped = 0
+
+    def _skip(self) -> None:
+        """Counts a request that couldn't be cached."""
+        with self.results.lock:
+            self.skipped += 1
+
+    def ttl_for(self, headers: dict, signed_header_keys: List[str]) -> float:
+        """Returns how long a result for this request may be cached for, or
+        None when it shouldn't be cached at all.
+        """
+        if 'date' not in signed_header_keys:
+            self._skip()
+            return None
+
+        try:
+            signed_at = parsedate_to_datetime(headers['date']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            self._skip()
+            return None
+
+        now = time.time()
+        if abs(now - signed_at) > self.window:
+            self._skip()
+            return None
+
+        return signed_at + self.window - now
+
+    def get(self, cache_key: tuple) -> bool:
+        """Returns the earlier result for a request, or None."""
+        return self.results.get(cache_key)
+
+    def set(self, cache_key: tuple, result: bool, ttl: float) -> None:
+        """Remember a verification result for ttl seconds."""
+        self.results.set(cache_key, result, ttl=ttl)
+
+    def clear(self) -> None:
+        """Forget every result."""
+        self.results.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss/skip counters for the verification cache."""
+        stats = self.results.stats()
+        with self.results.lock:
+            stats['skipped'] = self.skipped
+        return stats
+
+
+VERIFIED_CACHE = VerificationCache()
+
+
+def parse_signature_header(signature_header: str) -> dict:
+    """Splits a signature header into a dictionary of its values."""
+    return {
+        k: v[1:-1]
+        for k, v in [i.split('=', 1) for i in signature_header.split(',')]
+    }
+
+
+def digest_header(body: Union[str, bytes]) -> str:
+    """Returns the value of a digest header for a request body."""
+    if isinstance(body, str):
+        body = body.encode()
+    return 'SHA-256=' + base64.b64encode(SHA256.new(body).digest()).decode(
+        'ascii')
+
+
+def _signer(private_key) -> tuple:
+    """Returns a tuple of (algorithm, function) where the function takes the
+    signing string (as bytes) and returns the raw signature.
+    """
+    if is_ed25519_key(private_key):
+        return ('hs2019', eddsa.new(private_key, 'rfc8032').sign)
+
+    signer = pkcs1_15.new(private_key)
+    return ('rsa-sha256', lambda text: signer.sign(SHA256.new(text)))
+
+
+def _verifier(public_key, algorithm: str) -> Callable:
+    """Negotiates a verification function (taking the signing string and the
+    raw signature) for an algorithm and key type. Returns None when the two
+    don't go together.
+    """
+    if is_ed25519_key(public_key):
+        if algorithm in ('hs2019', 'ed25519'):
+            return eddsa.new(public_key, 'rfc8032').verify
+        return None
+
+    if algorithm in ('hs2019', 'rsa-sha256'):
+        verifier = pkcs1_15.new(public_key)
+        return lambda text, signature: verifier.verify(
+            SHA256.new(text), signature)
+    return None
+
+
+def digest_matches(received: str, expected: str) -> bool:
+    """Checks a received digest header (which may list several digests,
+    comma separated) against the one that we computed ourselves.
+    """
+    expected_algorithm, expected_value = expected.split('=', 1)
+    for entry in received.split(','):
+        algorithm, _, value = entry.strip().partition('=')
+        if algorithm.upper() == expected_algorithm.upper():
+            return hmac.compare_digest(value, expected_value)
+    return False
+
+
+class BodyTooLargeException(Exception):
+    """Raised when a request body is bigger than we are willing to read."""
+
+
+class BodyDigest:
+    """Incrementally hashes a request body, chunk by chunk, and refuses to
+    go past max_size bytes.
+    """
+
+    def __init__(self, max_size: int = MAX_BODY_SIZE) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+    def update(self, chunk: bytes) -> None:
+        """Add a chunk of the body to the digest."""
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise BodyTooLargeException(
+                f'request body is larger than {self.max_size} bytes')
+        self.hash.update(chunk)
+
+    def header(self) -> str:
+        """Returns the value of a digest header for everything so far."""
+        return 'SHA-256=' + base64.b64encode(self.hash.digest()).decode(
+            'ascii')
+
+    def matches(self, received: str) -> bool:
+        """Does a received digest header match the body that we read?"""
+        return digest_matches(received, self.header())
+
+
+async def read_body(request: Request, max_size: int = MAX_BODY_SIZE
+                    ) -> Tuple[bytearray, BodyDigest]:
+    """Reads a request body from starlette's stream, hashing each chunk as
+    it arrives. Returns a tuple of (body, digest).
+
+    The chunks are appended straight onto one bytearray (which is what
+    comes back), so the body is never held more than once.
+
+    Raises BodyTooLargeException as soon as the content-length header or the
+    stream itself goes past max_size, without reading the rest.
+    """
+    content_length = request.headers.get('content-length')
+    if content_length is not None and content_length.isdigit() and int(
+            content_length) > max_size:
+        raise BodyTooLargeException(
+            f'request body is larger than {max_size} bytes')
+
+    digest = BodyDigest(max_size)
+    body = bytearray()
+    async for chunk in request.stream():
+        digest.update(chunk)
+        body.extend(chunk)
+
+    return (body, digest)
+
+
+def _format_signature_header(key_id: str, algorithm: str,
+                             signed_header_keys: Iterable[str],
+                             signature: bytes) -> str:
+    """Put a raw signature into a valid HTTP signature header format."""
+    signature_dict = {
+        'keyId': key_id,
+        'algorithm': algorithm,
+        'headers': ' '.join(signed_header_keys),
+        'signature': base64.b64encode(signature).decode('ascii')
+    }
+    return ','.join([f'{k}="{v}"' for k, v in signature_dict.items()])
 
 
 def sign(private_key: str, key_id: str, headers: dict, path: str) -> str:
@@ -36,15 +401,15 @@ def sign(private_key: str, key_id: str, headers: dict, path: str) -> str:
 
     It also makes sense, I suppose.
 
-    private_key - the private key from an rsa key pair
+    private_key - the private key from an rsa or ed25519 key pair
     key_id - the lookup for the key to validate
     headers - should be a dictionary of request headers
     path - the relative url that we're requesting
     """
     # We should probably avoid accidentally changing our headers
     headers = headers.copy()
-    # Import the key
-    private_key = RSA.import_key(private_key)
+    # Import the key (or reuse the one we imported last time)
+    private_key = KEY_CACHE.import_key(private_key, key_id)
     # Note: we assume that this outgoing request is a POST
     headers.update({
         '(request-target)': f'post {path}',
@@ -55,74 +420,265 @@ def sign(private_key: str, key_id: str, headers: dict, path: str) -> str:
     for header_key in signed_header_keys:
         signed_header_text += f'{header_key}: {headers[header_key]}\n'
     signed_header_text = signed_header_text.strip()
-    header_digest = SHA256.new(signed_header_text.encode('ascii'))
 
-    # Sign the digest
-    raw_signature = pkcs1_15.new(private_key).sign(header_digest)
-    signature = base64.b64encode(raw_signature).decode('ascii')
+    # Sign the header text (rsa signs a sha256 digest of it)
+    algorithm, signer = _signer(private_key)
+    raw_signature = signer(signed_header_text.encode('ascii'))
 
     # Put it into a valid HTTP signature format and return
-    signature_dict = {
-        'keyId': key_id,
-        'algorithm': 'rsa-sha256',
-        'headers': ' '.join(signed_header_keys),
-        'signature': signature
-    }
-    signature_header = ','.join(
-        [f'{k}="{v}"' for k, v in signature_dict.items()])
-    return signature_header
+    return _format_signature_header(key_id, algorithm, signed_header_keys,
+                                    raw_signature)
+
+
+SignedDelivery = namedtuple('SignedDelivery', 'inbox headers')
+
+
+def sign_deliveries(private_key: str,
+                    key_id: str,
+                    body: Union[str, bytes],
+                    inboxes: Iterable[str],
+                    headers: dict = None) -> List[SignedDelivery]:
+    """Signs one request body for delivery to many inboxes at once. Returns
+    a list of SignedDelivery tuples holding the inbox url and the complete
+    set of headers (host, date, digest, signature and anything passed in)
+    to POST with.
+
+    When a post goes out to hundreds of inboxes, only the (request-target)
+    and host lines of the signing string actually change, so the body
+    digest, the date and the imported key are all worked out exactly once.
+
+    private_key - the private key from an rsa or ed25519 key pair
+    key_id - the lookup for the key to validate
+    body - the request body that will be POSTed to every inbox
+    inboxes - a list of absolute inbox urls
+    headers - extra headers to sign and send (a date is added if missing)
+    """
+    shared_headers = {}
+    if headers:
+        shared_headers.update({k.lower(): v for k, v in headers.items()})
+    shared_headers.setdefault('date', formatdate(usegmt=True))
+    shared_headers['digest'] = digest_header(body)
+
+    # Everything after the host line is the same for every recipient
+    shared_text = ''.join(
+        [f'\n{k}: {v}' for k, v in shared_headers.items() if k != 'host'])
+    signed_header_keys = ['(request-target)', 'host'] + [
+        k for k in shared_headers if k != 'host'
+    ]
+
+    algorithm, signer = _signer(KEY_CACHE.import_key(private_key, key_id))
+
+    deliveries = []
+    for inbox in inboxes:
+        parsed_inbox = urlparse(inbox)
+        target = parsed_inbox.path or '/'
+        if parsed_inbox.query:
+            target = f'{target}?{parsed_inbox.query}'
 
+        signed_header_text = (f'(request-target): post {target}\n'
+                              f'host: {parsed_inbox.netloc}{shared_text}')
+        raw_signature = signer(signed_header_text.encode('ascii'))
 
-def verify(public_key: str, headers: dict, method: str, path: str,
-           body: str) -> bool:
+        delivery_headers = shared_headers.copy()
+        delivery_headers['host'] = parsed_inbox.netloc
+        delivery_headers['signature'] = _format_signature_header(
+            key_id, algorithm, signed_header_keys, raw_signature)
+        deliveries.append(SignedDelivery(inbox, delivery_headers))
+
+    return deliveries
+
+
+def verify(public_key: str,
+           headers: dict,
+           method: str,
+           path: str,
+           body: Union[str, bytes] = None,
+           body_digest: str = None) -> bool:
     """Returns true or false depending on if the key that we plugged in here
     validates against the headers, method, and path.
 
-    publiuc_key - the public key from an rsa key pair
+    publiuc_key - the public key from an rsa or ed25519 key pair (a PEM or
+        a publicKeyMultibase value)
     headers - should be a dictionary of request headers
     method - the method that was used to make the request
     path - the relative url that was requested from this site
-    body - the received request body (used for digest)
+    body - the received request body (used for digest), as str or bytes
+    body_digest - the digest header value for a body that was already
+        hashed (see read_body), used instead of body when given
 
     I'm kind of starting to enjoy this. It's a pity the crypto portion
     of this should be coming to an end soon. Actually, no, no it isn't.
     """
-    # Import the key
-    public_key = RSA.import_key(public_key)
     # Build a dictionary of the signature values
-    signature_header = headers['signature']
-    signature_dict = {
-        k: v[1:-1]
-        for k, v in [i.split('=', 1) for i in signature_header.split(',')]
-    }
+    signature_dict = parse_signature_header(headers['signature'])
+    key_id = signature_dict.get('keyId')
+    signed_header_keys = signature_dict['headers'].split(' ')
 
     # Unpack the signed headers and set values based on current headers and
     # body (if a digest was included)
     signed_header_list = []
-    for signed_header in signature_dict['headers'].split(' '):
+    for signed_header in signed_header_keys:
         if signed_header == '(request-target)':
             signed_header_list.append(
                 f'(request-target): {method.lower()} {path}')
         elif signed_header == 'digest':
-            body_digest = base64.b64encode(SHA256.new(body.encode()).digest())
-            signed_header_list.append(f'digest: SHA-256={body_digest}')
+            if body_digest is None:
+                body_digest = digest_header(body)
+            # The signing string has to use the digest header exactly as it
+            # was sent, and that header has to agree with the body.
+            received_digest = headers.get('digest', body_digest)
+            if not digest_matches(received_digest, body_digest):
+                return False
+            signed_header_list.append(f'digest: {received_digest}')
         else:
             signed_header_list.append(
                 f'{signed_header}: {headers[signed_header]}')
 
-    # Now we have our header data digest
-    signed_header_text = '\n'.join(signed_header_list)
-    header_digest = SHA256.new(signed_header_text.encode('ascii'))
+    # Now we have our header data
+    signed_header_text = '\n'.join(signed_header_list).encode('ascii')
+
+    # A missing algorithm is treated as hs2019 (i.e. it depends on the key)
+    algorithm = signature_dict.get('algorithm', 'hs2019').lower()
+
+    # Have we seen this exact request (and key, and algorithm) recently?
+    fingerprint = key_fingerprint(public_key)
+    cache_ttl = VERIFIED_CACHE.ttl_for(headers, signed_header_keys)
+    if cache_ttl is not None:
+        cache_key = (key_id, fingerprint, algorithm,
+                     signature_dict['signature'],
+                     hashlib.sha256(signed_header_text).digest())
+        result = VERIFIED_CACHE.get(cache_key)
+        if result is not None:
+            return result
+
+    # Import the key (or reuse the one we imported last time)
+    public_key = KEY_CACHE.import_key(public_key, key_id, fingerprint)
+    # Work out how to check the signature, if we can at all
+    verifier = _verifier(public_key, algorithm)
 
     # Get the signature, verify with public key, return result
     signature = base64.b64decode(signature_dict['signature'])
 
-    try:
-        pkcs1_15.new(public_key).verify(header_digest, signature)
-        return True
-    except (ValueError, TypeError):
-        return False
-
-    # TODO: Uh, what other algorithms are used in the wild? Mastodon
-    # uses rsa-sha256 but it isn't the only thing out there.
-    # I guess we'll find out soon.
+    result = False
+    if verifier is not None:
+        try:
+            verifier(signed_header_text, signature)
+            result = True
+        except (ValueError, TypeError):
+            result = False
+
+    if cache_ttl is not None:
+        VERIFIED_CACHE.set(cache_key, result, cache_ttl)
+    return result
+
+
+def _verify_batch(requests: List[tuple]) -> List[bool]:
+    """Verifies a chunk of (public_key, headers, method, path, body) tuples
+    in one go. This runs inside of an executor, so a process pool only has
+    to pickle one job per chunk instead of one per signature.
+    """
+    return [verify(*request) for request in requests]
+
+
+class SignaturePool:
+    """Runs signing and verification work on an executor so that the event
+    loop is never blocked by RSA.
+
+    Pluggable into any starlette app, just like lamia.utilities.email.Email.
+    Until the app starts (or if no app is registered), work is sent to the
+    event loop's default executor.
+
+    Adds the following configuration settings:
+
+    HTTPSIG_EXECUTOR: Either thread or process. Defaults to thread, since
+        pycryptodome releases the GIL for most of the heavy lifting.
+
+    HTTPSIG_WORKER_COUNT: Number of workers in the pool. Defaults to the
+        executor's own default (based on the cpu count).
+    """
+
+    def init_app(self, app: Starlette, config: Config) -> None:
+        """Register the starlette app with the signature pool."""
+        self.config = config
+        app.add_event_handler('startup', self._startup)
+        app.add_event_handler('shutdown', self._shutdown)
+
+    def __init__(self, executor: Executor = None) -> None:
+        self.config = None
+        self.executor = executor
+        self.worker_count = None
+
+    async def _startup(self) -> None:
+        """Create the executor when the app starts."""
+        kind = self.config('HTTPSIG_EXECUTOR', cast=str, default='thread')
+        self.worker_count = self.config(
+            'HTTPSIG_WORKER_COUNT', cast=int, default=None)
+
+        if kind == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=self.worker_count)
+        elif kind == 'thread':
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.worker_count,
+                thread_name_prefix='lamia-httpsigs')
+        else:
+            sys.exit("Configuration failure:\n"
+                     "HTTPSIG_EXECUTOR must be either thread or process.")
+
+    async def _shutdown(self) -> None:
+        """Wait for any outstanding signing work and close the executor."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def run(self, func: Callable, *args) -> Any:
+        """Run func(*args) on the executor and wait for the result."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    async def verify_many(self, requests: Iterable[tuple]) -> List[bool]:
+        """Verifies a batch of (public_key, headers, method, path, body)
+        tuples in parallel. Results are returned in the same order.
+        """
+        requests = list(requests)
+        if not requests:
+            return []
+
+        # One chunk per worker keeps every core busy without paying for a
+        # round trip to the pool for each and every signature.
+        chunk_count = min(len(requests), self.worker_count or 4)
+        chunk_size = -(-len(requests) // chunk_count)
+        chunks = [
+            requests[i:i + chunk_size]
+            for i in range(0, len(requests), chunk_size)
+        ]
+
+        results = await asyncio.gather(
+            *[self.run(_verify_batch, chunk) for chunk in chunks])
+        return [result for chunk in results for result in chunk]
+
+
+POOL = SignaturePool()
+
+
+async def sign_async(private_key: str, key_id: str, headers: dict,
+                     path: str) -> str:
+    """The same as sign, but the work happens on POOL's executor."""
+    return await POOL.run(sign, private_key, key_id, headers, path)
+
+
+async def verify_async(public_key: str,
+                       headers: dict,
+                       method: str,
+                       path: str,
+                       body: Union[str, bytes] = None,
+                       body_digest: str = None) -> bool:
+    """The same as verify, but the work happens on POOL's executor."""
+    return await POOL.run(verify, public_key, headers, method, path, body,
+                          body_digest)
+
+
+async def verify_many_async(requests: Iterable[tuple]) -> List[bool]:
+    """Verifies a batch of (public_key, headers, method, path, body) tuples,
+    spread across POOL's workers. Handy for draining an inbox.
+    """
+    return await POOL.verify_many(requests)
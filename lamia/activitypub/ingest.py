@@ -0,0 +1,130 @@
+"""Bulk ingest of activitypub documents into the database.
+
+Creating models one at a time (schema.to_model() followed by create()) costs
+a round trip to the database for every row, which adds up fast during a
+backfill or when a busy inbox is catching up. ingest() instead writes a
+whole batch of validated schemas with one multi-row
+
+INSERT ... ON CONFLICT (uri) DO UPDATE ... RETURNING id
+
+statement per table, so things we've already seen are refreshed in place
+rather than duplicated, and hands back the row ids.
+
+Usage:
+
+report = validate_many(documents, ObjectSchema)
+schemas = ObjectSchema.many_from_validated(
+    itertools.compress(documents, report.results))
+ids = await ingest(schemas)
+"""
+from typing import Iterable, List
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+
+from lamia.activitypub.schema import Schema
+from lamia.activitypub.schema import ActivitySchema, ObjectSchema, ActorSchema
+from lamia.database import db
+from lamia.models.activitypub import Actor, Object, Activity
+from lamia.stats import SITE_STATS
+from lamia.timelines import HOME_TIMELINES
+
+# The most rows to put into a single statement (postgres allows 32767
+# parameters per statement, and each row takes up to 8)
+INGEST_BATCH_SIZE = 1000
+
+# schema class -> (model, columns to refresh when the row already exists)
+INGEST_MODELS = {
+    ActivitySchema: (Activity, ('object_uri', 'actor_uri', 'activity_type',
+                                'data')),
+    ObjectSchema: (Object, ('actor_uri', 'reply_to_uri', 'object_type',
+                            'last_updated', 'data')),
+    ActorSchema: (Actor, ('actor_type', 'display_name', 'user_name',
+                          'last_updated', 'data')),
+}
+
+
+def upsert_statement(schema_cls: type, rows: List[dict]):
+    """Returns the insert statement for a batch of rows from one schema
+    class, returning the id and uri of each row written, and whether it was
+    inserted rather than updated (postgres leaves xmax at 0 on rows that an
+    upsert inserts).
+
+    Remote documents never overwrite local actors, so conflicting rows for
+    local actors aren't updated (and don't come back in the results).
+    """
+    model, update_columns = INGEST_MODELS[schema_cls]
+    table = model.__table__
+
+    statement = insert(table).values(rows)
+    where = None
+    if model is Actor:
+        where = table.c.local.isnot(True)
+
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.uri],
+        set_={column: statement.excluded[column]
+              for column in update_columns},
+        where=where,
+    ).returning(table.c.id, table.c.uri,
+                sa.literal_column('(xmax = 0)', sa.Boolean).label('inserted'))
+
+
+def ingest_rows(schemas: Iterable[Schema]) -> dict:
+    """Groups schemas by schema class into {schema class: {uri: row}}.
+
+    A uri that shows up more than once keeps its last row, since a single
+    upsert can't touch the same row twice.
+    """
+    batches = {}
+    for schema in schemas:
+        schema_cls = type(schema)
+        if schema_cls not in INGEST_MODELS:
+            raise ValueError(f'{schema_cls.__name__} can not be ingested')
+        batches.setdefault(schema_cls, {})[schema.id] = schema.to_row()
+    return batches
+
+
+def _chunks(rows: List[dict], size: int) -> Iterable[List[dict]]:
+    """Splits rows into lists of at most size rows."""
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+async def ingest(schemas: Iterable[Schema],
+                 batch_size: int = INGEST_BATCH_SIZE) -> List[int]:
+    """Writes a batch of validated activity, object and actor schemas to the
+    database in one transaction, with one statement per table (per
+    batch_size rows). Returns the row ids in the same order as the schemas,
+    with None for any that weren't written (i.e. local actors).
+
+    Objects are fanned out into home timelines as part of the same
+    transaction (or, for timelines that aren't kept in the database, once
+    it commits), and newly inserted ones are counted in the site statistics
+    once it commits.
+    """
+    schemas = list(schemas)
+    ids = {}
+    created_by = []
+    transactional = HOME_TIMELINES.store.transactional
+
+    async with db.transaction():
+        for schema_cls, rows in ingest_rows(schemas).items():
+            for chunk in _chunks(list(rows.values()), batch_size):
+                written = await db.all(upsert_statement(schema_cls, chunk))
+                for row_id, uri, inserted in written:
+                    ids[(schema_cls, uri)] = row_id
+                    if inserted and schema_cls is ObjectSchema:
+                        created_by.append(rows[uri]['actor_uri'])
+
+        object_ids = [
+            row_id for (schema_cls, _), row_id in ids.items()
+            if schema_cls is ObjectSchema
+        ]
+        if transactional:
+            await HOME_TIMELINES.fan_out(object_ids)
+
+    if not transactional:
+        await HOME_TIMELINES.fan_out(object_ids)
+    SITE_STATS.objects_created(created_by)
+    return [ids.get((type(schema), schema.id)) for schema in schemas]
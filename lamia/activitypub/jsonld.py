@@ -0,0 +1,347 @@
+"""Offline JSON-LD context handling.
+
+Every activitypub document carries an @context, and almost all of them point
+at the same two or three remote documents (the activitystreams and security
+vocabularies). A JSON-LD processor would normally fetch those over the
+network, which is slow, flaky, and hands remote servers a way to make us do
+I/O for every activity they send.
+
+Instead, the well known contexts are bundled in lamia/activitypub/contexts
+and served by CONTEXT_STORE, and resolved contexts are memoised, so a
+context that's been seen before is turned into term definitions exactly
+once. Nothing in this module ever touches the network; remote contexts that
+aren't bundled are skipped (and noted on the resolved context) rather than
+fetched.
+
+Usage:
+
+context = resolve_context(document['@context'])
+context.expand('Note')  # 'https://www.w3.org/ns/activitystreams#Note'
+expand_iri(LAMIA_CONTEXT, 'publicKeyMultibase')
+
+document_loader has the same shape as a pyld document loader, for handing to
+a full JSON-LD processor.
+"""
+import os
+from typing import Any
+
+import ujson as json
+
+from lamia.activitypub.context import LAMIA_CONTEXT
+from lamia.logging import logging
+from lamia.utilities.lru import LRUCache
+
+LOGGER = logging.getLogger('lamia')
+
+CONTEXTS_PATH = os.path.join(os.path.dirname(__file__), 'contexts')
+
+# Maps remote context urls to the bundled copy in CONTEXTS_PATH
+BUNDLED_CONTEXTS = {
+    'https://www.w3.org/ns/activitystreams': 'activitystreams.jsonld',
+    'https://w3id.org/security/v1': 'security-v1.jsonld',
+    # (what LAMIA_CONTEXT and a few other implementations refer to)
+    'https://w3id.org/security/': 'security-v1.jsonld',
+}
+
+# The number of distinct resolved contexts to remember
+CONTEXT_CACHE_SIZE = 256
+# The number of expanded terms that each resolved context remembers
+EXPANSION_CACHE_SIZE = 1024
+
+
+class ContextNotFoundException(Exception):
+    """Raised when a context url isn't in the context store. We don't fetch
+    remote contexts, so this is the end of the line.
+    """
+
+
+def _normalize_url(url: str) -> str:
+    """Strips the bits of a context url that don't change the document."""
+    url = url.split('#', 1)[0]
+    if url.startswith('http://'):
+        url = 'https://' + url[len('http://'):]
+    return url
+
+
+class ContextStore:
+    """An offline store of remote context documents, keyed by url.
+
+    The bundled documents are read from disk the first time they're asked
+    for, and others can be registered (by an admin command, or a test).
+    """
+
+    def __init__(self, bundled: dict = None,
+                 path: str = CONTEXTS_PATH) -> None:
+        self.path = path
+        self.bundled = dict(BUNDLED_CONTEXTS if bundled is None else bundled)
+        self._documents = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, url: str, document: dict) -> None:
+        """Adds (or replaces) a context document."""
+        self._documents[_normalize_url(url)] = document
+
+    def get(self, url: str) -> dict:
+        """Returns the document for a context url, raising
+        ContextNotFoundException if we don't have one.
+        """
+        url = _normalize_url(url)
+        document = self._documents.get(url)
+        if document is None:
+            file_name = self.bundled.get(url)
+            if file_name is None:
+                file_name = self.bundled.get(url.rstrip('/'))
+            if file_name is None:
+                self.misses += 1
+                raise ContextNotFoundException(url)
+
+            with open(os.path.join(self.path, file_name), 'rb') as file:
+                document = json.loads(file.read())
+            self._documents[url] = document
+
+        self.hits += 1
+        return document
+
+    def __contains__(self, url: str) -> bool:
+        url = _normalize_url(url)
+        return (url in self._documents or url in self.bundled
+                or url.rstrip('/') in self.bundled)
+
+    def stats(self) -> dict:
+        """Returns a dictionary of counters for metrics and debugging."""
+        return {
+            'loaded': len(self._documents),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+CONTEXT_STORE = ContextStore()
+
+
+def document_loader(url: str, options: dict = None) -> dict:  # pylint: disable=unused-argument
+    """A pyld shaped document loader that only ever answers from the
+    context store.
+    """
+    return {
+        'contextUrl': None,
+        'documentUrl': url,
+        'document': CONTEXT_STORE.get(url),
+    }
+
+
+class ActiveContext:
+    """The term definitions that a resolved @context boils down to.
+
+    terms - maps each term to its definition, a dict with an expanded '@id'
+        (and '@type' or '@container' if the context gave them)
+    vocab - the expanded @vocab, if any
+    unresolved - remote context urls that weren't in the context store
+    """
+    __slots__ = ('terms', 'vocab', 'unresolved', '_expanded')
+
+    def __init__(self) -> None:
+        self.terms = {}
+        self.vocab = None
+        self.unresolved = ()
+        # (bounded, since remote documents can use any terms they like)
+        self._expanded = LRUCache(max_size=EXPANSION_CACHE_SIZE)
+
+    def copy(self) -> 'ActiveContext':
+        """Returns a copy to build a further context on top of."""
+        active = ActiveContext()
+        active.terms = dict(self.terms)
+        active.vocab = self.vocab
+        active.unresolved = self.unresolved
+        return active
+
+    def _expand_value(self, value: str, pending: dict = None) -> str:
+        """Expands a term or compact IRI using the terms defined so far
+        (and any raw, not yet expanded, definitions in pending).
+        """
+        if value.startswith('@') or value.startswith('_:'):
+            return value
+
+        # Definitions from the context being applied win over older ones
+        if pending and value in pending:
+            return self._expand_value(_raw_id(value, pending[value]))
+        definition = self.terms.get(value)
+        if definition is not None:
+            return definition['@id']
+
+        prefix, colon, suffix = value.partition(':')
+        if colon and not suffix.startswith('//'):
+            if pending and prefix in pending:
+                return self._expand_value(_raw_id(prefix,
+                                                  pending[prefix])) + suffix
+            definition = self.terms.get(prefix)
+            if definition is not None:
+                return definition['@id'] + suffix
+        return value
+
+    def define(self, local_context: dict) -> None:
+        """Applies a local (object) context on top of this one."""
+        pending = {
+            term: value
+            for term, value in local_context.items()
+            if not term.startswith('@')
+        }
+
+        if '@vocab' in local_context:
+            vocab = local_context['@vocab']
+            self.vocab = None if vocab is None else self._expand_value(
+                vocab, pending)
+
+        for term, value in pending.items():
+            if value is None:
+                self.terms.pop(term, None)
+                continue
+
+            if isinstance(value, str):
+                definition = {'@id': self._expand_value(value, pending)}
+            elif isinstance(value, dict):
+                definition = {
+                    key: value[key]
+                    for key in ('@type', '@container', '@reverse')
+                    if key in value
+                }
+                definition['@id'] = self._expand_value(
+                    _raw_id(term, value), pending)
+                if isinstance(definition.get('@type'), str):
+                    definition['@type'] = self._expand_value(
+                        definition['@type'], pending)
+            else:
+                continue
+
+            self.terms[term] = definition
+
+        self._expanded.clear()
+
+    def expand(self, value: str) -> str:
+        """Expands a term, compact IRI or type name to a full IRI. Values
+        that don't match anything fall back to @vocab, if there is one.
+        """
+        expanded = self._expanded.get(value)
+        if expanded is not None:
+            return expanded
+
+        expanded = self._expand_value(value)
+        if (expanded == value and self.vocab is not None
+                and ':' not in value and not value.startswith('@')):
+            expanded = self.vocab + value
+
+        self._expanded.set(value, expanded)
+        return expanded
+
+    def definition(self, term: str) -> dict:
+        """Returns a term's definition, or None."""
+        return self.terms.get(term)
+
+
+def _raw_id(term: str, value: Any) -> str:
+    """Returns the unexpanded @id of a raw term definition."""
+    if isinstance(value, dict):
+        return value.get('@id', term)
+    if isinstance(value, str):
+        return value
+    return term
+
+
+class ContextResolver:
+    """Resolves @context values into ActiveContexts, remembering each one so
+    repeated contexts (which is nearly all of them) are resolved only once.
+
+    Contexts are keyed by their identity: urls by themselves, and lists or
+    dictionaries by their encoded form (or, for the exact same object seen
+    again, like LAMIA_CONTEXT, by the object itself).
+    """
+
+    def __init__(self, store: ContextStore = None,
+                 max_size: int = CONTEXT_CACHE_SIZE) -> None:
+        self.store = CONTEXT_STORE if store is None else store
+        self._cache = LRUCache(max_size=max_size)
+        # Maps id(context) -> (context, key), for contexts we hold onto
+        self._keys = {}
+
+    def _key(self, context: Any) -> Any:
+        """Returns the cache key for a context value."""
+        if context is None or isinstance(context, str):
+            return context
+
+        known = self._keys.get(id(context))
+        if known is not None and known[0] is context:
+            return known[1]
+        return json.dumps(context, sort_keys=True)
+
+    def remember(self, context: Any) -> None:
+        """Keys a long lived context object (one that won't change) by its
+        identity, so that resolving it skips encoding it.
+        """
+        self._keys[id(context)] = (context, json.dumps(context, sort_keys=True))
+
+    def resolve(self, context: Any) -> ActiveContext:
+        """Returns the ActiveContext for an @context value."""
+        key = self._key(context)
+        active = self._cache.get(key)
+        if active is None:
+            active = self._resolve(ActiveContext(), context, ())
+            self._cache.set(key, active)
+        return active
+
+    def _resolve(self, active: ActiveContext, context: Any,
+                 seen: tuple) -> ActiveContext:
+        """Builds an ActiveContext on top of active. seen holds the urls
+        already being resolved, so a context can't include itself.
+        """
+        if context is None:
+            return ActiveContext()
+
+        if isinstance(context, list):
+            for item in context:
+                active = self._resolve(active, item, seen)
+            return active
+
+        if isinstance(context, str):
+            url = _normalize_url(context)
+            if url in seen:
+                return active
+            try:
+                document = self.store.get(url)
+            except ContextNotFoundException:
+                LOGGER.debug(f'skipping unknown context {url}')
+                active = active.copy()
+                active.unresolved += (url, )
+                return active
+            return self._resolve(active, document.get('@context'),
+                                 seen + (url, ))
+
+        if isinstance(context, dict):
+            active = active.copy()
+            active.define(context)
+            return active
+
+        return active
+
+    def clear(self) -> None:
+        """Forgets every resolved context."""
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        """Returns a dictionary of counters for metrics and debugging."""
+        return self._cache.stats()
+
+
+CONTEXT_RESOLVER = ContextResolver()
+CONTEXT_RESOLVER.remember(LAMIA_CONTEXT)
+
+
+def resolve_context(context: Any) -> ActiveContext:
+    """Returns the (memoised) ActiveContext for an @context value."""
+    return CONTEXT_RESOLVER.resolve(context)
+
+
+def expand_iri(context: Any, value: str) -> str:
+    """Expands a term or compact IRI against an @context value."""
+    return CONTEXT_RESOLVER.resolve(context).expand(value)
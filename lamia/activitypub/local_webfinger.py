@@ -0,0 +1,129 @@
+"""The local side of webfinger: answering remote servers about our own
+users.
+
+LOCAL_WEBFINGER is an in-memory index of local user names to prebuilt JRD
+documents, so that the webfinger endpoint never has to ask the database
+anything once it has warmed up. (It lives apart from the webfinger client
+in lamia.activitypub.webfinger, which has no business with the database.)
+"""
+import asyncio
+from urllib.parse import urlparse
+
+import ujson as json
+
+from lamia.config import BASE_URL
+from lamia.models.features import Identity
+
+
+class LocalWebfingerIndex:
+    """An index of local user names to prebuilt JRD documents (as bytes).
+
+    The index is loaded from the identities table on first use (or by
+    calling load), and kept up to date by calling add when an identity is
+    created and remove when one goes away.
+
+    User names are matched case-sensitively, the same as /u/<name> and the
+    identities table's unique index (only the host is case-insensitive), so
+    that two users whose names differ only by case each get their own
+    document.
+
+    Every change bumps the index's generation, so that a load can tell
+    when the index changed while it was reading the table (and what it read
+    may already be out of date).
+    """
+
+    def __init__(self, base_url: str = BASE_URL) -> None:
+        self.base_url = base_url
+        self.host = urlparse(base_url).netloc.lower()
+        self.documents = {}
+        self.loaded = False
+        self.generation = 0
+        self._lock = asyncio.Lock()
+
+    def build_document(self, user_name: str) -> bytes:
+        """Returns the encoded JRD document for a local user name."""
+        actor_uri = f'{self.base_url}/u/{user_name}'
+        document = {
+            'subject': f'acct:{user_name}@{self.host}',
+            'aliases': [actor_uri],
+            'links': [{
+                'rel': 'self',
+                'type': 'application/activity+json',
+                'href': actor_uri,
+            }, {
+                'rel': 'http://webfinger.net/rel/profile-page',
+                'type': 'text/html',
+                'href': actor_uri,
+            }],
+        }
+        return json.dumps(document, escape_forward_slashes=False).encode()
+
+    def add(self, user_name: str) -> None:
+        """Add (or rebuild) the document for a local user name."""
+        self.documents[user_name] = self.build_document(user_name)
+        self.generation += 1
+
+    def remove(self, user_name: str) -> None:
+        """Stop answering for a local user name."""
+        self.documents.pop(user_name, None)
+        self.generation += 1
+
+    def invalidate(self) -> None:
+        """Throw the whole index away, it'll be reloaded on next use."""
+        self.documents = {}
+        self.loaded = False
+        self.generation += 1
+
+    async def load(self) -> None:
+        """Load every active local identity, in one query. If the index
+        changes while the query runs, what was read is thrown away and the
+        index is left to be loaded again on next use.
+        """
+        async with self._lock:
+            if self.loaded:
+                return
+
+            generation = self.generation
+            user_names = await Identity.select('user_name').where(
+                Identity.deleted.isnot(True)).gino.all()
+            if generation != self.generation:
+                return
+
+            self.documents = {
+                user_name: self.build_document(user_name)
+                for (user_name, ) in user_names
+            }
+            self.loaded = True
+
+    def user_name_for(self, resource: str) -> str:
+        """Works out which local user name a resource is asking about, or
+        None if it isn't one of ours.
+        """
+        if resource.startswith(f'{self.base_url}/u/'):
+            return resource[len(self.base_url) + 3:].strip('/')
+
+        if resource.startswith('acct:'):
+            resource = resource[5:]
+        user_name, _, host = resource.rpartition('@')
+        if user_name and host.lower() == self.host:
+            return user_name.lstrip('@')
+
+        return None
+
+    def get(self, resource: str) -> bytes:
+        """Returns the JRD document for a resource, or None. Doesn't load
+        the index.
+        """
+        user_name = self.user_name_for(resource)
+        if user_name is None:
+            return None
+        return self.documents.get(user_name)
+
+    async def lookup(self, resource: str) -> bytes:
+        """Returns the JRD document for a resource, or None."""
+        if not self.loaded:
+            await self.load()
+        return self.get(resource)
+
+
+LOCAL_WEBFINGER = LocalWebfingerIndex()
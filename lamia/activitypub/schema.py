@@ -11,27 +11,102 @@ through the fediverse.
 
 Note: These classes speak JSON but they do so in the form of a Python
 dictionary.
+
+Validation runs off of the compiled form of each fieldset (see
+lamia.activitypub.fields.compile_fields), so checking a document is a
+single pass over a tuple of prebuilt checks. For bulk work, validate_many
+checks a whole batch of documents without logging anything per document.
+
+For responses and deliveries, to_json_ld_bytes and to_lamia_json_ld_bytes
+encode a schema straight to bytes, with lamia's context spliced in already
+encoded.
 """
-from typing import Any
-from collections import namedtuple
+from datetime import datetime
+from typing import Any, Iterable, Type
+from collections import Counter, namedtuple
 import pendulum
-from lamia.activitypub.fields import FIELD_TYPE, FIELD_REQUIRED, FIELD_VALIDATION
+import ujson as json
+from lamia.activitypub.fields import FIELD_REQUIRED
+from lamia.activitypub.fields import INVALID_DOCUMENT, INVALID_REQUIRED, INVALID_TYPE
+from lamia.activitypub.fields import get_compiled_fields
 from lamia.activitypub.fields import ACTIVTY_FIELDS, OBJECT_FIELDS, ACTOR_FIELDS
-from lamia.activitypub.context import LAMIA_CONTEXT
+from lamia.activitypub.context import LAMIA_CONTEXT, LAMIA_CONTEXT_MEMBER
 from lamia.models.activitypub import Actor, Object, Activity
 from lamia.logging import logging
 
 LOGGER = logging.getLogger('lamia')
 
 
+def log_invalid_field(field: str, reason: str) -> None:
+    """Logs a warning about a field that failed validation."""
+    if reason == INVALID_REQUIRED:
+        LOGGER.warning(f'required field {field} is not in schema')
+    elif reason == INVALID_TYPE:
+        LOGGER.warning(f'field {field} is not a valid type in schema')
+    else:
+        LOGGER.warning(f'field {field} failed validation in schema')
+
+
 class SchemaValidationException(Exception):
     """Schema validation exceptions are raised when a schema is badly formed
     in accordance with the given meta data..
     """
 
 
+def _field_property(name: str) -> property:
+    """Builds the property used to read and write one field of a schema's
+    representation. Writes are validated just like Schema.validate_field.
+    """
+
+    def getter(self):
+        return self.representation[name]
+
+    def setter(self, value):
+        if not self.validate_field(name, value):
+            raise SchemaValidationException(f'invalid value {value} for {name}')
+        self.representation[name] = value
+
+    return property(getter, setter, doc=f'The {name} field.')
+
+
 class Schema:
-    """The base class for all of our JSON schemata (what a lovely word)."""
+    """The base class for all of our JSON schemata (what a lovely word).
+
+    Schemata are slotted, so they carry no per instance __dict__, and
+    subclasses declare their fieldset as a class keyword:
+
+    class NoteSchema(Schema, fields=OBJECT_FIELDS):
+        __slots__ = ()
+
+    Every field in the fieldset becomes a property on the subclass, so
+    reads and validated writes skip __getattr__ and __setattr__'s slow path.
+    Fields that aren't in the fieldset still work through those.
+    """
+    __slots__ = ('fields', 'compiled', 'representation', 'db_id')
+
+    # The fieldset (and compiled fieldset) that subclasses validate against
+    FIELDS = None
+    COMPILED_FIELDS = None
+    # Names that __setattr__ hands straight to object.__setattr__
+    _DIRECT_ATTRIBUTES = frozenset(__slots__)
+
+    def __init_subclass__(cls, fields: dict = None, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        if fields is None:
+            return
+
+        cls.FIELDS = fields
+        cls.COMPILED_FIELDS = get_compiled_fields(fields)
+
+        direct = set(Schema.__slots__)
+        for name in fields:
+            # Leave alone anything that can't be an attribute, or that the
+            # class already uses for something else
+            if name.isidentifier() and not hasattr(cls, name):
+                setattr(cls, name, _field_property(name))
+            if isinstance(getattr(cls, name, None), property):
+                direct.add(name)
+        cls._DIRECT_ATTRIBUTES = frozenset(direct)
 
     def __setattr__(self, name: str, value: Any) -> None:
         """We overrride python's standard attribute setting method to provide
@@ -42,9 +117,9 @@ class Schema:
         validation of values that are being set.
         """
 
-        # Only fields and representation are set directly everything
+        # Slots and generated field properties are set directly, everything
         # else is assumed to be in the internal json ld representation.
-        if name in ('fields', 'representation', 'db_id'):
+        if name in self._DIRECT_ATTRIBUTES:
             object.__setattr__(self, name, value)
         else:
             if self.validate_field(name, value):
@@ -54,6 +129,11 @@ class Schema:
                     f'invalid value {value} for {name}')
 
     def __getattr__(self, name: str) -> Any:
+        # Unset slots and python's own dunder probing (copy, pickle, hasattr
+        # checks) shouldn't go looking in the representation, which might
+        # itself be an unset slot
+        if name in Schema._DIRECT_ATTRIBUTES or name.startswith('__'):
+            raise AttributeError(name)
         return self.representation[name]
 
     def __init__(self, json_to_load: dict, fields: dict = None) -> None:
@@ -64,7 +144,45 @@ class Schema:
         else:
             self.representation = {}
 
+        if fields is None:
+            fields = self.FIELDS
         self.fields = fields
+        if fields is None:
+            self.compiled = None
+        elif fields is self.FIELDS:
+            self.compiled = self.COMPILED_FIELDS
+        else:
+            self.compiled = get_compiled_fields(fields)
+
+    @classmethod
+    def from_validated(cls, json_to_load: dict) -> 'Schema':
+        """Wraps a document that has already been validated (by
+        validate_many, say) without running __init__ or any checks. The
+        document is used as is, not copied.
+
+        Only use this for data that really has been validated against this
+        class's fieldset.
+        """
+        schema = object.__new__(cls)
+        _set_representation(schema, json_to_load)
+        _set_fields(schema, cls.FIELDS)
+        _set_compiled(schema, cls.COMPILED_FIELDS)
+        return schema
+
+    @classmethod
+    def many_from_validated(cls, documents: Iterable[dict]) -> list:
+        """from_validated for a batch of documents, returning a list."""
+        new = object.__new__
+        fields = cls.FIELDS
+        compiled = cls.COMPILED_FIELDS
+        schemata = []
+        for document in documents:
+            schema = new(cls)
+            _set_representation(schema, document)
+            _set_fields(schema, fields)
+            _set_compiled(schema, compiled)
+            schemata.append(schema)
+        return schemata
 
     def load_json_ld(self, json_to_load: dict = None) -> None:
         """A convenience method for loading the internal dictionary.
@@ -86,6 +204,34 @@ class Schema:
         json_ld['@context'] = LAMIA_CONTEXT
         return json_ld
 
+    def to_json_ld_bytes(self) -> bytes:
+        """Returns the representation, as it is, encoded as JSON bytes."""
+        return encode_json_ld(self.representation)
+
+    def to_lamia_json_ld_bytes(self) -> bytes:
+        """Returns the same document as to_lamia_json_ld, encoded as JSON
+        bytes, without copying the representation or encoding the context.
+
+        The bytes are ready to be used as a response body, or to be passed to
+        httpsigs.sign_deliveries for every inbox of a delivery.
+        """
+        if '@context' in self.representation:
+            # Replacing an existing context does need the copy
+            return encode_json_ld(self.to_lamia_json_ld())
+
+        encoded = encode_json_ld(self.representation)
+        if encoded == b'{}':
+            return b'{' + LAMIA_CONTEXT_MEMBER + b'}'
+        return b''.join((b'{', LAMIA_CONTEXT_MEMBER, b',', encoded[1:]))
+
+    def _data(self) -> dict:
+        """Returns the document to store in a row's data column (with our
+        context, unless it came with its own).
+        """
+        if '@context' in self.representation:
+            return self.to_json_ld()
+        return self.to_lamia_json_ld()
+
     def validate_field(self, field: str, value_to_test: Any = None) -> bool:
         """If given a field name, this function verifies either the existing
         internal value or the given value_to_test.
@@ -94,59 +240,32 @@ class Schema:
         True return value is expected when a field doesn't exist yet and isn't
         required (because a non-existant field can't invalidate).
         """
-        # Does our internal representation contain this key
-        field_in_representation = field in self.representation
-
         # If this field is not part of our fields metadata, allow it
-        try:
-            meta = self.fields[field]
-        except KeyError:
+        check = self.compiled.checks.get(field)
+        if check is None:
             return True
 
         # If we are performing a theoretical test, don't expect the field
         # to have already been in the internal representation.
         if value_to_test is None:
-            # If we should have a field but we do not, then return false
-            if meta[FIELD_REQUIRED] and not field_in_representation:
-                LOGGER.warning(f'required field {field} is not in schema')
-                return False
-
-        # Set the local value to either the given value or the existing
-        # internal value.
-        if value_to_test is None:
-            # If we are validating a field that is in the fields metadata
-            # then set it if it exists, if it does not exist, then return
-            # true because it is not invalidating any tests if it doesn't
-            # exist.
             try:
                 local_value = self.representation[field]
             except KeyError:
+                # If we should have a field but we do not, then return false.
+                # Otherwise it's not invalidating anything by not existing.
+                if self.fields[field][FIELD_REQUIRED]:
+                    log_invalid_field(field, INVALID_REQUIRED)
+                    return False
                 return True
         else:
             local_value = value_to_test
 
-        # Is the local value a valid type? If not, return false
-        valid_type = False
-        type_idx = None
-        for i, _type in enumerate(meta[FIELD_TYPE]):
-            valid_type = isinstance(local_value, _type)
-
-            if valid_type:
-                type_idx = i
-                break
-
-        if not valid_type:
-            LOGGER.warning(f'field {field} is not a valid type in schema')
+        # Is the local value a valid type, and does it pass validation?
+        reason = check(local_value)
+        if reason is not None:
+            log_invalid_field(field, reason)
             return False
 
-        # Check the validation function associated with the type
-        validation_function = meta[FIELD_VALIDATION][type_idx]
-
-        if validation_function:
-            if not validation_function(local_value):
-                LOGGER.warning(f'field {field} failed validation in schema')
-                return False
-
         return True
 
     def validate(self) -> bool:
@@ -154,15 +273,104 @@ class Schema:
 
         Returns True if valid. Otherwise, returns False.
         """
-        for field in self.fields.keys():
-            if not self.validate_field(field):
-                return False
+        invalid = self.compiled.validate(self.representation)
+        if invalid is not None:
+            log_invalid_field(*invalid)
+            return False
 
         return True
 
 
-class ActivitySchema(Schema):
+def parse_datetime(value: str) -> datetime:
+    """Parses a timestamp from a document into the naive UTC datetime that
+    our timestamp columns hold.
+    """
+    return pendulum.parse(value).in_timezone('UTC').naive()
+
+
+def encode_json_ld(document: dict) -> bytes:
+    """Encodes a JSON-LD dictionary as bytes (urls keep their slashes)."""
+    return json.dumps(document, escape_forward_slashes=False).encode('utf-8')
+
+
+# The slot descriptors' setters, for the unchecked construction path
+_set_representation = Schema.representation.__set__
+_set_fields = Schema.fields.__set__
+_set_compiled = Schema.compiled.__set__
+
+# index - the position of the document in the batch
+# field - the first field that failed (None if the document wasn't a dict)
+# reason - one of the INVALID_* reasons from lamia.activitypub.fields
+ValidationError = namedtuple('ValidationError', 'index field reason')
+
+# results - a bytearray with a 1 for each valid document and a 0 for each
+#     invalid one, in order (itertools.compress can filter with it)
+# errors - a list of ValidationError tuples, one per invalid document
+# counts - a Counter of how many documents failed on each field
+ValidationReport = namedtuple('ValidationReport', 'results errors counts')
+
+
+def validate_many(documents: Iterable[dict],
+                  schema_cls: Type[Schema]) -> ValidationReport:
+    """Validates a batch (a list, or any other iterable) of JSON-LD
+    dictionaries against a schema class's fieldset.
+
+    Unlike Schema.validate, nothing is logged per document, which keeps a
+    flood of junk from turning into a flood of log writes. Log the report's
+    counts instead, if it's interesting.
+
+    Usage:
+
+    report = validate_many(documents, ObjectSchema)
+    good_documents = list(itertools.compress(documents, report.results))
+    """
+    validate = schema_cls.COMPILED_FIELDS.validate
+    results = bytearray()
+    errors = []
+    counts = Counter()
+
+    for index, document in enumerate(documents):
+        if isinstance(document, dict):
+            invalid = validate(document)
+        else:
+            invalid = (None, INVALID_DOCUMENT)
+
+        if invalid is None:
+            results.append(1)
+        else:
+            results.append(0)
+            errors.append(ValidationError(index, *invalid))
+            counts[invalid[0]] += 1
+
+    return ValidationReport(results, errors, counts)
+
+
+class ActivitySchema(Schema, fields=ACTIVTY_FIELDS):
     """A schema representing an activitypub activity."""
+    __slots__ = ()
+
+    def to_row(self) -> dict:
+        """Returns the column values for an activity row, as a dictionary.
+        This is what to_model fills its model with, and what bulk ingest
+        (lamia.activitypub.ingest) inserts.
+        """
+        representation = self.representation
+        row = {
+            'uri': self.id,
+            'actor_uri': self.actor,
+            'activity_type': self.type,
+            'created': parse_datetime(self.published),
+            'object_uri': None,
+            'data': self._data(),
+        }
+
+        _object = representation.get('object')
+        if isinstance(_object, str):
+            row['object_uri'] = _object
+        elif isinstance(_object, dict) and isinstance(_object.get('id'), str):
+            row['object_uri'] = _object['id']
+
+        return row
 
     def to_model(self) -> Activity:
         """A convenience method for quickly converting an activity schema into
@@ -173,26 +381,37 @@ class ActivitySchema(Schema):
         and should then have that data assigned directly to their data
         object to preserve the original database metadata.
         """
-        model = Activity()
-        model.uri = self.id
-        model.actor_uri = self.actor
-        model.activity_type = self.type
-        model.created = pendulum.parse(self.published)
-
-        if 'object' in self.representation and isinstance(self.object, str):
-            model.object_uri = self.object
-
-        if '@context' in self.representation:
-            model.data = self.to_json_ld()
-        else:
-            model.data = self.to_lamia_json_ld()
+        return Activity(**self.to_row())
 
     def __init__(self, json_to_load: dict = None) -> None:
-        super().__init__(fields=ACTIVTY_FIELDS, json_to_load=json_to_load)
+        super().__init__(json_to_load=json_to_load)
 
 
-class ObjectSchema(Schema):
+class ObjectSchema(Schema, fields=OBJECT_FIELDS):
     """A schema representing an activitypub object."""
+    __slots__ = ()
+
+    def to_row(self) -> dict:
+        """Returns the column values for an object row, as a dictionary."""
+        representation = self.representation
+        row = {
+            'uri': self.id,
+            'object_type': self.type,
+            'actor_uri': None,
+            'reply_to_uri': representation.get('inReplyTo'),
+            'created': parse_datetime(self.published),
+            'last_updated': pendulum.now('UTC').naive(),
+            'data': self._data(),
+        }
+
+        # attributedTo may be a list, and the first entry is the author
+        attributed_to = representation.get('attributedTo')
+        if isinstance(attributed_to, list):
+            attributed_to = attributed_to[0] if attributed_to else None
+        if isinstance(attributed_to, str):
+            row['actor_uri'] = attributed_to
+
+        return row
 
     def to_model(self) -> Object:
         """A convenience method for quickly converting an object schema into
@@ -203,28 +422,34 @@ class ObjectSchema(Schema):
         and should then have that data assigned directly to their data
         object to preserve the original database metadata.
         """
-        model = Object()
-        model.uri = self.id
-        model.object_type = self.type
-        model.created = pendulum.parse(self.published)
-        model.last_updated = pendulum.now()
-        if '@context' in self.representation:
-            model.data = self.to_json_ld()
-        else:
-            model.data = self.to_lamia_json_ld()
-
-        if 'inReplyTo' in self.representation:
-            model.reply_to_uri = self.inReplyTo
+        return Object(**self.to_row())
 
     def __init__(self, json_to_load: dict = None) -> None:
-        super().__init__(fields=OBJECT_FIELDS, json_to_load=json_to_load)
+        super().__init__(json_to_load=json_to_load)
 
 
 ActorProperty = namedtuple('ActorProperty', 'name value idx')
 
 
-class ActorSchema(Schema):
+class ActorSchema(Schema, fields=ACTOR_FIELDS):
     """A schema representing an activitypub actor."""
+    __slots__ = ()
+
+    def to_row(self) -> dict:
+        """Returns the column values for a (remote) actor row, as a
+        dictionary.
+        """
+        now = pendulum.now('UTC').naive()
+        return {
+            'uri': self.id,
+            'actor_type': self.type,
+            'user_name': self.name,
+            'display_name': self.representation.get('preferredUsername'),
+            'local': False,
+            'created': now,
+            'last_updated': now,
+            'data': self._data(),
+        }
 
     def to_model(self) -> Actor:
         """A convenience method for quickly converting an actor schema into
@@ -235,22 +460,7 @@ class ActorSchema(Schema):
         and should then have that data assigned directly to their data
         object to preserve the original database metadata.
         """
-        model = Actor()
-        if '@context' in self.representation:
-            model.data = self.to_json_ld()
-        else:
-            model.data = self.to_lamia_json_ld()
-        model.actor_type = self.type
-        model.user_name = self.name
-        model.uri = self.id
-        model.local = False
-        model.created = pendulum.now().naive()
-        model.last_updated = pendulum.now().naive()
-
-        if 'preferredUsername' in self.representation:
-            model.display_name = self.preferredUsername
-
-        return model
+        return Actor(**self.to_row())
 
     def add_actor_property(self, name: str = None, value: str = None) -> None:
         """A convenience method for adding a property to an actor."""
@@ -287,4 +497,4 @@ class ActorSchema(Schema):
         del self.representation['attachments'][idx]
 
     def __init__(self, json_to_load: dict = None) -> None:
-        super().__init__(fields=ACTOR_FIELDS, json_to_load=json_to_load)
+        super().__init__(json_to_load=json_to_load)
@@ -6,17 +6,61 @@ There's some useful discussion here about the intersection of
 webfinger and ActivityPub:
 https://github.com/w3c/activitypub/issues/194
 
+When a popular account gets mentioned, we'd otherwise ask the same server
+the same question dozens of times at once. finger() goes through
+FINGER_CACHE, which remembers answers for as long as the remote server's
+cache headers say it may (within limits), remembers 404s, timeouts and
+servers that can't be reached (or only answer with errors) for a shorter
+while, and makes concurrent lookups for one resource share a single
+request.
+
+finger_many() resolves a whole batch of identifiers (say, from an import)
+at once, without hammering any one server, and hands results back as soon as
+each one is ready.
+
+The other side of the conversation (answering remote servers about our own
+users) lives in lamia.activitypub.local_webfinger, so that this module
+doesn't need the database.
+
 TODO: tests for this using our own webfinger endpoints
 """
+import asyncio
 import re
+import time
+from collections import namedtuple, OrderedDict
+from email.utils import parsedate_to_datetime
+from itertools import zip_longest
 from urllib.parse import urlparse
-from typing import Tuple
-from aiohttp import ClientSession
+from typing import AsyncIterator, Iterable, Tuple
+
+import aiohttp
 import ujson as json
 
-from lamia.version import VERSION
+from lamia.federation import http_client
+from lamia.utilities.lru import LRUCache
 
 PORT_RE = re.compile(r'(\:\d+)')
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+# How many webfinger results to keep, and for how long (in seconds). The
+# remote server's cache headers win, but only within the min/max.
+FINGER_CACHE_SIZE = 4096
+FINGER_CACHE_TTL = 60 * 60
+FINGER_CACHE_MIN_TTL = 60
+FINGER_CACHE_MAX_TTL = 24 * 60 * 60
+# Missing accounts and unresponsive servers are remembered for less time
+FINGER_NEGATIVE_TTL = 5 * 60
+# How many lookups finger_many runs at once, in total and per remote server
+FINGER_MANY_CONCURRENCY = 32
+FINGER_MANY_PER_DOMAIN = 4
+
+FingerResult = namedtuple('FingerResult', 'identifier result error')
+
+
+class WebfingerException(Exception):
+    """Webfinger exceptions are raised when a resource can't be found, or
+    the remote server can't be reached or didn't answer in time.
+    """
 
 
 def normalize(identifier: str, allow_port: bool = False) -> Tuple[str, str]:
@@ -65,23 +109,203 @@ def normalize(identifier: str, allow_port: bool = False) -> Tuple[str, str]:
     )
 
 
-async def finger(identifier: str) -> dict:
-    """When provided with an id, returns the webfinger query for it
+def cache_ttl(headers: dict) -> float:
+    """Works out how long a response may be cached for from its
+    Cache-Control and Expires headers, clamped to our own limits.
+    """
+    cache_control = headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
 
-    https://tools.ietf.org/html/rfc7033"""
+    max_age = MAX_AGE_RE.search(cache_control)
+    if max_age:
+        ttl = int(max_age.group(1))
+    elif 'Expires' in headers:
+        try:
+            ttl = parsedate_to_datetime(
+                headers['Expires']).timestamp() - time.time()
+        except (TypeError, ValueError):
+            ttl = 0
+    else:
+        ttl = FINGER_CACHE_TTL
+
+    return min(max(ttl, FINGER_CACHE_MIN_TTL), FINGER_CACHE_MAX_TTL)
+
+
+async def _fetch(uid: str, url: str) -> Tuple[dict, float]:
+    """Asks a remote server about a resource. Returns a tuple of the JRD
+    document and how long it may be cached for.
+
+    Raises WebfingerException for missing resources, timeouts, servers that
+    can't be reached and error responses.
+    """
     headers = {
         # We aren't going to be accepting anything other than json
         'Accept': 'q=2, application/jrd+json; q=1, application/json',
-        # Gotta be a good neighbor
-        'User-Agent': f'Lamia/{VERSION}',
     }
-
-    uid, url = normalize(identifier)
     params = {'resource': uid}
     url = url + "/.well-known/webfinger"
 
-    # ref: https://docs.aiohttp.org/en/stable/client_reference.html
-    async with ClientSession() as async_session:
-        async with async_session.get(
-                url, headers=headers, params=params) as response:
-            return await json.loads(response.read())
+    try:
+        # The shared client pools connections and adds our User-Agent
+        async with await http_client.request(
+                'GET', url, headers=headers, params=params) as response:
+            if response.status in (404, 410):
+                raise WebfingerException(f'{uid} was not found')
+            response.raise_for_status()
+            return (json.loads(await response.read()),
+                    cache_ttl(response.headers))
+    except asyncio.TimeoutError as exception:
+        raise WebfingerException(
+            f'{url} did not respond in time') from exception
+    except aiohttp.ClientError as exception:
+        # Failed DNS lookups, refused connections and TLS errors, along with
+        # 5xx (or any other error) responses
+        raise WebfingerException(
+            f'{url} could not be fingered: {exception}') from exception
+
+
+class WebfingerCache:
+    """Remembers webfinger results (and failures) by normalized resource,
+    and coalesces concurrent lookups for the same resource.
+    """
+
+    def __init__(self, max_size: int = FINGER_CACHE_SIZE) -> None:
+        self.results = LRUCache(max_size=max_size)
+        self.in_flight = {}
+        self.negative_hits = 0
+        self.coalesced = 0
+
+    async def _fetch_and_store(self, uid: str, url: str) -> dict:
+        """Fetch a resource and remember the result, good or bad."""
+        try:
+            result, ttl = await _fetch(uid, url)
+        except WebfingerException as exception:
+            self.results.set(uid, exception, ttl=FINGER_NEGATIVE_TTL)
+            raise
+
+        if ttl:
+            self.results.set(uid, result, ttl=ttl)
+        return result
+
+    async def get(self, uid: str, url: str) -> dict:
+        """Returns the (shared, so please don't modify it) webfinger result
+        for a normalized resource, going to the network only when needed.
+        """
+        result = self.results.get(uid)
+        if isinstance(result, WebfingerException):
+            self.negative_hits += 1
+            # A fresh exception, so tracebacks don't pile up on the cached one
+            raise WebfingerException(*result.args)
+        if result is not None:
+            return result
+
+        task = self.in_flight.get(uid)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(uid, url))
+            self.in_flight[uid] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(uid, None))
+        else:
+            self.coalesced += 1
+
+        # Shielded, so that one impatient caller can't cancel everyone's
+        # lookup
+        return await asyncio.shield(task)
+
+    def invalidate(self, identifier: str) -> bool:
+        """Forget whatever we know about an identifier."""
+        return self.results.invalidate(normalize(identifier)[0])
+
+    def clear(self) -> None:
+        """Forget everything."""
+        self.results.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss counters for the webfinger cache."""
+        stats = self.results.stats()
+        stats['negative_hits'] = self.negative_hits
+        stats['coalesced'] = self.coalesced
+        stats['in_flight'] = len(self.in_flight)
+        return stats
+
+
+FINGER_CACHE = WebfingerCache()
+
+
+async def finger(identifier: str) -> dict:
+    """When provided with an id, returns the webfinger query for it
+
+    Raises WebfingerException if the resource doesn't exist or the server
+    can't be reached or doesn't answer in time (and keeps raising it for a
+    little while).
+
+    https://tools.ietf.org/html/rfc7033"""
+    uid, url = normalize(identifier)
+    return await FINGER_CACHE.get(uid, url)
+
+
+async def finger_many(identifiers: Iterable[str],
+                      concurrency: int = FINGER_MANY_CONCURRENCY,
+                      per_domain: int = FINGER_MANY_PER_DOMAIN
+                      ) -> AsyncIterator[FingerResult]:
+    """Resolves a batch of identifiers, yielding FingerResult tuples of
+    (identifier, result, error) in whatever order they finish. A failure
+    for one identifier is reported in its error and never stops the batch.
+
+    At most concurrency lookups run at once, and at most per_domain of
+    those go to any one server. Breaking out of the loop early cancels
+    whatever hasn't finished yet.
+
+    Usage:
+
+    async for found in finger_many(['lamia@lamia.social', ...]):
+        if found.error is None:
+            ...
+    """
+    # Group identifiers by server, then interleave the groups so that a
+    # long run of one busy server doesn't hold up everyone else
+    by_domain = OrderedDict()
+    results = asyncio.Queue()
+    for identifier in identifiers:
+        try:
+            domain = normalize(identifier)[1]
+        except Exception as exception:  # pylint: disable=broad-except
+            # (reported like any other failure, rather than ending the batch)
+            results.put_nowait(FingerResult(identifier, None, exception))
+            continue
+        by_domain.setdefault(domain, []).append(identifier)
+    malformed = results.qsize()
+    queues = [[(domain, identifier) for identifier in group]
+              for domain, group in by_domain.items()]
+    ordered = []
+    for row in zip_longest(*queues):
+        ordered.extend([item for item in row if item is not None])
+
+    global_limit = asyncio.Semaphore(concurrency)
+    domain_limits = {
+        domain: asyncio.Semaphore(per_domain)
+        for domain in by_domain
+    }
+
+    async def resolve(domain: str, identifier: str) -> None:
+        # Wait on the server first, so a busy server doesn't sit on slots
+        # from the global limit that other servers could be using
+        async with domain_limits[domain]:
+            async with global_limit:
+                try:
+                    found = FingerResult(identifier, await finger(identifier),
+                                         None)
+                except Exception as exception:  # pylint: disable=broad-except
+                    found = FingerResult(identifier, None, exception)
+        await results.put(found)
+
+    tasks = [
+        asyncio.ensure_future(resolve(domain, identifier))
+        for domain, identifier in ordered
+    ]
+    try:
+        for _ in range(malformed + len(tasks)):
+            yield await results.get()
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,12 @@
+"""Setup lamia cache lifecycle and global."""
+# pylint: disable=invalid-name
+from starlette.applications import Starlette
+import lamia.utilities.cache as caching
+import lamia.config as CONFIG
+
+cache = caching.Cache()
+
+
+def setup_cache(app: Starlette) -> None:
+    """Sets up lifecycle functions."""
+    cache.init_app(app, CONFIG.config)
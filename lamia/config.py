@@ -20,3 +20,5 @@ TEMPLATE_RELOAD = config(
     default=False,
 )
 BASE_URL = config('BASE_URL', cast=str)
+# Give local actors an ed25519 key alongside their rsa key
+ED25519_KEYS = config('ED25519_KEYS', cast=bool, default=False)
@@ -0,0 +1,14 @@
+"""Setup lamia federation lifecycle and globals."""
+# pylint: disable=invalid-name
+from starlette.applications import Starlette
+import lamia.activitypub.httpsigs as httpsigs
+import lamia.utilities.http as http
+import lamia.config as CONFIG
+
+http_client = http.HttpClient()
+
+
+def setup_federation(app: Starlette) -> None:
+    """Sets up lifecycle functions."""
+    httpsigs.POOL.init_app(app, CONFIG.config)
+    http_client.init_app(app, CONFIG.config)
@@ -0,0 +1,34 @@
+"""Setup lamia's invalidation bus lifecycle and global, and subscribe the
+in-process caches that need to hear about changes made by other workers.
+"""
+# pylint: disable=invalid-name
+from starlette.applications import Starlette
+import lamia.utilities.invalidation as invalidation
+from lamia.activitypub.local_webfinger import LOCAL_WEBFINGER
+from lamia.cache import cache
+from lamia.database import db
+import lamia.config as CONFIG
+
+bus = invalidation.InvalidationBus(database=db)
+
+
+def webfinger_changed(user_name: str) -> None:
+    """Adds a newly registered user name to the local webfinger index.
+    When every name may have changed, the index is thrown away instead (it's
+    one query to rebuild).
+    """
+    if user_name is None:
+        LOCAL_WEBFINGER.invalidate()
+    else:
+        LOCAL_WEBFINGER.add(user_name)
+
+
+def setup_invalidation(app: Starlette) -> None:
+    """Sets up lifecycle functions and subscriptions."""
+    bus.init_app(app, CONFIG.config)
+
+    bus.subscribe('webfinger', webfinger_changed)
+
+    # (redis is shared between workers, so this only evicts from memory)
+    cache.invalidation_bus = bus
+    bus.subscribe('cache', cache.evict)
@@ -2,10 +2,12 @@
 ActivityPub. They may be referenced by other models but probably shouldn't
 depend on them.
 """
-from Crypto.PublicKey import RSA
+from typing import Tuple
+from Crypto.PublicKey import ECC, RSA
 from gino.dialects.asyncpg import JSONB
 from lamia.database import db
 from lamia.config import BASE_URL
+from lamia.activitypub.httpsigs import invalidate_key, multibase_encode
 
 
 class Actor(db.Model):
@@ -25,6 +27,8 @@ class Actor(db.Model):
     id = db.Column(db.Integer(), primary_key=True)
     actor_type = db.Column(db.String())
     private_key = db.Column(db.String(), nullable=True)
+    # Optional, for instances that can verify the (much cheaper) ed25519
+    ed25519_private_key = db.Column(db.String(), nullable=True)
 
     display_name = db.Column(db.String())
     user_name = db.Column(db.String())
@@ -36,22 +40,68 @@ class Actor(db.Model):
 
     data = db.Column(JSONB())
 
-    def generate_keys(self):
-        """Create new keys and stuff them into an already created actor"""
+    # Also what bulk ingest upserts on
+    _uri_idx = db.Index('idx_actor_uri', 'uri', unique=True)
+
+    def generate_keys(self, ed25519: bool = False):
+        """Create new keys and stuff them into an already created actor.
+
+        If ed25519 is True, an ed25519 key is created alongside the rsa key
+        and published as a Multikey in the actor's assertionMethod list.
+        """
         key = RSA.generate(2048)
         self.private_key = key.export_key("PEM").decode()
+        key_id = f'{BASE_URL}/u/{self.user_name}#main-key'
 
         try:
             del self.data['publicKey']
         except KeyError:
             pass
 
+        # Anything signed with or verified against the old key is stale now
+        invalidate_key(key_id)
+
         self.data['publicKey'] = {
-            'id': f'{BASE_URL}/u/{self.user_name}#main-key',
+            'id': key_id,
             'owner': f'{BASE_URL}/u/{self.user_name}',
             'publicKeyPem': key.publickey().export_key("PEM").decode()
         }
 
+        if ed25519:
+            self.generate_ed25519_key()
+
+    def generate_ed25519_key(self):
+        """Create a new ed25519 key and stuff it into an already created
+        actor, replacing any ed25519 key that it already had.
+        """
+        key = ECC.generate(curve='ed25519')
+        self.ed25519_private_key = key.export_key(format='PEM')
+        key_id = f'{BASE_URL}/u/{self.user_name}#ed25519-key'
+        invalidate_key(key_id)
+
+        assertion_methods = [
+            method for method in self.data.get('assertionMethod', [])
+            if method.get('id') != key_id
+        ]
+        assertion_methods.append({
+            'id': key_id,
+            'type': 'Multikey',
+            'controller': f'{BASE_URL}/u/{self.user_name}',
+            'publicKeyMultibase': multibase_encode(key.public_key())
+        })
+        self.data['assertionMethod'] = assertion_methods
+
+    def signing_key(self, prefer_ed25519: bool = False) -> Tuple[str, str]:
+        """Returns a tuple of (private key, key id) for signing requests as
+        this actor. The ed25519 key is only used when asked for (i.e. when
+        the receiving end is known to support it) and when we have one.
+        """
+        if prefer_ed25519 and self.ed25519_private_key:
+            return (self.ed25519_private_key,
+                    f'{BASE_URL}/u/{self.user_name}#ed25519-key')
+
+        return (self.private_key, f'{BASE_URL}/u/{self.user_name}#main-key')
+
     # Convenience fields for local actors.
     identity_id = db.Column(
         db.Integer(),
@@ -82,6 +132,8 @@ class Activity(db.Model):
     created = db.Column(db.DateTime())
     data = db.Column(JSONB())
 
+    _uri_idx = db.Index('idx_activity_uri', 'uri', unique=True)
+
 
 class Object(db.Model):
     """Objects are the Things in the fediverse.
@@ -109,3 +161,11 @@ class Object(db.Model):
     last_updated = db.Column(db.DateTime())
 
     data = db.Column(JSONB())
+
+    _uri_idx = db.Index('idx_object_uri', 'uri', unique=True)
+    # For threads
+    _reply_to_uri_idx = db.Index('idx_object_reply_to_uri', 'reply_to_uri')
+    # For timelines, which page through (created, id) newest first
+    _created_idx = db.Index('idx_object_created_id', 'created', 'id')
+    _actor_created_idx = db.Index('idx_object_actor_created_id', 'actor_uri',
+                                  'created', 'id')
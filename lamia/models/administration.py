@@ -35,6 +35,9 @@ class Setting(db.Model):
     key = db.Column(db.String())
     value = db.Column(JSONB())
 
+    # One row per key, which lamia.settings upserts on
+    _key_idx = db.Index('idx_setting_key', 'key', unique=True)
+
 
 # TODO: relay support
 #class Relay(db.Model):
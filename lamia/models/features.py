@@ -100,6 +100,8 @@ class Identity(db.Model):
     created = db.Column(db.DateTime())
     last_updated = db.Column(db.DateTime())
 
+    _user_name_idx = db.Index('idx_identity_user_name', 'user_name', unique=True)
+
 
 class Blog(db.Model):
     """An account can have more than one blog. Each blog connects an
@@ -251,6 +253,39 @@ class Feed(db.Model):
     created = db.Column(db.DateTime())
 
 
+class TimelineEntry(db.Model):
+    """An object in an identity's (materialized) home timeline. Entries are
+    written when objects come in (fan-out-on-write) so that reading a home
+    timeline is a single range scan, and each timeline is trimmed to a
+    bounded number of entries.
+    """
+    __tablename__ = 'timeline_entries'
+
+    id = db.Column(db.Integer(), primary_key=True)
+    identity_id = db.Column(
+        db.Integer(),
+        db.ForeignKey(
+            'identities.id',
+            ondelete='CASCADE',
+            name='fk_timelineentry_identity'),
+    )
+    object_id = db.Column(
+        db.Integer(),
+        db.ForeignKey(
+            'objects.id', ondelete='CASCADE', name='fk_timelineentry_object'),
+    )
+    # The object's created, copied here so pages don't need the objects table
+    created = db.Column(db.DateTime())
+
+    _identity_object_idx = db.Index(
+        'idx_timelineentry_identity_object',
+        'identity_id',
+        'object_id',
+        unique=True)
+    _identity_created_idx = db.Index('idx_timelineentry_identity_created',
+                                     'identity_id', 'created', 'object_id')
+
+
 class FeedActor(db.Model):
     """A single actor watched by a feed."""
     __tablename__ = 'feed_actors'
@@ -267,6 +302,8 @@ class FeedActor(db.Model):
             'actors.id', ondelete='CASCADE', name='fk_feedactor_actor'))
     created = db.Column(db.DateTime())
 
+    _feed_idx = db.Index('idx_feedactor_feed', 'feed_id', 'target_actor_id')
+
 
 class Tag(db.Model):
     """The metaphysical concept of the hashtag, made real and without conceit."""
@@ -276,6 +313,8 @@ class Tag(db.Model):
     tag = db.Column(db.String())
     created = db.Column(db.DateTime())
 
+    _tag_idx = db.Index('idx_tag_tag', 'tag')
+
 
 class ObjectTag(db.Model):
     """A crosswalk table that ties tags to objects, for ease of querying."""
@@ -292,6 +331,10 @@ class ObjectTag(db.Model):
             'objects.id', ondelete='CASCADE', name='fk_objecttag_object'))
     created = db.Column(db.DateTime())
 
+    # For tag timelines
+    _tag_object_idx = db.Index('idx_objecttag_tag_object', 'tag_id',
+                               'object_id')
+
 
 class FeedTag(db.Model):
     """A single tag watched by a feed."""
@@ -308,6 +351,8 @@ class FeedTag(db.Model):
     )
     created = db.Column(db.DateTime())
 
+    _feed_idx = db.Index('idx_feedtag_feed', 'feed_id', 'target_tag_id')
+
 
 class Attachments(db.Model):
     """An attachment is an image tied to some kind of ActivityPub object.
@@ -426,3 +471,9 @@ class Follow(db.Model):
 
     created = db.Column(db.DateTime())
     last_updated = db.Column(db.DateTime())
+
+    # One follow per pair, which also covers "who does this actor follow"
+    _actor_target_idx = db.Index(
+        'idx_follow_actor_target', 'actor_id', 'target_actor_id', unique=True)
+    # For "who follows this actor" (i.e. delivery)
+    _target_idx = db.Index('idx_follow_target_actor', 'target_actor_id')
@@ -15,6 +15,7 @@ from lamia.views.graph import Queries
 from lamia.views.graph import Mutations
 import lamia.views.general as lamia_general
 import lamia.views.activitypub.nodeinfo as lamia_nodeinfo
+import lamia.views.activitypub.webfinger as lamia_webfinger
 
 
 def setup_routes(app: Starlette) -> None:
@@ -35,6 +36,10 @@ def setup_routes(app: Starlette) -> None:
     app.add_route('/nodeinfo/2.0.json', lamia_nodeinfo.nodeinfo_schema_20,
                   ['GET'])
 
+    # Webfinger route
+    app.add_route('/.well-known/webfinger', lamia_webfinger.webfinger_resource,
+                  ['GET'])
+
     # Graph QL endpoint
     app.add_route(
         '/graphql',
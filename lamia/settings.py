@@ -0,0 +1,253 @@
+"""Site settings, kept in the settings table and served from memory.
+
+The whole settings table is loaded once, when lamia starts, into an
+immutable snapshot, and reading a setting never touches the database. An
+update writes every changed setting in one transaction, swaps in a new
+snapshot (readers see either all of the old settings or all of the new
+ones, never a mix), and tells the other workers to reload theirs over the
+invalidation bus.
+
+Reloads can overlap, and finish in any order, so every read of the table
+is numbered when it starts and a snapshot is only swapped in when it's
+newer than the one already in place. A reload overtaken by an update made
+here reads the table again, since the update's snapshot only has the rows
+as this worker last knew them.
+
+Every setting is declared in SETTING_DEFINITIONS with its type and its
+default, and anything missing from the table (or stored with the wrong
+type) reads as its default.
+
+Usage:
+
+SETTINGS['open_registration']  # True
+SETTINGS.snapshot()  # a read-only mapping of every setting
+await SETTINGS.update_many({'site_name': 'Muffins', 'open_registration': False})
+"""
+from collections import namedtuple
+from types import MappingProxyType
+from typing import Any, Mapping
+
+from sqlalchemy.dialects.postgresql import insert
+from starlette.applications import Starlette
+from starlette.config import Config
+
+from lamia.database import db
+from lamia.invalidation import bus
+from lamia.logging import logging
+from lamia.models.administration import Setting
+from lamia.translation import _
+from lamia.utilities.invalidation import InvalidationBus
+from lamia.version import NAME, DESCRIPTION
+import lamia.config as CONFIG
+
+# cast - the type that the setting's value must be
+# default - the value of the setting when it isn't in the table
+# description - what the setting is for
+SettingDefinition = namedtuple('SettingDefinition', 'cast default description')
+
+SETTING_DEFINITIONS = {
+    'site_name':
+    SettingDefinition(str, NAME, 'The name of the site.'),
+    'site_description':
+    SettingDefinition(str, DESCRIPTION, 'A short description of the site.'),
+    'open_registration':
+    SettingDefinition(bool, True, 'Whether anyone can register an account.'),
+    'max_post_length':
+    SettingDefinition(int, 5000, 'The most characters allowed in a post.'),
+}
+
+
+class SettingException(ValueError):
+    """Raised for settings that don't exist or values of the wrong type."""
+
+
+def check_setting(key: str, value: Any) -> Any:
+    """Returns a value if it's valid for a setting, and raises a
+    SettingException if it isn't.
+    """
+    if key not in SETTING_DEFINITIONS:
+        raise SettingException(_('There is no setting named %s.') % key)
+    cast = SETTING_DEFINITIONS[key].cast
+    # (booleans are ints too, as far as isinstance is concerned)
+    if not isinstance(value, cast) or (cast is int
+                                       and isinstance(value, bool)):
+        raise SettingException(
+            _('The %s setting must be a %s.') % (key, cast.__name__))
+    return value
+
+
+def build_snapshot(stored: Mapping[str, Any]) -> Mapping[str, Any]:
+    """Returns a read-only mapping of every setting, from the stored values
+    and the defaults.
+    """
+    settings = {}
+    for key, definition in SETTING_DEFINITIONS.items():
+        value = stored.get(key, definition.default)
+        try:
+            settings[key] = check_setting(key, value)
+        except SettingException:
+            logging.warning(
+                _('Settings: Ignored a stored %s of the wrong type') % key)
+            settings[key] = definition.default
+    return MappingProxyType(settings)
+
+
+class SettingsStore():
+    """
+    A cached view of the settings table.
+
+    Pluggable into any starlette app.
+
+    app: the starlette app to register to SettingsStore
+    config: The starlette configuration object
+    invalidation_bus: the bus that tells other workers about updates
+
+    raises: Value error if only app is provided an argument.
+    """
+
+    def init_app(self, app: Starlette, config: Config) -> None:
+        """
+        Register the starlette app with the settings store.
+
+        App: the starlette app
+        config: lamia's config
+
+        Returns: none
+        """
+        self.config = config
+        app.add_event_handler('startup', self._startup)
+
+    def __init__(self,
+                 app: Starlette = None,
+                 config: Config = None,
+                 invalidation_bus: InvalidationBus = None):
+        if (app is not None) and (config is None):
+            raise ValueError(
+                "A starlette app was provided, but no configuration.")
+        self.config = config
+        self.invalidation_bus = invalidation_bus
+        self._snapshot = build_snapshot({})
+        # Bumped every time a new snapshot is swapped in
+        self.generation = 0
+        # Numbers reads of the table in the order they started, and the
+        # number of the read behind the current snapshot
+        self._sequence = 0
+        self._swapped = 0
+        # Whether the current snapshot came from a read of the whole table
+        self._swapped_read = False
+        self.loaded = False
+
+        if invalidation_bus is not None:
+            invalidation_bus.subscribe('settings', self._invalidated)
+        if app is not None:
+            self.init_app(app, config)
+
+    def snapshot(self) -> Mapping[str, Any]:
+        """Returns every setting, as a read-only mapping."""
+        return self._snapshot
+
+    def __getitem__(self, key: str) -> Any:
+        return self._snapshot[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Returns the value of a setting, or default if there isn't one."""
+        return self._snapshot.get(key, default)
+
+    def _next_sequence(self) -> int:
+        """Numbers a read of the table (or a write) as it starts."""
+        self._sequence += 1
+        return self._sequence
+
+    def _swap(self,
+              stored: Mapping[str, Any],
+              sequence: int = None,
+              read: bool = False) -> bool:
+        """Swaps in a new snapshot, unless it was read before the current
+        one. Returns whether it was swapped in.
+
+        read - whether stored is the whole table, as opposed to an update
+            on top of the current snapshot
+        """
+        if sequence is None:
+            sequence = self._next_sequence()
+        if sequence <= self._swapped:
+            return False
+        self._swapped = sequence
+        self._swapped_read = read
+        self._snapshot = build_snapshot(stored)
+        self.generation += 1
+        return True
+
+    async def refresh(self) -> Mapping[str, Any]:
+        """Reloads the whole settings table, in one query (or more, when
+        an update here overtakes it).
+        """
+        while True:
+            sequence = self._next_sequence()
+            rows = await db.all(db.select([Setting.key, Setting.value]))
+            # Overtaken by a newer read is fine, since that has everything
+            # this one does, but an update only has its own transaction's
+            # rows on top of whatever was here before
+            stored = {key: value for key, value in rows}
+            if self._swap(stored, sequence, read=True) or self._swapped_read:
+                break
+        self.loaded = True
+        return self._snapshot
+
+    async def _invalidated(self, key: str) -> None:  # pylint: disable=unused-argument
+        """Reloads when another worker has changed the settings."""
+        try:
+            await self.refresh()
+        except Exception:  # pylint: disable=broad-except
+            logging.exception(_('Settings: Could not reload'))
+
+    async def update_many(self, values: Mapping[str, Any]) -> None:
+        """Stores several settings in one transaction, then swaps in the new
+        snapshot and lets the other workers know. Nothing is stored if any of
+        the values aren't valid.
+        """
+        values = {
+            key: check_setting(key, value)
+            for key, value in values.items()
+        }
+        if not values:
+            return
+
+        statement = insert(Setting.__table__).values(
+            [{'key': key, 'value': value} for key, value in values.items()])
+        statement = statement.on_conflict_do_update(
+            index_elements=[Setting.key],
+            set_={'value': statement.excluded.value})
+        async with db.transaction():
+            await db.status(statement)
+
+        # (numbered after the commit, so that any reload already under way
+        # can't swap the old values back in)
+        self._swap({**self._snapshot, **values}, self._next_sequence())
+        if self.invalidation_bus is not None:
+            # This worker is already up to date
+            self.invalidation_bus.publish('settings', local=False)
+
+    async def update(self, key: str, value: Any) -> None:
+        """Stores a single setting."""
+        await self.update_many({key: value})
+
+    async def _startup(self) -> None:
+        """
+        Startup function intended to be ran on application start.
+
+        Returns: none
+        """
+        try:
+            await self.refresh()
+        except Exception:  # pylint: disable=broad-except
+            # (say, a database that hasn't been migrated yet)
+            logging.exception(_('Settings: Could not load, using defaults'))
+
+
+SETTINGS = SettingsStore(invalidation_bus=bus)
+
+
+def setup_settings(app: Starlette) -> None:
+    """Sets up lifecycle functions."""
+    SETTINGS.init_app(app, CONFIG.config)
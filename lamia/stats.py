@@ -0,0 +1,271 @@
+"""Site statistics (for nodeinfo, and anything else that wants them).
+
+Counting accounts and local posts with COUNT(*) on every request would let
+any crawler that polls nodeinfo put a full table scan on the database. So
+SITE_STATS keeps the counters in memory instead: they're bumped as accounts
+and posts are created or deleted, corrected now and then by a periodic
+reconciliation against the real tables, and served from an immutable
+snapshot that's only rebuilt when something changes.
+
+Each worker keeps its own counters, so a worker that counts a change also
+publishes it on the invalidation bus as a 'stats:<sequence>:<kind>:<value>'
+key, and the other workers apply the same change to theirs:
+
+stats:<sequence>:users:<count> - count accounts were created (or deleted,
+    when negative)
+stats:<sequence>:posts:<count> - the same for local posts
+stats:<sequence>:active:<actor uri> - a local actor has just posted
+
+(The sequence keeps two identical changes from being gathered into one
+notification by the bus.) Anything missed while a worker wasn't listening
+is corrected by its next reconciliation.
+
+Every change bumps the snapshot's generation, which is handy for anything
+that caches output built from the stats.
+
+Adds the following configuration settings:
+
+STATS_RECONCILE_INTERVAL: Seconds between reconciliations of the counters
+    against the database. Defaults to 3600.
+"""
+import asyncio
+from collections import namedtuple
+from itertools import count as counter
+from datetime import timedelta
+from typing import Iterable, Tuple
+
+import pendulum
+import sqlalchemy as sa
+from starlette.applications import Starlette
+from starlette.config import Config
+
+from lamia.config import BASE_URL
+from lamia.database import db
+from lamia.invalidation import bus
+from lamia.logging import logging
+from lamia.models.activitypub import Actor, Object
+from lamia.models.features import Account
+from lamia.translation import _
+from lamia.utilities.invalidation import InvalidationBus
+import lamia.config as CONFIG
+
+DEFAULTS = {
+    'STATS_RECONCILE_INTERVAL': 3600,
+}
+
+# The windows that count as active, in the sense nodeinfo means
+ACTIVE_MONTH = timedelta(days=30)
+ACTIVE_HALFYEAR = timedelta(days=180)
+
+# generation - bumped every time any of the numbers change
+StatsSnapshot = namedtuple(
+    'StatsSnapshot',
+    'local_users local_posts active_month active_halfyear generation')
+
+
+def is_local_uri(uri: str) -> bool:
+    """Returns True for the uris of things hosted here."""
+    return isinstance(uri, str) and uri.startswith(f'{BASE_URL}/')
+
+
+class SiteStatistics:
+    """
+    Incrementally maintained site statistics.
+
+    Pluggable into any starlette app.
+
+    app: the starlette app to register to SiteStatistics
+    config: The starlette configuration object
+    invalidation_bus: the bus that tells other workers about changes
+
+    raises: Value error if only app is provided an argument.
+    """
+
+    def init_app(self, app: Starlette, config: Config) -> None:
+        """
+        Register the starlette app with the site statistics.
+
+        App: the starlette app
+        config: lamia's config
+
+        Returns: none
+        """
+        self.config = config
+        app.add_event_handler('startup', self._startup)
+        app.add_event_handler('shutdown', self._shutdown)
+
+    def __init__(self,
+                 app: Starlette = None,
+                 config: Config = None,
+                 invalidation_bus: InvalidationBus = None):
+        if (app is not None) and (config is None):
+            raise ValueError(
+                "A starlette app was provided, but no configuration.")
+        self.config = config
+        self.invalidation_bus = invalidation_bus
+        self._task = None
+        # Numbers the changes published to other workers
+        self._sequence = counter()
+
+        self.local_users = 0
+        self.local_posts = 0
+        # Maps local actor uris to when they last posted
+        self.last_active = {}
+        self.generation = 0
+        self.reconciled = None
+        self._snapshot = None
+        self._publish()
+
+        if invalidation_bus is not None:
+            invalidation_bus.subscribe('stats', self._invalidated)
+        if app is not None:
+            self.init_app(app, config)
+
+    def _setting(self, name: str) -> int:
+        """Returns a configured integer setting, or its default."""
+        if self.config is None:
+            return DEFAULTS[name]
+        return self.config(name, cast=int, default=DEFAULTS[name])
+
+    def _active_since(self, window: timedelta) -> int:
+        """Counts the local actors that have posted within a window."""
+        since = pendulum.now('UTC').naive() - window
+        return sum(1 for last in self.last_active.values() if last >= since)
+
+    def _publish(self) -> None:
+        """Rebuilds the snapshot after a change."""
+        self.generation += 1
+        self._snapshot = StatsSnapshot(
+            local_users=self.local_users,
+            local_posts=self.local_posts,
+            active_month=self._active_since(ACTIVE_MONTH),
+            active_halfyear=self._active_since(ACTIVE_HALFYEAR),
+            generation=self.generation,
+        )
+
+    def _apply(self, kind: str, value: object) -> None:
+        """Applies one change to the counters (without rebuilding the
+        snapshot).
+        """
+        if kind == 'users':
+            self.local_users = max(0, self.local_users + int(value))
+        elif kind == 'posts':
+            self.local_posts = max(0, self.local_posts + int(value))
+        elif kind == 'active':
+            self.last_active[value] = pendulum.now('UTC').naive()
+        else:
+            raise ValueError(f'unknown statistic {kind}')
+
+    def _changed(self, *changes: Tuple[str, object]) -> None:
+        """Applies (kind, value) changes counted here, and sends them on to
+        the other workers.
+        """
+        for kind, value in changes:
+            self._apply(kind, value)
+        self._publish()
+        if self.invalidation_bus is not None:
+            self.invalidation_bus.publish(
+                *(f'stats:{next(self._sequence)}:{kind}:{value}'
+                  for kind, value in changes),
+                local=False)
+
+    def _invalidated(self, key: str) -> None:
+        """Applies a change counted by another worker."""
+        if key is None:
+            # Whatever was missed is left to the next reconciliation
+            return
+        try:
+            kind, value = key.split(':', 2)[1:]
+            self._apply(kind, value)
+        except ValueError:
+            logging.warning(_('Stats: Ignored a change we could not read'))
+            return
+        self._publish()
+
+    def snapshot(self) -> StatsSnapshot:
+        """Returns the current statistics. Never touches the database."""
+        return self._snapshot
+
+    def users_created(self, count: int = 1) -> None:
+        """Counts newly registered accounts."""
+        self._changed(('users', count))
+
+    def users_deleted(self, count: int = 1) -> None:
+        """Counts deleted accounts."""
+        self._changed(('users', -count))
+
+    def objects_created(self, actor_uris: Iterable[str]) -> None:
+        """Counts newly stored objects, given the uris of their authors.
+        Anything not by a local actor is ignored.
+        """
+        actor_uris = [uri for uri in actor_uris if is_local_uri(uri)]
+        if actor_uris:
+            self._changed(('posts', len(actor_uris)),
+                          *(('active', uri) for uri in set(actor_uris)))
+
+    def objects_deleted(self, actor_uris: Iterable[str]) -> None:
+        """Counts deleted objects, given the uris of their authors."""
+        deleted = sum(1 for actor_uri in actor_uris if is_local_uri(actor_uri))
+        if deleted:
+            self._changed(('posts', -deleted))
+
+    async def reconcile(self) -> StatsSnapshot:
+        """Recounts everything from the database, correcting any drift in
+        the counters, and returns the new snapshot.
+        """
+        local_users = await db.scalar(
+            sa.select([sa.func.count(Account.id)]).where(
+                Account.banned.isnot(True)))
+        local_uris = sa.select([Actor.uri]).where(Actor.local.is_(True))
+        local_posts = await db.scalar(
+            sa.select([sa.func.count(Object.id)]).where(
+                Object.actor_uri.in_(local_uris)))
+        since = pendulum.now('UTC').naive() - ACTIVE_HALFYEAR
+        last_active = await db.all(
+            sa.select([Object.actor_uri, sa.func.max(Object.created)]).where(
+                sa.and_(Object.actor_uri.in_(local_uris),
+                        Object.created >= since)).group_by(Object.actor_uri))
+
+        self.local_users = local_users or 0
+        self.local_posts = local_posts or 0
+        self.last_active = {uri: created for uri, created in last_active}
+        self.reconciled = pendulum.now('UTC')
+        self._publish()
+        return self._snapshot
+
+    async def _reconcile_forever(self) -> None:
+        """Reconciles the counters every STATS_RECONCILE_INTERVAL seconds."""
+        interval = self._setting('STATS_RECONCILE_INTERVAL')
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as exception:  # pylint: disable=broad-except
+                # (before python 3.8, being cancelled is an Exception too)
+                if isinstance(exception, asyncio.CancelledError):
+                    raise
+                logging.exception(_("Stats: Reconciliation failed"))
+            await asyncio.sleep(interval)
+
+    async def _startup(self) -> None:
+        """
+        Startup function intended to be ran on application start.
+
+        Returns: none
+        """
+        self._task = asyncio.ensure_future(self._reconcile_forever())
+
+    async def _shutdown(self) -> None:
+        """
+        Internal method to clean up on starlette server close.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+SITE_STATS = SiteStatistics(invalidation_bus=bus)
+
+
+def setup_stats(app: Starlette) -> None:
+    """Sets up lifecycle functions."""
+    SITE_STATS.init_app(app, CONFIG.config)
@@ -0,0 +1,558 @@
+"""Timeline queries over stored objects.
+
+Timelines are paged with keyset (a.k.a. seek) pagination instead of OFFSET.
+Each page ends with a cursor holding the (created, id) of its last object,
+and the next page asks for objects that sort before that pair. This makes
+every page one walk down an index, however far back someone scrolls, where
+OFFSET has to count its way past every row it skips.
+
+By default, timelines only select the metadata columns of objects and leave
+out the (large) data column, for callers that just need ids to look up in a
+cache or to hand to something else.
+
+Usage:
+
+page = await fetch_timeline(home_query(actor_id), limit=20)
+page.items  # [TimelineItem(id=..., uri=..., ...), ...]
+older = await fetch_timeline(home_query(actor_id), cursor=page.cursor)
+
+Home timelines can also be materialized (fan-out-on-write): as objects are
+stored, HOME_TIMELINES pushes them into the timeline of every identity that
+follows their author, so that reading a home timeline doesn't have to join
+follows to objects at all. Each timeline is trimmed to a bounded number of
+entries, kept either in the timeline_entries table or in memory.
+
+Nothing in lamia creates follows yet, so nothing calls
+HOME_TIMELINES.backfill when one is made either; whatever starts creating
+them should, so that a newly followed actor's recent objects show up
+straight away. Until then, lamia-db backfill-timelines rebuilds
+timelines from follows.
+
+Adds the following configuration settings:
+
+TIMELINE_BACKEND: Where materialized home timelines are kept, 'postgres'
+    (the default) or 'memory' (for development, or a single process).
+
+TIMELINE_MAX_ENTRIES: How many entries each home timeline keeps.
+    Defaults to 800.
+"""
+import base64
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import datetime
+from typing import Iterable, List, Tuple
+
+import pendulum
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+from starlette.config import Config
+
+from lamia.database import db
+import lamia.config as CONFIG
+from lamia.models.activitypub import Actor, Object
+from lamia.models.features import Follow, FeedActor, FeedTag, Identity
+from lamia.models.features import ObjectTag, Tag, TimelineEntry
+
+TIMELINE_LIMIT = 20
+MAX_TIMELINE_LIMIT = 40
+
+DEFAULTS = {
+    'TIMELINE_BACKEND': 'postgres',
+    'TIMELINE_MAX_ENTRIES': 800,
+}
+
+# The object columns a timeline selects, unless asked for data too
+TIMELINE_COLUMNS = (
+    Object.id,
+    Object.uri,
+    Object.actor_uri,
+    Object.reply_to_uri,
+    Object.object_type,
+    Object.created,
+)
+TimelineItem = namedtuple('TimelineItem',
+                          [column.name for column in TIMELINE_COLUMNS])
+TimelineItemWithData = namedtuple('TimelineItemWithData',
+                                  TimelineItem._fields + ('data', ))
+
+# items - a list of TimelineItem (or TimelineItemWithData) tuples
+# cursor - the cursor for the next (older) page, or None at the end
+TimelinePage = namedtuple('TimelinePage', 'items cursor')
+
+
+class TimelineCursorException(ValueError):
+    """Raised when a timeline cursor can't be decoded."""
+
+
+def encode_cursor(created: datetime, object_id: int) -> str:
+    """Encodes an object's (created, id) as an opaque, url safe cursor."""
+    value = f'{created.isoformat()}|{object_id}'.encode()
+    return base64.urlsafe_b64encode(value).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decodes a cursor from encode_cursor back into (created, id)."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created, object_id = base64.urlsafe_b64decode(
+            padded.encode()).decode().split('|')
+        return pendulum.parse(created).naive(), int(object_id)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise TimelineCursorException(f'invalid timeline cursor {cursor}')
+
+
+def _select(include_data: bool = False) -> sa.sql.Select:
+    """Returns the base select for a timeline."""
+    columns = list(TIMELINE_COLUMNS)
+    if include_data:
+        columns.append(Object.data)
+    return sa.select(columns)
+
+
+def _followed_uris(actor_id: int) -> sa.sql.Select:
+    """Selects the uris of the actors that an actor (approved) follows."""
+    return sa.select([Actor.uri]).select_from(
+        Follow.__table__.join(Actor.__table__,
+                              Actor.id == Follow.target_actor_id)).where(
+                                  sa.and_(Follow.actor_id == actor_id,
+                                          Follow.approved.is_(True)))
+
+
+def _home_condition(actor_id: int) -> sa.sql.ClauseElement:
+    """Matches objects from the actors that an actor follows, and their
+    own.
+    """
+    own_uri = sa.select([Actor.uri]).where(Actor.id == actor_id)
+    return sa.or_(
+        Object.actor_uri.in_(_followed_uris(actor_id)),
+        Object.actor_uri == own_uri.as_scalar(),
+    )
+
+
+def home_query(actor_id: int, include_data: bool = False) -> sa.sql.Select:
+    """Objects from the actors that an actor follows, and their own.
+
+    This works out the timeline at read time; see HOME_TIMELINES for the
+    materialized version.
+    """
+    return _select(include_data).where(_home_condition(actor_id))
+
+
+def local_query(include_data: bool = False) -> sa.sql.Select:
+    """Objects from this instance's actors."""
+    local_uris = sa.select([Actor.uri]).where(Actor.local.is_(True))
+    return _select(include_data).where(Object.actor_uri.in_(local_uris))
+
+
+def tag_query(tag: str, include_data: bool = False) -> sa.sql.Select:
+    """Objects tagged with a tag."""
+    tagged = sa.select([ObjectTag.object_id]).select_from(
+        ObjectTag.__table__.join(Tag.__table__,
+                                 Tag.id == ObjectTag.tag_id)).where(
+                                     Tag.tag == tag)
+    return _select(include_data).where(Object.id.in_(tagged))
+
+
+def feed_query(feed_id: int, include_data: bool = False) -> sa.sql.Select:
+    """Objects from a feed's actors, or tagged with one of its tags."""
+    feed_uris = sa.select([Actor.uri]).select_from(
+        FeedActor.__table__.join(Actor.__table__,
+                                 Actor.id == FeedActor.target_actor_id)).where(
+                                     FeedActor.feed_id == feed_id)
+    feed_tagged = sa.select([ObjectTag.object_id]).select_from(
+        ObjectTag.__table__.join(
+            FeedTag.__table__,
+            FeedTag.target_tag_id == ObjectTag.tag_id)).where(
+                FeedTag.feed_id == feed_id)
+    return _select(include_data).where(
+        sa.or_(
+            Object.actor_uri.in_(feed_uris),
+            Object.id.in_(feed_tagged),
+        ))
+
+
+def paginate(query: sa.sql.Select,
+             cursor: str = None,
+             limit: int = TIMELINE_LIMIT,
+             keys: tuple = (Object.created, Object.id)) -> sa.sql.Select:
+    """Adds keyset pagination to a timeline query: newest first, starting
+    after the cursor, one more row than the limit (to tell if there's
+    another page).
+
+    keys are the (created, object id) columns to page through, which should
+    be the ones that the query's index covers.
+    """
+    created_key, id_key = keys
+    limit = max(1, min(limit, MAX_TIMELINE_LIMIT))
+    if cursor is not None:
+        created, object_id = decode_cursor(cursor)
+        query = query.where(
+            sa.tuple_(created_key, id_key) < sa.tuple_(
+                sa.literal(created, created_key.type),
+                sa.literal(object_id, id_key.type)))
+    return query.order_by(created_key.desc(), id_key.desc()).limit(limit + 1)
+
+
+def to_page(rows: list, limit: int = TIMELINE_LIMIT,
+            include_data: bool = False) -> TimelinePage:
+    """Turns the rows from a paginated query into a TimelinePage."""
+    limit = max(1, min(limit, MAX_TIMELINE_LIMIT))
+    item_cls = TimelineItemWithData if include_data else TimelineItem
+    items = [item_cls(*row) for row in rows[:limit]]
+
+    cursor = None
+    if len(rows) > limit:
+        cursor = encode_cursor(items[-1].created, items[-1].id)
+    return TimelinePage(items, cursor)
+
+
+async def fetch_timeline(query: sa.sql.Select,
+                         cursor: str = None,
+                         limit: int = TIMELINE_LIMIT,
+                         keys: tuple = (Object.created, Object.id)
+                         ) -> TimelinePage:
+    """Runs a timeline query (from home_query, local_query, tag_query or
+    feed_query) for one page.
+    """
+    include_data = len(query.c) > len(TIMELINE_COLUMNS)
+    rows = await db.all(paginate(query, cursor, limit, keys))
+    return to_page(rows, limit, include_data)
+
+
+async def home_timeline(actor_id: int,
+                        cursor: str = None,
+                        limit: int = TIMELINE_LIMIT,
+                        include_data: bool = False) -> TimelinePage:
+    """A page of an actor's home timeline."""
+    return await fetch_timeline(
+        home_query(actor_id, include_data), cursor, limit)
+
+
+async def local_timeline(cursor: str = None,
+                         limit: int = TIMELINE_LIMIT,
+                         include_data: bool = False) -> TimelinePage:
+    """A page of the local timeline."""
+    return await fetch_timeline(local_query(include_data), cursor, limit)
+
+
+async def tag_timeline(tag: str,
+                       cursor: str = None,
+                       limit: int = TIMELINE_LIMIT,
+                       include_data: bool = False) -> TimelinePage:
+    """A page of a tag's timeline."""
+    return await fetch_timeline(tag_query(tag, include_data), cursor, limit)
+
+
+async def feed_timeline(feed_id: int,
+                        cursor: str = None,
+                        limit: int = TIMELINE_LIMIT,
+                        include_data: bool = False) -> TimelinePage:
+    """A page of a feed's timeline."""
+    return await fetch_timeline(
+        feed_query(feed_id, include_data), cursor, limit)
+
+
+def fan_out_query(object_ids: Iterable[int]) -> sa.sql.Select:
+    """Selects (identity_id, object_id, created) for every home timeline
+    that some objects belong in: the timelines of the local identities
+    following each object's author, and the author's own.
+    """
+    object_ids = list(object_ids)
+    columns = [
+        Identity.id.label('identity_id'),
+        Object.id.label('object_id'),
+        Object.created,
+    ]
+    authors = Object.__table__.join(Actor.__table__,
+                                    Actor.uri == Object.actor_uri)
+    followers = sa.select(columns).select_from(
+        authors.join(
+            Follow.__table__,
+            sa.and_(Follow.target_actor_id == Actor.id,
+                    Follow.approved.is_(True))).join(
+                        Identity.__table__,
+                        Identity.actor_id == Follow.actor_id)).where(
+                            Object.id.in_(object_ids))
+    own = sa.select(columns).select_from(
+        authors.join(Identity.__table__,
+                     Identity.actor_id == Actor.id)).where(
+                         Object.id.in_(object_ids))
+    return sa.union(followers, own)
+
+
+def backfill_query(identity_id: int,
+                   actor_id: int,
+                   max_entries: int,
+                   target_actor_id: int = None) -> sa.sql.Select:
+    """Selects (identity_id, object_id, created) for the newest objects that
+    belong in an identity's home timeline. With a target_actor_id, only
+    objects by that actor (i.e. someone just followed) are selected.
+    """
+    if target_actor_id is None:
+        condition = _home_condition(actor_id)
+    else:
+        target_uri = sa.select([Actor.uri]).where(Actor.id == target_actor_id)
+        condition = Object.actor_uri == target_uri.as_scalar()
+
+    return sa.select([
+        sa.literal(identity_id, TimelineEntry.identity_id.type).label(
+            'identity_id'),
+        Object.id.label('object_id'),
+        Object.created,
+    ]).where(condition).order_by(Object.created.desc(),
+                                 Object.id.desc()).limit(max_entries)
+
+
+class PostgresTimelineStore:
+    """Keeps home timelines in the timeline_entries table. Pushes are a
+    single INSERT ... SELECT, however many timelines they reach.
+    """
+    # Pushes are part of whatever transaction they're made in
+    transactional = True
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+
+    async def push(self, entries: sa.sql.Select) -> int:
+        """Adds the (identity_id, object_id, created) rows selected by
+        entries, trimming the timelines they land in. Returns the number of
+        entries added.
+        """
+        table = TimelineEntry.__table__
+        statement = insert(table).from_select(
+            ['identity_id', 'object_id', 'created'],
+            entries).on_conflict_do_nothing(
+                index_elements=[table.c.identity_id, table.c.object_id]
+            ).returning(table.c.identity_id)
+        identity_ids = [row[0] for row in await db.all(statement)]
+        if identity_ids:
+            await self.trim(set(identity_ids))
+        return len(identity_ids)
+
+    def trim_statement(self, identity_ids: Iterable[int]) -> sa.sql.Delete:
+        """Returns the statement that trims timelines to max_entries."""
+        ranked = sa.select([
+            TimelineEntry.id,
+            sa.func.row_number().over(
+                partition_by=TimelineEntry.identity_id,
+                order_by=(TimelineEntry.created.desc(),
+                          TimelineEntry.object_id.desc())).label('position'),
+        ]).where(TimelineEntry.identity_id.in_(list(identity_ids))).alias(
+            'ranked')
+        return TimelineEntry.__table__.delete().where(
+            TimelineEntry.id.in_(
+                sa.select([ranked.c.id
+                           ]).where(ranked.c.position > self.max_entries)))
+
+    async def trim(self, identity_ids: Iterable[int]) -> None:
+        """Drops the oldest entries from timelines over max_entries."""
+        await db.status(self.trim_statement(identity_ids))
+
+    async def remove_actor(self, identity_id: int, actor_uri: str) -> None:
+        """Drops an actor's objects from a timeline (after an unfollow)."""
+        by_actor = sa.select([Object.id]).where(Object.actor_uri == actor_uri)
+        await db.status(TimelineEntry.__table__.delete().where(
+            sa.and_(TimelineEntry.identity_id == identity_id,
+                    TimelineEntry.object_id.in_(by_actor))))
+
+    async def clear(self, identity_id: int) -> None:
+        """Empties a timeline."""
+        await db.status(TimelineEntry.__table__.delete().where(
+            TimelineEntry.identity_id == identity_id))
+
+    def read_query(self, identity_id: int,
+                   include_data: bool = False) -> sa.sql.Select:
+        """Selects the objects in a timeline."""
+        return _select(include_data).select_from(
+            TimelineEntry.__table__.join(
+                Object.__table__, Object.id == TimelineEntry.object_id)).where(
+                    TimelineEntry.identity_id == identity_id)
+
+    async def read(self,
+                   identity_id: int,
+                   cursor: str = None,
+                   limit: int = TIMELINE_LIMIT,
+                   include_data: bool = False) -> TimelinePage:
+        """Returns a page of a timeline: one range scan of the
+        (identity_id, created, object_id) index.
+        """
+        return await fetch_timeline(
+            self.read_query(identity_id, include_data), cursor, limit,
+            (TimelineEntry.created, TimelineEntry.object_id))
+
+
+class MemoryTimelineStore:
+    """Keeps home timelines in memory, as sorted lists of (created,
+    object_id), for development and single process instances. Only ids are
+    kept; pages are filled in from the objects table.
+    """
+    # Pushes take effect straight away, and stay even if the transaction
+    # that they were made in rolls back
+    transactional = False
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.timelines = {}
+
+    def push_entries(self, entries: Iterable[tuple]) -> int:
+        """Adds (identity_id, object_id, created) tuples, trimming the
+        timelines they land in. Returns the number of entries added.
+        """
+        added = 0
+        for identity_id, object_id, created in entries:
+            timeline = self.timelines.setdefault(identity_id, [])
+            entry = (created, object_id)
+            position = bisect_left(timeline, entry)
+            if position < len(timeline) and timeline[position] == entry:
+                continue
+            insort(timeline, entry)
+            added += 1
+            if len(timeline) > self.max_entries:
+                del timeline[:len(timeline) - self.max_entries]
+        return added
+
+    async def push(self, entries: sa.sql.Select) -> int:
+        """Adds the (identity_id, object_id, created) rows selected by
+        entries. Returns the number of entries added.
+        """
+        return self.push_entries(await db.all(entries))
+
+    async def remove_actor(self, identity_id: int, actor_uri: str) -> None:
+        """Drops an actor's objects from a timeline (after an unfollow)."""
+        timeline = self.timelines.get(identity_id)
+        if not timeline:
+            return
+        object_ids = [object_id for _, object_id in timeline]
+        rows = await db.all(
+            sa.select([Object.id]).where(
+                sa.and_(Object.actor_uri == actor_uri,
+                        Object.id.in_(object_ids))))
+        by_actor = {row[0] for row in rows}
+        self.timelines[identity_id] = [
+            entry for entry in timeline if entry[1] not in by_actor
+        ]
+
+    async def clear(self, identity_id: int) -> None:
+        """Empties a timeline."""
+        self.timelines.pop(identity_id, None)
+
+    def page_ids(self, identity_id: int, cursor: str = None,
+                 limit: int = TIMELINE_LIMIT) -> List[int]:
+        """Returns the object ids for a page, newest first, with one more
+        than the limit if there's another page.
+        """
+        limit = max(1, min(limit, MAX_TIMELINE_LIMIT))
+        timeline = self.timelines.get(identity_id, [])
+        end = len(timeline)
+        if cursor is not None:
+            end = bisect_left(timeline, decode_cursor(cursor))
+        start = max(0, end - limit - 1)
+        return [object_id for _, object_id in reversed(timeline[start:end])]
+
+    async def read(self,
+                   identity_id: int,
+                   cursor: str = None,
+                   limit: int = TIMELINE_LIMIT,
+                   include_data: bool = False) -> TimelinePage:
+        """Returns a page of a timeline."""
+        object_ids = self.page_ids(identity_id, cursor, limit)
+        if not object_ids:
+            return TimelinePage([], None)
+
+        rows = {
+            row[0]: row
+            for row in await db.all(
+                _select(include_data).where(Object.id.in_(object_ids)))
+        }
+        return to_page([rows[object_id] for object_id in object_ids
+                        if object_id in rows], limit, include_data)
+
+
+TIMELINE_STORES = {
+    'postgres': PostgresTimelineStore,
+    'memory': MemoryTimelineStore,
+}
+
+
+class HomeTimelines:
+    """
+    Materialized home timelines, written to as objects come in.
+
+    There's nothing to start or stop, so there's no app to register with;
+    the store is picked from the configuration on first use.
+
+    config: The starlette configuration object
+    """
+
+    def __init__(self, config: Config = None):
+        self.configure(config)
+
+    def configure(self, config: Config) -> None:
+        """
+        Use a configuration, picking the store again on next use.
+
+        config: lamia's config
+
+        Returns: none
+        """
+        self.config = config
+        self._store = None
+
+    def _setting(self, name: str, cast: type) -> object:
+        """Returns a configured setting, or its default."""
+        if self.config is None:
+            return DEFAULTS[name]
+        return self.config(name, cast=cast, default=DEFAULTS[name])
+
+    @property
+    def store(self):
+        """The configured timeline store."""
+        if self._store is None:
+            backend = self._setting('TIMELINE_BACKEND', str)
+            if backend not in TIMELINE_STORES:
+                raise ValueError(f'unknown TIMELINE_BACKEND {backend}')
+            self._store = TIMELINE_STORES[backend](
+                self._setting('TIMELINE_MAX_ENTRIES', int))
+        return self._store
+
+    async def fan_out(self, object_ids: Iterable[int]) -> int:
+        """Pushes newly stored objects into the home timelines of everyone
+        who should see them. Returns the number of entries added.
+
+        When the store isn't transactional, only fan objects out once the
+        transaction that stored them has committed.
+        """
+        object_ids = [object_id for object_id in object_ids if object_id]
+        if not object_ids:
+            return 0
+        return await self.store.push(fan_out_query(object_ids))
+
+    async def backfill(self, identity_id: int,
+                       target_actor_id: int = None) -> int:
+        """Fills an identity's timeline with the newest objects from one
+        newly followed actor or, with no target_actor_id, rebuilds the whole
+        timeline from follows. Returns the number of entries added.
+        """
+        actor_id = await Identity.select('actor_id').where(
+            Identity.id == identity_id).gino.scalar()
+        if actor_id is None:
+            return 0
+        store = self.store
+        return await store.push(
+            backfill_query(identity_id, actor_id, store.max_entries,
+                           target_actor_id))
+
+    async def unfollow(self, identity_id: int, actor_uri: str) -> None:
+        """Drops an unfollowed actor's objects from a timeline."""
+        await self.store.remove_actor(identity_id, actor_uri)
+
+    async def read(self,
+                   identity_id: int,
+                   cursor: str = None,
+                   limit: int = TIMELINE_LIMIT,
+                   include_data: bool = False) -> TimelinePage:
+        """Returns a page of an identity's home timeline."""
+        return await self.store.read(identity_id, cursor, limit, include_data)
+
+
+HOME_TIMELINES = HomeTimelines(CONFIG.config)
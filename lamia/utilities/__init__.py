@@ -17,19 +17,16 @@ async def get_site_stats() -> dict:
     While this function primarily exists for compiling nodeinfo responses, it
     is also available for other views that may display statistical information.
 
-    TODO: The data for this should be stored in a redis cache.
-    TODO: Everything here is currently filler. We obs need real queries.
+    The numbers come from the in-memory snapshot kept by lamia.stats (and
+    the settings from lamia.settings), so this never queries the database.
     """
+    # Imported here, since both import the models (which import us)
+    from lamia.settings import SETTINGS  # pylint: disable=import-outside-toplevel
+    from lamia.stats import SITE_STATS  # pylint: disable=import-outside-toplevel
 
-    local_users = 0
-    local_posts = 0
-    open_registration = True
-
-    return {
-        'local_users': local_users,
-        'local_posts': local_posts,
-        'open_registration': open_registration
-    }
+    site_stats = SITE_STATS.snapshot()._asdict()
+    site_stats['open_registration'] = SETTINGS['open_registration']
+    return site_stats
 
 
 def response_contains_graphql_error(response: dict,
@@ -0,0 +1,529 @@
+"""Lamia's application cache.
+
+A small async cache with pluggable backends, for anything that's worth
+remembering between requests (and, with redis, between workers). Keys live
+in namespaces, so that unrelated parts of lamia can't trip over each other's
+keys, and every namespace counts its own hits and misses.
+
+Two backends come with it:
+
+- memory:// keeps values in a size bounded, in-process LRU. Values are
+  stored as is (so they're shared, not copied), and nothing is shared
+  between workers.
+- redis://[:password@]host[:port][/db] speaks the redis protocol to redis
+  (or anything compatible with it) over a single connection, with values
+  stored as json. Tuples come back as lists. rediss:// does the same over
+  TLS.
+
+Usage:
+
+actors = cache.namespace('actors', ttl=300)
+await actors.set(uri, data)
+await actors.get(uri)  # data
+await actors.get_many([uri, other_uri])  # {uri: data}
+cache.stats()  # {'actors': {'hits': 1, 'misses': 1, ...}, ...}
+
+Adds the following configuration settings:
+
+CACHE_URL: Where to keep cached values, either memory:// or a redis url.
+    Defaults to memory://.
+
+CACHE_MAX_SIZE: The most entries that the memory backend holds before it
+    evicts the least recently used. Defaults to 10000.
+
+CACHE_DEFAULT_TTL: Seconds that entries live for when neither the call nor
+    the namespace gives a ttl. 0 (the default) means until evicted.
+
+CACHE_PREFIX: Put in front of every key, so that several lamia sites can
+    share one redis. Defaults to lamia:.
+
+CACHE_TIMEOUT: Seconds to wait for redis to connect or reply before giving
+    up on it. Defaults to 5.
+"""
+import asyncio
+from typing import Any, Dict, Iterable, List, Union
+from urllib.parse import urlparse
+
+import ujson as json
+from starlette.applications import Starlette
+from starlette.config import Config
+
+from lamia.logging import logging
+from lamia.translation import _
+from lamia.utilities.lru import LRUCache
+
+DEFAULTS = {
+    'CACHE_URL': 'memory://',
+    'CACHE_MAX_SIZE': 10000,
+    'CACHE_DEFAULT_TTL': 0,
+    'CACHE_PREFIX': 'lamia:',
+    'CACHE_TIMEOUT': 5,
+}
+
+# Returned by backends for keys that aren't cached (since None can be)
+MISSING = object()
+
+
+class CacheException(Exception):
+    """Raised when a cache backend can't be reached or refuses a command."""
+
+
+class MemoryBackend:
+    """Keeps values in an in-process LRU cache.
+
+    max_size - the most entries to hold before evicting
+    """
+    # Every worker has its own
+    shared = False
+
+    def __init__(self, max_size: int = DEFAULTS['CACHE_MAX_SIZE']) -> None:
+        self.entries = LRUCache(max_size=max_size)
+
+    async def connect(self) -> None:
+        """Nothing to connect to."""
+
+    async def close(self) -> None:
+        """Nothing to close."""
+
+    async def get(self, key: str) -> Any:
+        """Returns the value for a key, or MISSING."""
+        return self.entries.get(key, MISSING, count=False)
+
+    async def get_many(self, keys: List[str]) -> List[Any]:
+        """Returns the values for several keys, with MISSING for any that
+        aren't cached.
+        """
+        return [self.entries.get(key, MISSING, count=False) for key in keys]
+
+    async def set(self, key: str, value: Any, ttl: float = None) -> None:
+        """Stores a value for ttl seconds (or until evicted, if None)."""
+        self.entries.set(key, value, ttl=ttl)
+
+    async def delete(self, keys: List[str]) -> int:
+        """Removes keys, returning how many were removed."""
+        return self.entries.invalidate_many(keys)
+
+    async def clear(self, prefix: str) -> int:
+        """Removes every key starting with prefix."""
+        return self.entries.invalidate_many(
+            key for key in self.entries.keys() if key.startswith(prefix))
+
+    def stats(self) -> dict:
+        """Returns a dictionary of counters for metrics and debugging."""
+        stats = self.entries.stats()
+        del stats['hits'], stats['misses']
+        return stats
+
+
+def encode_command(*args: Union[str, bytes, int]) -> bytes:
+    """Encodes a command as a redis protocol array of bulk strings."""
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = b'%d' % arg
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """Reads one redis protocol reply."""
+    line = await reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionResetError('Connection closed')
+    kind, data = line[:1], line[1:-2]
+
+    if kind == b'+':
+        return data.decode()
+    if kind == b'-':
+        raise CacheException(data.decode())
+    if kind == b':':
+        return int(data)
+    if kind == b'$':
+        length = int(data)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b'*':
+        length = int(data)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for index in range(length)]
+    raise CacheException(_('Cache: Unexpected reply from the server'))
+
+
+class RedisBackend:
+    """Keeps values in redis, as json.
+
+    url - redis://[:password@]host[:port][/db], or rediss:// for TLS
+    timeout - seconds to wait for the connection, or for any reply
+
+    Commands go one at a time over a single connection, which is opened on
+    first use and opened again if it drops. A connection that times out is
+    closed, since a late reply would be read as the answer to the next
+    command.
+    """
+    # Every worker sees the same values
+    shared = True
+
+    def __init__(self, url: str,
+                 timeout: float = DEFAULTS['CACHE_TIMEOUT']) -> None:
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.strip('/') or 0)
+        self.ssl = True if parsed.scheme == 'rediss' else None
+        self.timeout = timeout
+
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self.commands = 0
+        self.reconnects = 0
+        self.timeouts = 0
+
+    async def connect(self) -> None:
+        """Opens the connection (if it isn't open already)."""
+        async with self._lock:
+            await self._connect()
+
+    async def _connect(self) -> None:
+        if self._writer is not None:
+            return
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl),
+                self.timeout)
+            if self.password:
+                await self._send('AUTH', self.password)
+            if self.db:
+                await self._send('SELECT', self.db)
+        except asyncio.TimeoutError:
+            # (anything half open is no use to the next command)
+            self._close()
+            self.timeouts += 1
+            raise CacheException(_('Cache: Timed out connecting to redis'))
+        except (OSError, asyncio.IncompleteReadError) as exception:
+            self._close()
+            raise CacheException(
+                _('Cache: Could not connect to redis: %s') % exception)
+        except CacheException:
+            self._close()
+            raise
+
+    async def close(self) -> None:
+        """Closes the connection."""
+        async with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _send(self, *args) -> Any:
+        self._writer.write(encode_command(*args))
+        await asyncio.wait_for(self._writer.drain(), self.timeout)
+        return await asyncio.wait_for(read_reply(self._reader), self.timeout)
+
+    async def execute(self, *args) -> Any:
+        """Sends a command and returns its reply, reconnecting (once) if the
+        connection has dropped.
+        """
+        async with self._lock:
+            self.commands += 1
+            await self._connect()
+            try:
+                return await self._send(*args)
+            except asyncio.TimeoutError:
+                # (which is an OSError too, these days)
+                self._close()
+                self.timeouts += 1
+                raise CacheException(_('Cache: Timed out waiting for redis'))
+            except (OSError, asyncio.IncompleteReadError):
+                self._close()
+                self.reconnects += 1
+
+            await self._connect()
+            try:
+                return await self._send(*args)
+            except asyncio.TimeoutError:
+                self._close()
+                self.timeouts += 1
+                raise CacheException(_('Cache: Timed out waiting for redis'))
+            except (OSError, asyncio.IncompleteReadError):
+                self._close()
+                raise CacheException(_('Cache: Lost connection to redis'))
+
+    @staticmethod
+    def _decode(value: bytes) -> Any:
+        return MISSING if value is None else json.loads(value)
+
+    async def get(self, key: str) -> Any:
+        """Returns the value for a key, or MISSING."""
+        return self._decode(await self.execute('GET', key))
+
+    async def get_many(self, keys: List[str]) -> List[Any]:
+        """Returns the values for several keys, with MISSING for any that
+        aren't cached.
+        """
+        if not keys:
+            return []
+        return [self._decode(value)
+                for value in await self.execute('MGET', *keys)]
+
+    async def set(self, key: str, value: Any, ttl: float = None) -> None:
+        """Stores a value for ttl seconds (or until evicted, if None)."""
+        encoded = json.dumps(value, escape_forward_slashes=False)
+        if ttl is None:
+            await self.execute('SET', key, encoded)
+        else:
+            await self.execute('SET', key, encoded, 'PX',
+                               max(1, int(ttl * 1000)))
+
+    async def delete(self, keys: List[str]) -> int:
+        """Removes keys, returning how many were removed."""
+        if not keys:
+            return 0
+        return await self.execute('DEL', *keys)
+
+    async def clear(self, prefix: str) -> int:
+        """Removes every key starting with prefix."""
+        cursor, removed = b'0', 0
+        while True:
+            cursor, keys = await self.execute('SCAN', cursor, 'MATCH',
+                                              f'{prefix}*', 'COUNT', 500)
+            removed += await self.delete(keys)
+            if cursor == b'0':
+                return removed
+
+    def stats(self) -> dict:
+        """Returns a dictionary of counters for metrics and debugging."""
+        return {
+            'commands': self.commands,
+            'reconnects': self.reconnects,
+            'timeouts': self.timeouts,
+            'connected': self._writer is not None,
+        }
+
+
+def backend_for(url: str,
+                max_size: int = DEFAULTS['CACHE_MAX_SIZE'],
+                timeout: float = DEFAULTS['CACHE_TIMEOUT']):
+    """Returns the backend for a CACHE_URL."""
+    scheme = urlparse(url).scheme
+    if scheme == 'memory':
+        return MemoryBackend(max_size)
+    if scheme in ('redis', 'rediss'):
+        return RedisBackend(url, timeout)
+    raise ValueError(f'Unknown cache backend: {url}')
+
+
+class CacheNamespace:
+    """A namespace of keys within a cache, with its own default ttl and its
+    own counters.
+
+    cache - the cache that the namespace belongs to
+    name - put in front of every key (after the cache's prefix)
+    ttl - the default ttl for this namespace's entries (the cache's default
+        if None)
+    """
+
+    def __init__(self, cache: 'Cache', name: str, ttl: float = None) -> None:
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.deletes = 0
+
+    @property
+    def prefix(self) -> str:
+        """The full prefix of this namespace's keys."""
+        return f'{self.cache.prefix}{self.name}:'
+
+    def key(self, key: str) -> str:
+        """Returns the full key (as stored in the backend) for a key."""
+        return f'{self.prefix}{key}'
+
+    def _ttl(self, ttl: float) -> float:
+        if ttl is None:
+            ttl = self.ttl
+        if ttl is None:
+            ttl = self.cache.default_ttl
+        return ttl or None
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        """Returns the cached value for a key, or default."""
+        value = await self.cache.backend.get(self.key(key))
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Returns a dictionary of the cached values for several keys. Keys
+        that aren't cached are left out.
+        """
+        keys = list(keys)
+        values = await self.cache.backend.get_many(
+            [self.key(key) for key in keys])
+        found = {
+            key: value
+            for key, value in zip(keys, values) if value is not MISSING
+        }
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def set(self, key: str, value: Any, ttl: float = None) -> None:
+        """Caches a value for ttl seconds (or the namespace's default)."""
+        self.sets += 1
+        await self.cache.backend.set(self.key(key), value, self._ttl(ttl))
+
+    async def delete(self, *keys: str) -> int:
+        """Removes keys, returning how many were removed."""
+        self.deletes += len(keys)
+        return await self.cache.backend.delete([self.key(key) for key in keys])
+
+    async def clear(self) -> int:
+        """Removes every key in the namespace."""
+        return await self.cache.backend.clear(self.prefix)
+
+    async def invalidate(self, *keys: str) -> None:
+        """Removes keys from the cache in every worker. Backends that aren't
+        shared between workers hear about it through the cache's
+        invalidation bus (if it has one).
+        """
+        bus = self.cache.invalidation_bus
+        if bus is None or self.cache.backend.shared:
+            await self.delete(*keys)
+        else:
+            bus.publish(*(f'cache:{self.name}:{key}' for key in keys))
+
+    def stats(self) -> dict:
+        """Returns a dictionary of counters for metrics and debugging."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'sets': self.sets,
+            'deletes': self.deletes,
+        }
+
+
+class Cache():
+    """
+    Lamia's application cache.
+
+    Pluggable into any starlette app.
+
+    app: the starlette app to register to Cache
+    config: The starlette configuration object
+    backend: a backend to use instead of the one from CACHE_URL
+
+    raises: Value error if only app is provided an argument.
+    """
+
+    def init_app(self, app: Starlette, config: Config) -> None:
+        """
+        Register the starlette app with the cache.
+
+        App: the starlette app
+        config: lamia's config
+
+        Returns: none
+        """
+        self.config = config
+        app.add_event_handler('startup', self._startup)
+        app.add_event_handler('shutdown', self._shutdown)
+
+    def __init__(self, app: Starlette = None, config: Config = None,
+                 backend=None):
+        if (app is not None) and (config is None):
+            raise ValueError(
+                "A starlette app was provided, but no configuration.")
+        self.config = config
+        self._backend = backend
+        self.namespaces = {}
+        # Set by lamia.invalidation, which evicts for the other workers
+        self.invalidation_bus = None
+        if app is not None:
+            self.init_app(app, config)
+
+    def _setting(self, name: str, cast: type) -> Any:
+        """Returns a configured setting, or its default."""
+        if self.config is None:
+            return DEFAULTS[name]
+        return self.config(name, cast=cast, default=DEFAULTS[name])
+
+    @property
+    def backend(self):
+        """The configured cache backend."""
+        if self._backend is None:
+            self._backend = backend_for(
+                self._setting('CACHE_URL', str),
+                self._setting('CACHE_MAX_SIZE', int),
+                self._setting('CACHE_TIMEOUT', float))
+        return self._backend
+
+    @property
+    def prefix(self) -> str:
+        """Put in front of every key."""
+        return self._setting('CACHE_PREFIX', str)
+
+    @property
+    def default_ttl(self) -> int:
+        """The ttl for entries that aren't given one (0 for none)."""
+        return self._setting('CACHE_DEFAULT_TTL', int)
+
+    def namespace(self, name: str, ttl: float = None) -> CacheNamespace:
+        """Returns the namespace with a name, creating it the first time."""
+        if name not in self.namespaces:
+            self.namespaces[name] = CacheNamespace(self, name, ttl)
+        return self.namespaces[name]
+
+    async def evict(self, key: str) -> None:
+        """Removes a 'namespace:key' key, or everything in every namespace
+        when key is None. Called by the invalidation bus.
+        """
+        if key is None:
+            for namespace in list(self.namespaces.values()):
+                await namespace.clear()
+            return
+        name, key = key.split(':', 1)
+        await self.namespace(name).delete(key)
+
+    def stats(self) -> dict:
+        """Returns a dictionary of counters for every namespace, along with
+        the backend's own (under 'backend').
+        """
+        stats = {
+            name: namespace.stats()
+            for name, namespace in self.namespaces.items()
+        }
+        stats['backend'] = self.backend.stats()
+        return stats
+
+    async def _startup(self) -> None:
+        """
+        Startup function intended to be ran on application start.
+
+        Returns: none
+        """
+        try:
+            await self.backend.connect()
+        except CacheException:
+            # Commands try to connect again, so this isn't fatal
+            logging.exception(_("Cache: Could not connect at startup"))
+        logging.debug(_("Cache: Started"))
+
+    async def _shutdown(self) -> None:
+        """
+        Internal method to clean up on starlette server close.
+        """
+        if self._backend is not None:
+            await self._backend.close()
@@ -0,0 +1,179 @@
+"""Lamia wrapper around aiohttp's client session.
+
+Every outbound federation request (webfinger lookups, fetching actors and
+objects, delivering activities) should go through the one, app-lifetime
+client here so that connections, DNS lookups and TLS sessions are reused
+instead of being set up and torn down for every single request.
+
+Adds the following configuration settings:
+
+HTTP_CONNECTION_LIMIT: Total number of simultaneous outbound connections.
+    Defaults to 100.
+
+HTTP_CONNECTION_LIMIT_PER_HOST: Number of simultaneous connections to any
+    one remote host, so that one slow instance can't hog the pool.
+    Defaults to 8.
+
+HTTP_DNS_CACHE_TTL: Seconds to remember DNS lookups for. Defaults to 300.
+
+HTTP_KEEPALIVE_TIMEOUT: Seconds to keep an idle connection open for reuse.
+    Defaults to 30.
+
+HTTP_TIMEOUT: Total number of seconds a request may take. Defaults to 30.
+
+HTTP_CONNECT_TIMEOUT: Number of seconds to wait for a connection.
+    Defaults to 10.
+"""
+from typing import Any
+
+import aiohttp
+import ujson as json
+from starlette.applications import Starlette
+from starlette.config import Config
+
+from lamia.logging import logging
+from lamia.translation import _
+from lamia.version import VERSION
+
+DEFAULTS = {
+    'HTTP_CONNECTION_LIMIT': 100,
+    'HTTP_CONNECTION_LIMIT_PER_HOST': 8,
+    'HTTP_DNS_CACHE_TTL': 300,
+    'HTTP_KEEPALIVE_TIMEOUT': 30,
+    'HTTP_TIMEOUT': 30,
+    'HTTP_CONNECT_TIMEOUT': 10,
+}
+
+
+class HttpClient():
+    """
+    Lamia wrapper around aiohttp.ClientSession
+
+    Pluggable into any starlette app.
+
+    app: the starlette app to register to HttpClient
+    config: The starlette configuration object
+
+    raises: Value error if only app is provided an argument.
+    """
+
+    def init_app(self, app: Starlette, config: Config) -> None:
+        """
+        Register the starlette app with the http client.
+
+        App: the starlette app
+        config: lamia's config
+
+        Returns: none
+        """
+        self.config = config
+        app.add_event_handler('startup', self._startup)
+        app.add_event_handler('shutdown', self._shutdown)
+
+    def __init__(self, app: Starlette = None, config: Config = None):
+        if (app is not None) and (config is None):
+            raise ValueError(
+                "A starlette app was provided, but no configuration.")
+        self.config = config
+        self._session = None
+        self.requests = 0
+        if app is not None:
+            self.init_app(app, config)
+
+    def _setting(self, name: str) -> int:
+        """Returns a configured integer setting, or its default."""
+        if self.config is None:
+            return DEFAULTS[name]
+        return self.config(name, cast=int, default=DEFAULTS[name])
+
+    async def _startup(self) -> None:
+        """
+        Startup function intended to be ran on application start.
+
+        Returns: none
+        """
+        if self._session is not None:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self._setting('HTTP_CONNECTION_LIMIT'),
+            limit_per_host=self._setting('HTTP_CONNECTION_LIMIT_PER_HOST'),
+            use_dns_cache=True,
+            ttl_dns_cache=self._setting('HTTP_DNS_CACHE_TTL'),
+            keepalive_timeout=self._setting('HTTP_KEEPALIVE_TIMEOUT'),
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self._setting('HTTP_TIMEOUT'),
+            connect=self._setting('HTTP_CONNECT_TIMEOUT'),
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            # Gotta be a good neighbor
+            headers={'User-Agent': f'Lamia/{VERSION}'},
+            json_serialize=json.dumps,
+        )
+        logging.debug(_("HTTP: Client session started"))
+
+    async def _shutdown(self) -> None:
+        """
+        Internal method to clean up on starlette server close.
+        """
+        if self._session is not None:
+            logging.info(_("HTTP: Closing outbound connections"))
+            await self._session.close()
+            self._session = None
+
+    async def session(self) -> aiohttp.ClientSession:
+        """Returns the shared client session, starting it if the app hasn't
+        (handy for scripts and tests that don't run the app lifecycle).
+        """
+        if self._session is None:
+            await self._startup()
+        return self._session
+
+    async def request(self, method: str, url: str,
+                      **kwargs) -> aiohttp.ClientResponse:
+        """Makes a request using the shared session. The response should be
+        used as an async context manager so the connection is released back
+        into the pool:
+
+        async with await client.request('GET', url) as response:
+            ...
+        """
+        session = await self.session()
+        self.requests += 1
+        return await session.request(method, url, **kwargs)
+
+    async def get_json(self, url: str, **kwargs) -> Any:
+        """GETs a url and returns the decoded json body."""
+        async with await self.request('GET', url, **kwargs) as response:
+            response.raise_for_status()
+            return json.loads(await response.read())
+
+    def stats(self) -> dict:
+        """Returns a dictionary of connection pool statistics."""
+        # pylint: disable=protected-access
+        # aiohttp doesn't have a public api for any of this
+        if self._session is None:
+            return {'started': False, 'requests': self.requests}
+
+        connector = self._session.connector
+        idle = {
+            f'{key.host}:{key.port}': len(connections)
+            for key, connections in connector._conns.items()
+        }
+        in_use = {
+            f'{key.host}:{key.port}': len(connections)
+            for key, connections in connector._acquired_per_host.items()
+        }
+        return {
+            'started': True,
+            'requests': self.requests,
+            'limit': connector.limit,
+            'limit_per_host': connector.limit_per_host,
+            'in_use': len(connector._acquired),
+            'idle': sum(idle.values()),
+            'in_use_per_host': in_use,
+            'idle_per_host': idle,
+        }
@@ -0,0 +1,324 @@
+"""Telling every lamia worker when cached things have changed.
+
+Each worker keeps its own in-process caches (the local webfinger index, the
+memory cache backend, settings), so a write handled by one worker leaves
+the others holding stale copies. The invalidation bus fixes that with
+postgres' LISTEN/NOTIFY: writers publish the keys that they've changed on
+a notification channel, and every worker keeps one connection from the
+database pool listening on that channel and evicts whatever it's told to.
+
+Keys look like 'topic:rest' ('webfinger:lamia', 'cache:actors:<uri>', or
+just 'settings'). Handlers subscribe to a topic and are called with the
+rest of the key, or with None when everything in the topic may be stale
+(after the listening connection has been lost and opened again, since any
+notifications sent in between are gone).
+
+Publishing evicts in the publishing worker straight away (unless it says
+it's already up to date, with local=False). The keys are
+then gathered up for a moment, so that a burst of writes turns into one
+notification, and sent to the other workers. Publish after the write has
+committed, or other workers may reload the old value.
+
+Usage:
+
+bus.subscribe('webfinger', webfinger_changed)
+bus.publish('webfinger:lamia')
+
+Adds the following configuration settings:
+
+INVALIDATION_CHANNEL: The postgres notification channel to use.
+    Defaults to lamia_invalidation.
+
+INVALIDATION_DELAY: Milliseconds to gather up published keys for before
+    notifying the other workers. Defaults to 50.
+
+INVALIDATION_RECONNECT_DELAY: Seconds between checks that the listening
+    connection is still alive (and between attempts to open it again when
+    it isn't). Defaults to 5.
+"""
+import asyncio
+import os
+import uuid
+from typing import Any, Callable, Iterable, List
+
+import sqlalchemy as sa
+import ujson as json
+from starlette.applications import Starlette
+from starlette.config import Config
+
+from lamia.logging import logging
+from lamia.translation import _
+
+DEFAULTS = {
+    'INVALIDATION_CHANNEL': 'lamia_invalidation',
+    'INVALIDATION_DELAY': 50,
+    'INVALIDATION_RECONNECT_DELAY': 5,
+}
+
+# Postgres refuses notification payloads of 8000 bytes or more
+MAX_PAYLOAD_SIZE = 7900
+
+Handler = Callable[[str], Any]
+
+
+def split_key(key: str) -> tuple:
+    """Splits a key into its topic and the rest (None if there isn't any)."""
+    topic, separator, rest = key.partition(':')
+    return topic, (rest if separator and rest else None)
+
+
+def encode_payloads(origin: str, keys: Iterable[str]) -> List[str]:
+    """Encodes keys into as few notification payloads as will fit."""
+    payloads = []
+    batch = []
+    size = 0
+    for key in sorted(keys):
+        # (the quotes and comma around each key)
+        key_size = len(json.dumps(key)) + 1
+        if batch and size + key_size > MAX_PAYLOAD_SIZE:
+            payloads.append(json.dumps({'origin': origin, 'keys': batch}))
+            batch, size = [], 0
+        batch.append(key)
+        size += key_size
+    if batch:
+        payloads.append(json.dumps({'origin': origin, 'keys': batch}))
+    return payloads
+
+
+class InvalidationBus():
+    """
+    Cross-worker cache invalidation over postgres LISTEN/NOTIFY.
+
+    Pluggable into any starlette app.
+
+    app: the starlette app to register to InvalidationBus
+    config: The starlette configuration object
+    database: the gino database whose pool to listen and notify with
+
+    raises: Value error if only app is provided an argument.
+    """
+
+    def init_app(self, app: Starlette, config: Config) -> None:
+        """
+        Register the starlette app with the invalidation bus.
+
+        App: the starlette app
+        config: lamia's config
+
+        Returns: none
+        """
+        self.config = config
+        app.add_event_handler('startup', self._startup)
+        app.add_event_handler('shutdown', self._shutdown)
+
+    def __init__(self, app: Starlette = None, config: Config = None,
+                 database=None):
+        if (app is not None) and (config is None):
+            raise ValueError(
+                "A starlette app was provided, but no configuration.")
+        self.config = config
+        self.database = database
+        # Tells this worker's notifications apart from everyone else's
+        self.origin = f'{os.getpid()}-{uuid.uuid4().hex}'
+        self.handlers = {}
+
+        self._pending = set()
+        self._flush_task = None
+        self._listen_task = None
+        self._connection = None
+
+        self.published = 0
+        self.notifications = 0
+        self.received = 0
+        self.reconnects = 0
+
+        if app is not None:
+            self.init_app(app, config)
+
+    def _setting(self, name: str, cast: type) -> Any:
+        """Returns a configured setting, or its default."""
+        if self.config is None:
+            return DEFAULTS[name]
+        return self.config(name, cast=cast, default=DEFAULTS[name])
+
+    @property
+    def channel(self) -> str:
+        """The notification channel."""
+        return self._setting('INVALIDATION_CHANNEL', str)
+
+    def subscribe(self, topic: str, handler: Handler) -> None:
+        """Calls handler with the rest of every key published in topic
+        (or None, when everything in the topic should go). Handlers may be
+        coroutine functions.
+        """
+        self.handlers.setdefault(topic, []).append(handler)
+
+    def dispatch(self, keys: Iterable[str]) -> None:
+        """Runs the handlers for some keys in this worker."""
+        for key in keys:
+            topic, rest = split_key(key)
+            for handler in self.handlers.get(topic, ()):
+                self._call(handler, rest)
+
+    def dispatch_all(self) -> None:
+        """Tells every handler that everything may be stale."""
+        for handlers in self.handlers.values():
+            for handler in handlers:
+                self._call(handler, None)
+
+    @staticmethod
+    def _call(handler: Handler, rest: str) -> None:
+        try:
+            result = handler(rest)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception(_("Invalidation: Handler failed"))
+
+    def publish(self, *keys: str, local: bool = True) -> None:
+        """Invalidates keys in this worker now, and in every other worker
+        shortly after.
+
+        local - False to only tell the other workers, when this one has
+            already updated its own copy
+        """
+        self.published += len(keys)
+        if local:
+            self.dispatch(keys)
+        if self.database is None:
+            return
+
+        self._pending.update(keys)
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        """Waits for a burst of publishes to finish, then flushes."""
+        try:
+            await asyncio.sleep(
+                self._setting('INVALIDATION_DELAY', int) / 1000)
+        finally:
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Notifies the other workers of every pending key."""
+        keys, self._pending = self._pending, set()
+        if not keys:
+            return
+
+        for payload in encode_payloads(self.origin, keys):
+            try:
+                await self.database.scalar(
+                    sa.select([sa.func.pg_notify(self.channel, payload)]))
+                self.notifications += 1
+            except Exception:  # pylint: disable=broad-except
+                logging.exception(_("Invalidation: Could not notify"))
+
+    def handle_notification(self, connection, pid: int, channel: str,
+                            payload: str) -> None:  # pylint: disable=unused-argument
+        """The LISTEN callback. Evicts the keys that another worker
+        published.
+        """
+        try:
+            message = json.loads(payload)
+            origin, keys = message['origin'], message['keys']
+        except (ValueError, KeyError, TypeError):
+            logging.warning(_("Invalidation: Ignored a malformed payload"))
+            return
+        if origin == self.origin:
+            return
+
+        self.received += len(keys)
+        self.dispatch(keys)
+
+    async def listen(self) -> None:
+        """Takes a connection from the pool and listens on the channel."""
+        connection = await self.database.acquire(lazy=False)
+        try:
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.add_listener(self.channel,
+                                              self.handle_notification)
+        except Exception:
+            await connection.release()
+            raise
+        self._connection = connection
+
+    async def _unlisten(self) -> None:
+        """Gives the listening connection back to the pool."""
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        try:
+            raw_connection = await connection.get_raw_connection()
+            if not raw_connection.is_closed():
+                await raw_connection.remove_listener(
+                    self.channel, self.handle_notification)
+            await connection.release()
+        except Exception:  # pylint: disable=broad-except
+            logging.exception(_("Invalidation: Could not release connection"))
+
+    async def _is_listening(self) -> bool:
+        if self._connection is None:
+            return False
+        raw_connection = await self._connection.get_raw_connection()
+        return not raw_connection.is_closed()
+
+    async def _listen_forever(self) -> None:
+        """Keeps the listening connection alive, opening it again when it
+        drops (and telling every handler that it may have missed
+        something).
+        """
+        delay = self._setting('INVALIDATION_RECONNECT_DELAY', int)
+        lost = False
+        while True:
+            if not await self._is_listening():
+                lost = lost or self._connection is not None
+                await self._unlisten()
+                try:
+                    await self.listen()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception(_("Invalidation: Could not listen"))
+                    lost = True
+                else:
+                    if lost:
+                        # Anything sent while we weren't listening is gone
+                        self.reconnects += 1
+                        self.dispatch_all()
+                        lost = False
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        """Returns a dictionary of counters for metrics and debugging."""
+        return {
+            'published': self.published,
+            'notifications': self.notifications,
+            'received': self.received,
+            'reconnects': self.reconnects,
+            'pending': len(self._pending),
+            'listening': self._connection is not None,
+        }
+
+    async def _startup(self) -> None:
+        """
+        Startup function intended to be ran on application start.
+
+        Returns: none
+        """
+        if self.database is not None and self._listen_task is None:
+            self._listen_task = asyncio.ensure_future(self._listen_forever())
+
+    async def _shutdown(self) -> None:
+        """
+        Internal method to clean up on starlette server close.
+        """
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+            self._listen_task = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self._unlisten()
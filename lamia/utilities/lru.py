@@ -0,0 +1,125 @@
+"""A small, dependency free, size bounded LRU cache with optional expiry.
+
+This exists for the bits of lamia that want to remember expensive results
+(parsed keys, verified signatures, webfinger lookups) in-process without
+pulling in a full caching layer. Entries are evicted in least recently used
+order once max_size is reached, and entries older than their ttl are treated
+as missing.
+
+Every read and change of the entries happens under a lock, so one cache can
+be shared by threads (the http signature worker pool, for one).
+
+Usage:
+
+cache = LRUCache(max_size=512, ttl=300)
+cache.set('key', 'value')
+cache.get('key')  # 'value'
+cache.stats()  # {'hits': 1, 'misses': 0, ...}
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable
+
+_MISSING = object()
+
+
+class LRUCache:
+    """A size bounded least recently used cache.
+
+    max_size - the number of entries to keep before evicting the oldest
+    ttl - the default number of seconds that an entry lives for (None for
+        entries that only leave when evicted or invalidated)
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = None) -> None:
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+
+        self.max_size = max_size
+        self.ttl = ttl
+        # Maps key -> (expires_at or None, value)
+        self._entries = OrderedDict()
+        # Public, so that whatever wraps a cache can keep its own counters
+        # under the same lock
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None,
+            count: bool = True) -> Any:
+        """Returns the cached value for key or default when the key is
+        missing or expired. Counts toward hits/misses unless count is False.
+        """
+        with self.lock:
+            try:
+                expires_at, value = self._entries[key]
+            except KeyError:
+                if count:
+                    self.misses += 1
+                return default
+
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                if count:
+                    self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        """Stores a value, evicting the least recently used entry if the
+        cache is full. A ttl given here overrides the cache's default ttl.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+
+        with self.lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def keys(self) -> list:
+        """Returns a snapshot of the keys currently held (expired or not)."""
+        with self.lock:
+            return list(self._entries.keys())
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Removes a single key. Returns True if anything was removed."""
+        with self.lock:
+            return self._entries.pop(key, _MISSING) is not _MISSING
+
+    def invalidate_many(self, keys: Iterable[Hashable]) -> int:
+        """Removes several keys, returning the number removed."""
+        return sum(1 for key in keys if self.invalidate(key))
+
+    def clear(self) -> None:
+        """Drops every entry. Counters are left alone."""
+        with self.lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns a dictionary of counters for metrics and debugging."""
+        with self.lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
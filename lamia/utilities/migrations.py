@@ -0,0 +1,196 @@
+"""Bringing an existing database up to date with lamia's models.
+
+`lamia-db init-db` creates everything from scratch, but a database that's
+already in use needs the columns and indexes added since it was created,
+without locking up the tables while it happens. This compares the database
+against the models' metadata and works out what's missing:
+
+- tables that don't exist yet (created as usual)
+- columns that don't exist yet (added as nullable columns)
+- indexes that don't exist yet, or that a failed build left invalid
+  (built with CREATE INDEX CONCURRENTLY, so reads and writes carry on)
+
+Usage (with every model imported, so that the metadata is complete):
+
+report = await check_database(db)
+for statement in plan_migration(db, report):
+    ...
+await migrate_database(db)
+"""
+from collections import namedtuple
+from typing import Callable, List
+
+from sqlalchemy import MetaData, Index, Table
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable, CreateIndex
+
+DIALECT = postgresql.dialect()
+
+# missing_tables - names of tables that aren't in the database
+# missing_columns - (table name, column name) pairs that aren't either
+# missing_indexes - names of indexes that aren't either
+# invalid_indexes - names of indexes that exist but aren't usable (a
+#     concurrent build that failed part way leaves one of these behind)
+MigrationReport = namedtuple(
+    'MigrationReport',
+    'missing_tables missing_columns missing_indexes invalid_indexes')
+
+EXISTING_TABLES_SQL = '''
+SELECT table_name FROM information_schema.tables
+WHERE table_schema = current_schema()
+'''
+
+EXISTING_COLUMNS_SQL = '''
+SELECT table_name, column_name FROM information_schema.columns
+WHERE table_schema = current_schema()
+'''
+
+EXISTING_INDEXES_SQL = '''
+SELECT index_class.relname, pg_index.indisvalid
+FROM pg_index
+JOIN pg_class AS index_class ON index_class.oid = pg_index.indexrelid
+JOIN pg_namespace ON pg_namespace.oid = index_class.relnamespace
+WHERE pg_namespace.nspname = current_schema()
+'''
+
+
+def is_clean(report: MigrationReport) -> bool:
+    """Returns True if the report found nothing to do."""
+    return not any(report)
+
+
+def model_indexes(metadata: MetaData) -> List[Index]:
+    """Returns every index declared on the models, ordered by name."""
+    indexes = [
+        index for table in metadata.tables.values() for index in table.indexes
+    ]
+    return sorted(indexes, key=lambda index: index.name)
+
+
+def create_index_sql(index: Index) -> str:
+    """Returns a CREATE INDEX CONCURRENTLY IF NOT EXISTS statement."""
+    sql = str(CreateIndex(index).compile(dialect=DIALECT))
+    return sql.replace(' INDEX ', ' INDEX CONCURRENTLY IF NOT EXISTS ', 1)
+
+
+def drop_index_sql(name: str) -> str:
+    """Returns a DROP INDEX CONCURRENTLY IF EXISTS statement."""
+    name = DIALECT.identifier_preparer.quote(name)
+    return f'DROP INDEX CONCURRENTLY IF EXISTS {name}'
+
+
+def add_column_sql(table: Table, column_name: str) -> str:
+    """Returns an ALTER TABLE statement adding a (nullable) column."""
+    preparer = DIALECT.identifier_preparer
+    column = table.c[column_name]
+    return (f'ALTER TABLE {preparer.format_table(table)} '
+            f'ADD COLUMN IF NOT EXISTS {preparer.format_column(column)} '
+            f'{column.type.compile(dialect=DIALECT)}')
+
+
+def compare(metadata: MetaData, tables: set, columns: set,
+            indexes: dict) -> MigrationReport:
+    """Compares the metadata against what's in the database.
+
+    tables - the names of the tables in the database
+    columns - (table name, column name) pairs in the database
+    indexes - maps the names of indexes in the database to whether they're
+        valid
+    """
+    # (in dependency order, so that foreign keys have something to point at)
+    missing_tables = [
+        table.name for table in metadata.sorted_tables
+        if table.name not in tables
+    ]
+    missing_columns = [(table.name, column.name)
+                       for table in metadata.sorted_tables
+                       if table.name in tables for column in table.columns
+                       if (table.name, column.name) not in columns]
+    missing_indexes = []
+    invalid_indexes = []
+    for index in model_indexes(metadata):
+        if index.name not in indexes:
+            missing_indexes.append(index.name)
+        elif not indexes[index.name]:
+            invalid_indexes.append(index.name)
+
+    return MigrationReport(missing_tables, missing_columns, missing_indexes,
+                           invalid_indexes)
+
+
+def plan_migration(metadata: MetaData, report: MigrationReport) -> List[str]:
+    """Returns the statements that fix everything in a report, in order.
+
+    New tables come with their indexes, so those indexes aren't built
+    concurrently (there's nothing in a new table to lock out).
+    """
+    statements = []
+    new_table_indexes = set()
+    for name in report.missing_tables:
+        table = metadata.tables[name]
+        statements.append(str(CreateTable(table).compile(dialect=DIALECT)))
+        for index in table.indexes:
+            statements.append(str(CreateIndex(index).compile(dialect=DIALECT)))
+            new_table_indexes.add(index.name)
+
+    for table_name, column_name in report.missing_columns:
+        statements.append(
+            add_column_sql(metadata.tables[table_name], column_name))
+
+    indexes = {index.name: index for index in model_indexes(metadata)}
+    for name in report.invalid_indexes:
+        statements.append(drop_index_sql(name))
+        statements.append(create_index_sql(indexes[name]))
+    for name in report.missing_indexes:
+        if name not in new_table_indexes:
+            statements.append(create_index_sql(indexes[name]))
+
+    return [statement.strip() for statement in statements]
+
+
+async def check_database(db) -> MigrationReport:
+    """Compares a gino database against its models' metadata."""
+    tables = {row[0] for row in await db.all(EXISTING_TABLES_SQL)}
+    columns = {(row[0], row[1]) for row in await db.all(EXISTING_COLUMNS_SQL)}
+    indexes = {row[0]: row[1] for row in await db.all(EXISTING_INDEXES_SQL)}
+    return compare(db, tables, columns, indexes)
+
+
+async def migrate_database(db, echo: Callable[[str], None] = None,
+                           dry_run: bool = False) -> List[str]:
+    """Brings a gino database up to date with its models.
+
+    Statements run one at a time, outside of any transaction (concurrent
+    index builds can't run inside of one). A statement that fails (say, a
+    unique index over rows that aren't unique yet) is reported through echo
+    and the rest carry on; a half built index is dropped again so that it
+    doesn't slow down writes. Returns the statements that failed.
+    """
+    echo = echo or (lambda message: None)
+    report = await check_database(db)
+    failed = []
+
+    statements = plan_migration(db, report)
+    if dry_run:
+        for statement in statements:
+            echo(statement)
+        return failed
+
+    async with db.acquire() as connection:
+        # Straight to asyncpg, which sends statements without arguments as
+        # simple queries (outside of any implicit transaction)
+        raw_connection = connection.raw_connection
+        for statement in statements:
+            echo(statement)
+            try:
+                await raw_connection.execute(statement)
+            except Exception as exception:  # pylint: disable=broad-except
+                echo(f'  failed: {exception}')
+                failed.append(statement)
+
+        if failed:
+            for name in (await check_database(db)).invalid_indexes:
+                echo(drop_index_sql(name))
+                await raw_connection.execute(drop_index_sql(name))
+
+    return failed
@@ -0,0 +1,151 @@
+"""A byte-level cache for responses that rarely change.
+
+Some endpoints (nodeinfo, for one) build and encode the same document on
+every request, even though it only changes now and then. Wrapping a view in
+cached_response keeps the encoded body of its last response along with an
+ETag, serves that body with a Cache-Control header until the response's
+version changes, and answers requests that already have it (a matching
+If-None-Match) with a body-less 304.
+
+A version is any hashable value that changes whenever the response would
+(lamia's version and the site statistics' generation, say). Whenever the
+version function returns something new, the cached body is thrown away and
+the view is called again.
+
+Usage:
+
+@cached_response(max_age=300, version=lambda: VERSION)
+async def some_view(request: Request) -> Response:
+    ...
+"""
+import functools
+import hashlib
+from collections import namedtuple
+from typing import Awaitable, Callable, Hashable
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from lamia.utilities.lru import LRUCache
+
+# The most responses to remember across every cached view
+RESPONSE_CACHE_SIZE = 256
+
+# body - the encoded body
+# media_type - the content-type header of the original response
+# etag - a strong ETag for the body
+# version - the version that the body was built for
+CachedBody = namedtuple('CachedBody', 'body media_type etag version')
+
+View = Callable[[Request], Awaitable[Response]]
+
+
+def make_etag(body: bytes) -> str:
+    """Returns a strong ETag for a body."""
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Checks an If-None-Match header against an ETag, using the weak
+    comparison that RFC 7232 asks for.
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """Remembers encoded response bodies, keyed by view and cache key.
+
+    max_size - the most bodies to hold on to
+    """
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE) -> None:
+        self.bodies = LRUCache(max_size=max_size)
+        self.not_modified = 0
+
+    def get(self, key: Hashable, version: Hashable) -> CachedBody:
+        """Returns the cached body for a key, or None if there isn't one for
+        this version.
+        """
+        cached = self.bodies.get(key)
+        if cached is None or cached.version != version:
+            return None
+        return cached
+
+    def set(self, key: Hashable, version: Hashable,
+            response: Response) -> CachedBody:
+        """Remembers the body of a response."""
+        body = bytes(response.body)
+        cached = CachedBody(body, response.headers.get('content-type'),
+                            make_etag(body), version)
+        self.bodies.set(key, cached)
+        return cached
+
+    def clear(self) -> None:
+        """Forgets every cached body."""
+        self.bodies.clear()
+
+    def stats(self) -> dict:
+        """Returns a dictionary of counters for metrics and debugging."""
+        stats = self.bodies.stats()
+        stats['not_modified'] = self.not_modified
+        return stats
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+def cached_response(max_age: int = 60,
+                    key: Callable[[Request], Hashable] = None,
+                    version: Callable[[], Hashable] = None,
+                    cache: ResponseCache = None) -> Callable[[View], View]:
+    """Decorates a view so that its responses are cached as bytes.
+
+    max_age - the max-age given to clients in Cache-Control, in seconds
+    key - returns the part of a request that the response depends on (by
+        default, responses don't depend on the request at all)
+    version - returns the current version of the response (by default,
+        responses never change)
+    cache - the cache to keep responses in (RESPONSE_CACHE if None)
+
+    Only 200 responses are cached; anything else is passed along untouched.
+    """
+    cache_control = f'public, max-age={max_age}'
+
+    def decorator(view: View) -> View:
+        view_name = f'{view.__module__}.{view.__qualname__}'
+
+        @functools.wraps(view)
+        async def cached_view(request: Request) -> Response:
+            response_cache = RESPONSE_CACHE if cache is None else cache
+            cache_key = (view_name, None if key is None else key(request))
+            current = None if version is None else version()
+
+            cached = response_cache.get(cache_key, current)
+            if cached is None:
+                response = await view(request)
+                if response.status_code != 200:
+                    return response
+                cached = response_cache.set(cache_key, current, response)
+
+            headers = {'etag': cached.etag, 'cache-control': cache_control}
+            if etag_matches(request.headers.get('if-none-match'), cached.etag):
+                response_cache.not_modified += 1
+                return Response(b'', status_code=304, headers=headers)
+
+            if cached.media_type is not None:
+                headers['content-type'] = cached.media_type
+            return Response(cached.body, headers=headers)
+
+        return cached_view
+
+    return decorator
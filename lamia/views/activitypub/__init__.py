@@ -0,0 +1,13 @@
+"""Views that speak activitypub (and its neighbors, webfinger and nodeinfo)."""
+from starlette.responses import Response
+
+# The media type that activitypub documents are served as
+ACTIVITY_MEDIA_TYPE = 'application/activity+json'
+
+
+class ActivityResponse(Response):
+    """A response for activitypub documents. Give it the bytes from
+    Schema.to_lamia_json_ld_bytes (which can be reused for the body of any
+    deliveries) so that the document isn't encoded again here.
+    """
+    media_type = ACTIVITY_MEDIA_TYPE
@@ -13,9 +13,26 @@ from starlette.responses import JSONResponse
 from starlette.requests import Request
 from lamia.utilities import get_request_base_url
 from lamia.utilities import get_site_stats
+from lamia.utilities.responses import cached_response
+from lamia.settings import SETTINGS
+from lamia.stats import SITE_STATS
 from lamia.version import VERSION, NAME, DESCRIPTION
 
+# How long clients may hold on to nodeinfo documents, in seconds
+NODEINFO_MAX_AGE = 300
 
+
+def nodeinfo_version() -> tuple:
+    """Nodeinfo documents change with lamia's version, its statistics and
+    its settings.
+    """
+    return (VERSION, SITE_STATS.snapshot().generation, SETTINGS.generation)
+
+
+@cached_response(
+    max_age=NODEINFO_MAX_AGE,
+    key=get_request_base_url,
+    version=lambda: VERSION)
 async def nodeinfo_index(request: Request) -> JSONResponse:
     """Replies to a request with a JSON Resource Descriptor (JRD) document that
     references lamia's implemented nodeinfo schema(s).
@@ -31,6 +48,7 @@ async def nodeinfo_index(request: Request) -> JSONResponse:
     })
 
 
+@cached_response(max_age=NODEINFO_MAX_AGE, version=nodeinfo_version)
 async def nodeinfo_schema_20(request: Request) -> JSONResponse:  # pylint: disable=unused-argument
     """Provides a basic implementation of nodeinfo's 2.0 schema."""
     site_stats = await get_site_stats()
@@ -53,7 +71,9 @@ async def nodeinfo_schema_20(request: Request) -> JSONResponse:  # pylint: disab
             'openRegistrations': site_stats['open_registration'],
             'usage': {
                 'users': {
-                    'total': site_stats['local_users']
+                    'total': site_stats['local_users'],
+                    'activeMonth': site_stats['active_month'],
+                    'activeHalfyear': site_stats['active_halfyear']
                 },
                 'localPosts': site_stats['local_posts']
             }
@@ -0,0 +1,34 @@
+"""This module contains the view for answering webfinger queries about local
+users. Remote servers ask this before they follow or mention anyone here.
+
+> https://tools.ietf.org/html/rfc7033
+
+Answers come straight out of an in-memory index of prebuilt documents (see
+lamia.activitypub.local_webfinger), so this doesn't query the database on
+the hot path.
+"""
+from starlette.responses import Response
+from starlette.requests import Request
+from lamia.activitypub.local_webfinger import LOCAL_WEBFINGER
+
+JRD_HEADERS = {
+    # Anybody can ask, and everybody may remember the answer for a while
+    'Access-Control-Allow-Origin': '*',
+    'Cache-Control': 'max-age=3600, public',
+}
+
+
+async def webfinger_resource(request: Request) -> Response:
+    """Replies to a webfinger query with a JSON Resource Descriptor (JRD)
+    for a local user, given either an acct: resource or an actor's url.
+    """
+    resource = request.query_params.get('resource')
+    if not resource:
+        return Response(status_code=400)
+
+    document = await LOCAL_WEBFINGER.lookup(resource)
+    if document is None:
+        return Response(status_code=404)
+
+    return Response(
+        document, media_type='application/jrd+json', headers=JRD_HEADERS)
@@ -6,11 +6,13 @@ import pendulum
 from email_validator import validate_email, EmailSyntaxError, EmailUndeliverableError
 from graphql import GraphQLError
 from lamia.translation import _
-from lamia.config import BASE_URL
+from lamia.config import BASE_URL, ED25519_KEYS
 from lamia.views.graph.objecttypes import IdentityObjectType
 from lamia.models.features import Identity, Account
 from lamia.models.oauth import OauthToken
 from lamia.activitypub.schema import ActorSchema
+from lamia.invalidation import bus
+from lamia.stats import SITE_STATS
 
 ALLOWED_NAME_CHARACTERS_RE = re.compile(r'^[a-zA-Z_]+$')
 
@@ -123,7 +125,8 @@ class RegisterUser(graphene.Mutation):
         actor.name = user_name
         actor.preferredUsername = user_name
         actor_model = actor.to_model()
-        actor_model.generate_keys()
+        actor_model.local = True
+        actor_model.generate_keys(ed25519=ED25519_KEYS)
         await actor_model.create()
 
         identity_model = Identity()
@@ -143,6 +146,10 @@ class RegisterUser(graphene.Mutation):
         account_model.set_password(password)
         await account_model.create()
         await identity_model.update(account_id=account_model.id).apply()
+        # Adds the user to the webfinger index, here and in every other
+        # worker
+        bus.publish(f'webfinger:{user_name}')
+        SITE_STATS.users_created()
 
         new_identity = IdentityObjectType(
             display_name=user_name,
@@ -11,14 +11,21 @@ from lamia.models.features import *
 from lamia.models.moderation import *
 from lamia.models.oauth import *
 
-from lamia.database import db
+from lamia.database import db, loop
 from lamia.config import DEV_CONFIG
 
 if not DEV_CONFIG:
     raise Exception('Please create a lamia.dev.config file before running tests.')
 
+@pytest.fixture
+def event_loop():
+    # The database pool only works on the loop that it was opened on, so
+    # async tests run there instead of on a new loop each
+    asyncio.set_event_loop(loop)
+    yield loop
+
 @pytest.fixture(scope='session')
 def gino_db():
-    asyncio.get_event_loop().run_until_complete(db.gino.create_all())
+    loop.run_until_complete(db.gino.create_all())
     yield db
-    asyncio.get_event_loop().run_until_complete(db.gino.drop_all())
+    loop.run_until_complete(db.gino.drop_all())
@@ -0,0 +1,210 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import asyncio
+import fnmatch
+
+import pytest
+
+from lamia.utilities.cache import Cache, MemoryBackend, RedisBackend
+from lamia.utilities.cache import CacheException, backend_for, encode_command
+from lamia.utilities.cache import read_reply
+
+
+class FakeRedis:
+    """Just enough of a redis server to test RedisBackend against."""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+        self.writers = []
+        # Reads commands without ever replying
+        self.stalled = False
+
+    async def handle(self, reader, writer):
+        self.writers.append(writer)
+        while True:
+            try:
+                command = await read_reply(reader)
+            except (ConnectionResetError, asyncio.IncompleteReadError):
+                return
+            self.commands.append(command)
+            if self.stalled:
+                continue
+            writer.write(self.reply(command))
+            await writer.drain()
+
+    def reply(self, command):
+        name, args = command[0].upper(), command[1:]
+        if name == b'GET':
+            value = self.data.get(args[0])
+            return b'$-1\r\n' if value is None else self.bulk(value)
+        if name == b'MGET':
+            return b'*%d\r\n' % len(args) + b''.join(
+                b'$-1\r\n' if self.data.get(key) is None else self.bulk(
+                    self.data[key]) for key in args)
+        if name == b'AUTH':
+            return b'+OK\r\n' if args[0] == b'secret' else (
+                b'-ERR invalid password\r\n')
+        if name == b'SET':
+            self.data[args[0]] = args[1]
+            return b'+OK\r\n'
+        if name == b'DEL':
+            removed = sum(1 for key in args if self.data.pop(key, None))
+            return b':%d\r\n' % removed
+        if name == b'SCAN':
+            pattern = args[2].decode()
+            keys = [key for key in self.data
+                    if fnmatch.fnmatch(key.decode(), pattern)]
+            return b'*2\r\n' + self.bulk(b'0') + b'*%d\r\n' % len(
+                keys) + b''.join(self.bulk(key) for key in keys)
+        return b'-ERR unknown command\r\n'
+
+    @staticmethod
+    def bulk(value):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+@pytest.fixture
+async def fake_redis():
+    fake = FakeRedis()
+    server = await asyncio.start_server(fake.handle, '127.0.0.1', 0)
+    fake.port = server.sockets[0].getsockname()[1]
+    yield fake
+    server.close()
+    await server.wait_closed()
+
+
+def test_encode_command():
+    assert encode_command('SET', 'key', 10) == (
+        b'*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$2\r\n10\r\n')
+
+
+def test_backend_for():
+    assert isinstance(backend_for('memory://'), MemoryBackend)
+    redis = backend_for('redis://:secret@cache.example:6380/2')
+    assert isinstance(redis, RedisBackend)
+    assert (redis.host, redis.port, redis.password, redis.db) == (
+        'cache.example', 6380, 'secret', 2)
+    assert redis.ssl is None
+    assert backend_for('rediss://cache.example').ssl is True
+    with pytest.raises(ValueError):
+        backend_for('memcached://localhost')
+
+
+@pytest.mark.asyncio
+async def test_memory_cache():
+    cache = Cache(backend=MemoryBackend(max_size=2))
+    actors = cache.namespace('actors')
+    assert cache.namespace('actors') is actors
+
+    assert await actors.get('a', 'nope') == 'nope'
+    await actors.set('a', {'name': 'lamia'})
+    await actors.set('b', None)
+    assert await actors.get('a') == {'name': 'lamia'}
+    assert await actors.get_many(['a', 'b', 'c']) == {
+        'a': {'name': 'lamia'},
+        'b': None
+    }
+
+    # Namespaces don't share keys
+    assert await cache.namespace('other').get('a') is None
+
+    # Size bounded
+    await actors.set('c', 3)
+    assert len(cache.backend.entries) == 2
+
+    assert await actors.delete('c') == 1
+    assert await actors.clear() == 1
+
+    stats = cache.stats()
+    assert stats['actors'] == {'hits': 3, 'misses': 2, 'sets': 3, 'deletes': 1}
+    assert stats['other']['misses'] == 1
+    assert stats['backend']['size'] == 0
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_ttl():
+    cache = Cache(backend=MemoryBackend())
+    short = cache.namespace('short', ttl=0.01)
+    await short.set('a', 1)
+    await short.set('b', 2, ttl=60)
+    await asyncio.sleep(0.02)
+    assert await short.get_many(['a', 'b']) == {'b': 2}
+
+
+@pytest.mark.asyncio
+async def test_redis_cache(fake_redis):
+    backend = RedisBackend(f'redis://127.0.0.1:{fake_redis.port}')
+    cache = Cache(backend=backend)
+    actors = cache.namespace('actors', ttl=30)
+
+    await actors.set('https://example.com/u/lamia', {'name': 'lamia'})
+    assert fake_redis.commands[-1] == [
+        b'SET', b'lamia:actors:https://example.com/u/lamia',
+        b'{"name":"lamia"}', b'PX', b'30000'
+    ]
+    assert await actors.get('https://example.com/u/lamia') == {
+        'name': 'lamia'
+    }
+    assert await actors.get('missing', 0) == 0
+    assert await actors.get_many(['https://example.com/u/lamia', 'x']) == {
+        'https://example.com/u/lamia': {
+            'name': 'lamia'
+        }
+    }
+
+    # Error replies come through as exceptions, without dropping the
+    # connection
+    with pytest.raises(CacheException):
+        await backend.execute('FLUSHALL')
+    assert backend.reconnects == 0
+
+    # Dropped connections are opened again
+    fake_redis.writers[-1].close()
+    await asyncio.sleep(0.01)
+    assert await actors.get('https://example.com/u/lamia') == {
+        'name': 'lamia'
+    }
+    assert backend.reconnects == 1
+
+    assert await actors.clear() == 1
+    assert fake_redis.data == {}
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_unreachable():
+    backend = RedisBackend('redis://127.0.0.1:1')
+    with pytest.raises(CacheException):
+        await backend.get('key')
+
+
+@pytest.mark.asyncio
+async def test_redis_connect_failure(fake_redis):
+    backend = RedisBackend(f'redis://:wrong@127.0.0.1:{fake_redis.port}')
+    with pytest.raises(CacheException):
+        await backend.execute('GET', 'a')
+    # Not left looking connected after the AUTH was refused
+    assert backend.stats()['connected'] is False
+
+    backend.password = 'secret'
+    assert await backend.execute('GET', 'a') is None
+    assert fake_redis.commands[-2:] == [[b'AUTH', b'secret'], [b'GET', b'a']]
+
+
+@pytest.mark.asyncio
+async def test_redis_timeout(fake_redis):
+    backend = RedisBackend(f'redis://127.0.0.1:{fake_redis.port}',
+                           timeout=0.05)
+    fake_redis.stalled = True
+    with pytest.raises(CacheException):
+        await backend.execute('GET', 'a')
+    assert backend.stats()['timeouts'] == 1
+    # The late reply can't be mistaken for the next command's
+    assert backend.stats()['connected'] is False
+
+    fake_redis.stalled = False
+    await backend.execute('SET', 'a', '1')
+    assert await backend.execute('GET', 'a') == b'1'
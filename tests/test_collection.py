@@ -0,0 +1,135 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import pytest
+from aiohttp import web
+from lamia.activitypub.collection import CollectionWalk, CollectionException
+from lamia.activitypub.schema import ActivitySchema, ObjectSchema
+from lamia.utilities.http import HttpClient
+
+TEST_PORT = 12347
+BASE = f'http://localhost:{TEST_PORT}'
+
+
+def note(number):
+    return {
+        'id': f'{BASE}/notes/{number}',
+        'type': 'Note',
+        'url': f'{BASE}/notes/{number}',
+        'published': '2018-11-05T02:31:49Z',
+        'to': ['https://www.w3.org/ns/activitystreams#Public'],
+        'cc': [],
+    }
+
+
+def create(number):
+    return {
+        'id': f'{BASE}/activities/{number}',
+        'type': 'Create',
+        'actor': f'{BASE}/users/lamia',
+        'published': '2018-11-05T02:31:49Z',
+        'to': ['https://www.w3.org/ns/activitystreams#Public'],
+        'cc': [],
+        'object': note(number),
+    }
+
+
+PAGES = {
+    '/outbox': {
+        'type': 'OrderedCollection',
+        'totalItems': 5,
+        'first': f'{BASE}/outbox/1',
+    },
+    '/outbox/1': {
+        'type': 'OrderedCollectionPage',
+        'orderedItems': [create(1), {'type': 'Create'}, create(2)],
+        'next': f'{BASE}/outbox/2',
+    },
+    '/outbox/2': {
+        'type': 'OrderedCollectionPage',
+        'orderedItems': [create(3), note(4)],
+        # A badly behaved server pointing back at itself
+        'next': f'{BASE}/outbox/2',
+    },
+    '/followers': {
+        'type': 'OrderedCollection',
+        'first': {
+            'type': 'OrderedCollectionPage',
+            'orderedItems': [f'{BASE}/users/a', f'{BASE}/users/b'],
+        },
+    },
+    '/huge': {'type': 'OrderedCollection', 'orderedItems': ['x' * 2048]},
+}
+
+
+@pytest.fixture
+async def collection_server():
+    requested = []
+
+    async def handler(request):
+        requested.append(request.path)
+        if request.path not in PAGES:
+            return web.Response(status=404)
+        return web.json_response(PAGES[request.path])
+
+    app = web.Application()
+    app.router.add_get('/{path:.*}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, 'localhost', TEST_PORT)
+    await site.start()
+    yield requested
+    await runner.cleanup()
+
+
+@pytest.fixture
+async def client():
+    client = HttpClient()
+    yield client
+    await client._shutdown()
+
+
+@pytest.mark.asyncio
+async def test_collection_walk(collection_server, client):
+    walk = CollectionWalk(f'{BASE}/outbox', client=client)
+    items = [item async for item in walk]
+
+    assert [type(item) for item in items] == [
+        ActivitySchema, ActivitySchema, ActivitySchema, ObjectSchema]
+    assert items[0].id == f'{BASE}/activities/1'
+    assert walk.stats() == {'pages': 3, 'items': 4, 'invalid': 1, 'total_items': 5}
+    assert collection_server == ['/outbox', '/outbox/1', '/outbox/2']
+
+
+@pytest.mark.asyncio
+async def test_collection_walk_stops_early(collection_server, client):
+    walk = CollectionWalk(f'{BASE}/outbox', client=client)
+    async for item in walk:
+        break
+    assert walk.pages == 2
+    assert collection_server == ['/outbox', '/outbox/1']
+
+    walk = CollectionWalk(f'{BASE}/outbox', client=client, max_items=3)
+    assert len([item async for item in walk]) == 3
+    assert walk.pages == 3
+
+    walk = CollectionWalk(f'{BASE}/outbox', client=client, max_pages=2)
+    assert len([item async for item in walk]) == 2
+
+
+@pytest.mark.asyncio
+async def test_collection_walk_links(collection_server, client):
+    walk = CollectionWalk(f'{BASE}/followers', client=client)
+    assert [item async for item in walk] == [f'{BASE}/users/a', f'{BASE}/users/b']
+    assert walk.pages == 1
+
+
+@pytest.mark.asyncio
+async def test_collection_walk_errors(collection_server, client):
+    with pytest.raises(CollectionException):
+        [item async for item in CollectionWalk(f'{BASE}/missing', client=client)]
+
+    walk = CollectionWalk(f'{BASE}/huge', client=client, max_page_size=1024)
+    with pytest.raises(CollectionException):
+        [item async for item in walk]
@@ -0,0 +1,46 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import pytest
+from aiohttp import web
+import starlette.config
+import lamia.utilities.http
+from lamia.version import VERSION
+
+TEST_PORT = 12346
+
+
+@pytest.fixture
+async def http_server():
+    async def handler(request):
+        return web.json_response({'user_agent': request.headers['User-Agent']})
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, 'localhost', TEST_PORT)
+    await site.start()
+    yield f'http://localhost:{TEST_PORT}/'
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_http_client(http_server):
+    config = starlette.config.Config(environ={'HTTP_CONNECTION_LIMIT_PER_HOST': '2'})
+    client = lamia.utilities.http.HttpClient(config=config)
+    assert client.stats()['started'] == False
+
+    await client._startup() # Dont need the app to run these tests.
+    for _ in range(3):
+        response = await client.get_json(http_server)
+        assert response['user_agent'] == f'Lamia/{VERSION}'
+
+    stats = client.stats()
+    assert stats['requests'] == 3
+    assert stats['limit_per_host'] == 2
+    # Keep-alive means that one connection gets reused
+    assert stats['in_use'] == 0
+    assert stats['idle'] == 1
+    await client._shutdown()
@@ -20,7 +20,7 @@ faulty_headers = {'host': 'seems.legit'}
 message_body = '{"a key": "a value", "another key": "btw, this is json, obviously"}'
 path = '/inbox'
 keyId = 'https://lamia.social/lamia#main-key'
-body_digest = base64.b64encode(SHA256.new(message_body.encode()).digest())
+body_digest = base64.b64encode(SHA256.new(message_body.encode()).digest()).decode()
 headers_with_digest = {'host': 'lamia.social', 'digest': f'SHA-256={body_digest}'}
 faulty_headers_with_digest = {'host': 'seems.legit', 'digest': f'SHA-256={body_digest}'}
 
@@ -48,4 +48,215 @@ def test_http_signatures_digest():
     
     headers = faulty_headers_with_digest.copy()
     headers['signature'] = signature_header
-    assert verify(public, headers, 'POST', '/inbox', message_body) == False
\ No newline at end of file
+    assert verify(public, headers, 'POST', '/inbox', message_body) == False
+
+def test_key_cache():
+    from lamia.activitypub.httpsigs import KeyCache
+
+    cache = KeyCache(max_size=2)
+    first = cache.import_key(public, keyId)
+    assert cache.import_key(public, keyId) is first
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+    # A rotated key under the same keyId should never hit the stale entry
+    rotated = RSA.generate(2048).publickey().export_key("PEM")
+    assert cache.import_key(rotated, keyId) is not first
+
+    assert cache.invalidate(keyId) == 2
+    assert cache.stats()['size'] == 0
+
+
+@pytest.mark.asyncio
+async def test_http_signatures_async():
+    from lamia.activitypub.httpsigs import sign_async
+    from lamia.activitypub.httpsigs import verify_async
+    from lamia.activitypub.httpsigs import verify_many_async
+
+    headers = headers_with_digest.copy()
+    headers['signature'] = await sign_async(private, keyId,
+                                            headers_with_digest, path)
+    assert await verify_async(public, headers, 'POST', '/inbox', message_body)
+
+    batch = [
+        (public, headers, 'POST', '/inbox', message_body),
+        (public, headers, 'POST', '/lamia/inbox', message_body),
+        (public, headers, 'GET', '/inbox', message_body),
+    ] * 3
+    assert await verify_many_async(batch) == [True, False, False] * 3
+
+
+
+def test_sign_deliveries():
+    from lamia.activitypub.httpsigs import sign_deliveries
+
+    inboxes = [
+        'https://lamia.social/inbox',
+        'https://seems.legit/u/lamia/inbox',
+        'https://lamia.social/inbox?page=true',
+    ]
+    deliveries = sign_deliveries(private, keyId, message_body, inboxes)
+    assert [delivery.inbox for delivery in deliveries] == inboxes
+
+    for delivery in deliveries:
+        assert delivery.headers['digest'] == f'SHA-256={body_digest}'
+        assert 'date' in delivery.headers
+
+    assert deliveries[0].headers['host'] == 'lamia.social'
+    assert verify(public, deliveries[0].headers, 'POST', '/inbox',
+                  message_body)
+    assert verify(public, deliveries[1].headers, 'POST', '/u/lamia/inbox',
+                  message_body.encode())
+    assert verify(public, deliveries[2].headers, 'POST', '/inbox?page=true',
+                  message_body)
+    assert verify(public, deliveries[1].headers, 'POST', '/inbox',
+                  message_body) == False
+    assert verify(public, deliveries[0].headers, 'POST', '/inbox',
+                  message_body + ' ') == False
+
+
+def test_http_signatures_ed25519():
+    from Crypto.PublicKey import ECC
+    from lamia.activitypub.httpsigs import multibase_encode
+
+    ed_key = ECC.generate(curve='ed25519')
+    ed_private = ed_key.export_key(format='PEM')
+    ed_public = ed_key.public_key().export_key(format='PEM')
+    ed_multibase = multibase_encode(ed_key.public_key())
+    ed_key_id = 'https://lamia.social/lamia#ed25519-key'
+    assert ed_multibase.startswith('z6Mk')
+
+    headers = headers_with_digest.copy()
+    headers['signature'] = sign(ed_private, ed_key_id, headers_with_digest,
+                                path)
+    assert 'algorithm="hs2019"' in headers['signature']
+    assert verify(ed_public, headers, 'POST', '/inbox', message_body)
+    assert verify(ed_multibase, headers, 'POST', '/inbox', message_body)
+    assert verify(ed_public, headers, 'POST', '/lamia/inbox',
+                  message_body) == False
+    # The key type and the algorithm have to agree
+    assert verify(public, headers, 'POST', '/inbox', message_body) == False
+    headers['signature'] = headers['signature'].replace(
+        'hs2019', 'rsa-sha256')
+    assert verify(ed_public, headers, 'POST', '/inbox', message_body) == False
+
+    # hs2019 with an rsa key is rsa-sha256
+    headers = headers_with_digest.copy()
+    headers['signature'] = sign(private, keyId, headers_with_digest,
+                                path).replace('rsa-sha256', 'hs2019')
+    assert verify(public, headers, 'POST', '/inbox', message_body)
+
+
+def test_verified_signature_cache():
+    from email.utils import formatdate
+    from lamia.activitypub.httpsigs import VERIFIED_CACHE
+
+    VERIFIED_CACHE.clear()
+    signed_headers = headers_with_digest.copy()
+    signed_headers['date'] = formatdate(usegmt=True)
+    headers = signed_headers.copy()
+    headers['signature'] = sign(private, keyId, signed_headers, path)
+
+    hits = VERIFIED_CACHE.stats()['hits']
+    assert verify(public, headers, 'POST', '/inbox', message_body)
+    assert verify(public, headers, 'POST', '/inbox', message_body)
+    assert VERIFIED_CACHE.stats()['hits'] == hits + 1
+
+    # A replay against a different path or body has to be a miss
+    assert verify(public, headers, 'POST', '/lamia/inbox',
+                  message_body) == False
+    assert verify(public, headers, 'POST', '/inbox',
+                  message_body + ' ') == False
+    assert VERIFIED_CACHE.stats()['hits'] == hits + 1
+
+    # Stale dates are never cached
+    signed_headers['date'] = formatdate(0, usegmt=True)
+    headers = signed_headers.copy()
+    headers['signature'] = sign(private, keyId, signed_headers, path)
+    skipped = VERIFIED_CACHE.stats()['skipped']
+    assert verify(public, headers, 'POST', '/inbox', message_body)
+    assert VERIFIED_CACHE.stats()['skipped'] == skipped + 1
+
+
+def test_verified_signature_cache_algorithm():
+    from email.utils import formatdate
+    from Crypto.PublicKey import ECC
+    from lamia.activitypub.httpsigs import VERIFIED_CACHE
+
+    VERIFIED_CACHE.clear()
+    ed_key = ECC.generate(curve='ed25519')
+    ed_private = ed_key.export_key(format='PEM')
+    ed_public = ed_key.public_key().export_key(format='PEM')
+    ed_key_id = 'https://lamia.social/lamia#ed25519-key'
+
+    signed_headers = headers_with_digest.copy()
+    signed_headers['date'] = formatdate(usegmt=True)
+    headers = signed_headers.copy()
+    headers['signature'] = sign(ed_private, ed_key_id, signed_headers, path)
+    assert verify(ed_public, headers, 'POST', '/inbox', message_body)
+
+    # The same signature replayed under an algorithm that doesn't fit the
+    # key must not be answered from the cache
+    headers['signature'] = headers['signature'].replace(
+        'hs2019', 'rsa-sha256')
+    assert verify(ed_public, headers, 'POST', '/inbox', message_body) == False
+
+
+class StreamedRequest:
+    """Just enough of a starlette request to stream a body from."""
+
+    def __init__(self, body, chunk_size=8, headers=None):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.headers = headers or {}
+
+    async def stream(self):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+
+def test_verified_signature_cache_skipped_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from lamia.activitypub.httpsigs import VerificationCache
+
+    cache = VerificationCache()
+
+    def skip(thread):
+        for _ in range(5000):
+            # Unsigned dates can't be cached
+            assert cache.ttl_for({}, ['(request-target)']) is None
+        return True
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(executor.map(skip, range(8)))
+    assert cache.stats()['skipped'] == 8 * 5000
+
+
+@pytest.mark.asyncio
+async def test_streaming_body_digest():
+    from lamia.activitypub.httpsigs import read_body
+    from lamia.activitypub.httpsigs import BodyTooLargeException
+
+    body, digest = await read_body(StreamedRequest(message_body.encode()))
+    assert body == message_body.encode()
+    assert isinstance(body, bytearray)
+    assert digest.header() == f'SHA-256={body_digest}'
+    assert digest.matches(f'SHA-256={body_digest}')
+    assert digest.matches(f'SHA-512=whatever,SHA-256={body_digest}')
+
+    headers = headers_with_digest.copy()
+    headers['signature'] = sign(private, keyId, headers_with_digest, path)
+    assert verify(public, headers, 'POST', '/inbox',
+                  body_digest=digest.header())
+
+    headers['digest'] = 'SHA-256=bm90IHRoZSBib2R5'
+    assert verify(public, headers, 'POST', '/inbox',
+                  body_digest=digest.header()) == False
+
+    with pytest.raises(BodyTooLargeException):
+        await read_body(StreamedRequest(message_body.encode()), max_size=16)
+
+    with pytest.raises(BodyTooLargeException):
+        await read_body(
+            StreamedRequest(b'', headers={'content-length': '17'}),
+            max_size=16)
@@ -0,0 +1,145 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# Actors and objects have foreign keys into these tables
+import lamia.models.features
+from lamia.activitypub.ingest import ingest, ingest_rows, upsert_statement
+from lamia.activitypub.schema import ActivitySchema, ObjectSchema, ActorSchema
+from lamia.config import BASE_URL
+from lamia.models.activitypub import Actor, Object
+from lamia.models.features import Identity, TimelineEntry
+from lamia.stats import SITE_STATS
+from lamia.timelines import HOME_TIMELINES, MemoryTimelineStore
+from tests.test_schema import well_formed_activity, well_formed_object, well_formed_actor
+
+
+def compile_sql(statement):
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+def test_to_row():
+    row = ObjectSchema(well_formed_object).to_row()
+    assert row['uri'] == well_formed_object['id']
+    assert row['actor_uri'] == 'https://lamia.social/u/scarly'
+    assert row['reply_to_uri'] == well_formed_object['inReplyTo']
+    # Timestamp columns are naive utc
+    assert row['created'].tzinfo is None
+    assert row['created'].hour == 2
+    assert '@context' in row['data']
+
+    activity = ActivitySchema(dict(well_formed_activity, object={'id': 'https://x/1'}))
+    assert activity.to_row()['object_uri'] == 'https://x/1'
+    assert activity.to_model().uri == well_formed_activity['id']
+    assert ActorSchema(well_formed_actor).to_model().local == False
+
+
+def test_ingest_rows():
+    edited = dict(well_formed_object, content='<p>Edited.</p>')
+    batches = ingest_rows([
+        ObjectSchema(well_formed_object),
+        ActivitySchema(well_formed_activity),
+        ObjectSchema(edited),
+    ])
+    # Repeated uris keep their last version
+    assert len(batches[ObjectSchema]) == 1
+    assert batches[ObjectSchema][edited['id']]['data']['content'] == '<p>Edited.</p>'
+    assert len(batches[ActivitySchema]) == 1
+
+    with pytest.raises(ValueError):
+        ingest_rows([object()])
+
+
+def test_upsert_statement():
+    rows = [ObjectSchema(well_formed_object).to_row()] * 2
+    sql = compile_sql(upsert_statement(ObjectSchema, rows))
+    assert sql.startswith('INSERT INTO objects')
+    assert 'ON CONFLICT (uri) DO UPDATE SET' in sql
+    assert 'data = excluded.data' in sql
+    assert 'created = ' not in sql
+    assert sql.endswith(
+        'RETURNING objects.id, objects.uri, (xmax = 0) AS inserted')
+
+    sql = compile_sql(upsert_statement(ActorSchema, [ActorSchema(well_formed_actor).to_row()]))
+    assert 'WHERE actors.local IS NOT true' in sql
+
+
+@pytest.mark.asyncio
+async def test_ingest(gino_db):
+    local_uri = f'{BASE_URL}/u/ingest'
+    local_actor = await Actor.create(
+        uri=local_uri, local=True, actor_type='Person',
+        user_name='ingest', display_name='ingest', data={})
+    identity = await Identity.create(actor_id=local_actor.id, user_name='ingest')
+
+    seen_before = dict(well_formed_object, id='https://elsewhere.example/o/1')
+    [seen_before_id] = await ingest([ObjectSchema(seen_before)])
+    local_posts = SITE_STATS.snapshot().local_posts
+
+    new_object = dict(well_formed_object, id=f'{local_uri}/o/2',
+                      attributedTo=local_uri)
+    edited = dict(seen_before, content='<p>Edited.</p>')
+    local_copy = dict(well_formed_actor, id=local_uri, name='Not Me')
+    remote_actor = dict(well_formed_actor, id='https://elsewhere.example/u/crow')
+
+    # One row per statement, so that every schema is its own batch
+    ids = await ingest([
+        ObjectSchema(new_object),
+        ActorSchema(local_copy),
+        ObjectSchema(edited),
+        ActorSchema(remote_actor),
+    ], batch_size=1)
+
+    # Ids come back in the same order as the schemas
+    assert ids[0] is not None
+    assert (await Object.get(ids[0])).uri == new_object['id']
+    # Local actors are never overwritten (or returned)
+    assert ids[1] is None
+    assert (await Actor.get(local_actor.id)).display_name == 'ingest'
+    # Rows we've seen before are updated in place
+    assert ids[2] == seen_before_id
+    assert (await Object.get(seen_before_id)).data['content'] == '<p>Edited.</p>'
+    assert (await Actor.get(ids[3])).uri == remote_actor['id']
+
+    # Only the newly inserted local post is counted
+    assert SITE_STATS.snapshot().local_posts == local_posts + 1
+
+    # The new post was fanned out into its author's own home timeline
+    entries = await gino_db.all(
+        sa.select([TimelineEntry.object_id]).where(
+            TimelineEntry.identity_id == identity.id))
+    assert [entry[0] for entry in entries] == [ids[0]]
+
+
+@pytest.mark.asyncio
+async def test_ingest_memory_timelines(gino_db, monkeypatch):
+    store = MemoryTimelineStore(800)
+    monkeypatch.setattr(HOME_TIMELINES, '_store', store)
+    local_uri = f'{BASE_URL}/u/memory'
+    local_actor = await Actor.create(
+        uri=local_uri, local=True, actor_type='Person',
+        user_name='memory', display_name='memory', data={})
+    identity = await Identity.create(actor_id=local_actor.id, user_name='memory')
+    post = dict(well_formed_object, id=f'{local_uri}/o/1', attributedTo=local_uri)
+
+    committed = []
+    push = store.push
+
+    async def checked_push(entries):
+        # Asked on another connection, which can't see uncommitted rows
+        async with gino_db.acquire(reuse=False) as connection:
+            committed.append(await connection.scalar(
+                sa.select([sa.func.count(Object.id)]).where(
+                    Object.uri == post['id'])))
+        return await push(entries)
+
+    # Memory timelines can't be rolled back, so they're only written to
+    # once the objects are sure to exist
+    monkeypatch.setattr(store, 'push', checked_push)
+    [object_id] = await ingest([ObjectSchema(post)])
+    assert committed == [1]
+    assert store.page_ids(identity.id) == [object_id]
@@ -0,0 +1,158 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import asyncio
+
+import pytest
+import ujson as json
+
+from lamia.utilities.cache import Cache, MemoryBackend
+from lamia.utilities.invalidation import InvalidationBus, encode_payloads
+from lamia.utilities.invalidation import split_key, MAX_PAYLOAD_SIZE
+
+
+class FakeRawConnection:
+    def __init__(self):
+        self.listeners = {}
+        self.closed = False
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    async def remove_listener(self, channel, callback):
+        self.listeners.pop(channel, None)
+
+    def is_closed(self):
+        return self.closed
+
+
+class FakeConnection:
+    def __init__(self):
+        self.raw = FakeRawConnection()
+        self.released = False
+
+    async def get_raw_connection(self):
+        return self.raw
+
+    async def release(self):
+        self.released = True
+
+
+class FakeDatabase:
+    """Stands in for the gino database's pool."""
+
+    def __init__(self):
+        self.connections = []
+        self.queries = []
+
+    async def acquire(self, lazy=True):
+        self.connections.append(FakeConnection())
+        return self.connections[-1]
+
+    async def scalar(self, query):
+        self.queries.append(query)
+
+
+def test_split_key():
+    assert split_key('settings') == ('settings', None)
+    assert split_key('cache:actors:https://example.com') == (
+        'cache', 'actors:https://example.com')
+
+
+def test_encode_payloads():
+    keys = [f'cache:actors:{index:05}' + 'x' * 100 for index in range(200)]
+    payloads = encode_payloads('origin', keys)
+    assert len(payloads) > 1
+    decoded = [json.loads(payload) for payload in payloads]
+    assert all(len(payload) < MAX_PAYLOAD_SIZE + 100 for payload in payloads)
+    assert [key for message in decoded for key in message['keys']] == keys
+
+
+@pytest.mark.asyncio
+async def test_publish_coalesces():
+    database = FakeDatabase()
+    bus = InvalidationBus(database=database)
+    seen = []
+    bus.subscribe('webfinger', seen.append)
+
+    bus.publish('webfinger:lamia')
+    bus.publish('webfinger:lamia', 'webfinger:muffin')
+    # Evicted here straight away
+    assert seen == ['lamia', 'lamia', 'muffin']
+    assert database.queries == []
+
+    await asyncio.sleep(0.1)
+    assert len(database.queries) == 1
+    assert bus.stats()['notifications'] == 1
+    assert bus.stats()['pending'] == 0
+
+    # Only the other workers are told
+    bus.publish('webfinger:cupcake', local=False)
+    assert seen == ['lamia', 'lamia', 'muffin']
+    await asyncio.sleep(0.1)
+    assert len(database.queries) == 2
+
+
+@pytest.mark.asyncio
+async def test_notifications():
+    bus = InvalidationBus(database=FakeDatabase())
+    seen = []
+    bus.subscribe('settings', seen.append)
+    bus.subscribe('webfinger', seen.append)
+
+    await bus.listen()
+    callback = bus.database.connections[0].raw.listeners['lamia_invalidation']
+
+    callback(None, 1, 'lamia_invalidation',
+             json.dumps({'origin': 'elsewhere', 'keys': ['settings', 'x:y']}))
+    # Our own notifications were handled when they were published
+    callback(None, 1, 'lamia_invalidation',
+             json.dumps({'origin': bus.origin, 'keys': ['webfinger:a']}))
+    callback(None, 1, 'lamia_invalidation', 'not json')
+    assert seen == [None]
+    assert bus.stats()['received'] == 2
+
+
+@pytest.mark.asyncio
+async def test_reconnects():
+    database = FakeDatabase()
+    bus = InvalidationBus(database=database)
+    bus.config = lambda name, cast, default: 0 if name.endswith(
+        'DELAY') else default
+    seen = []
+    bus.subscribe('webfinger', seen.append)
+
+    await bus._startup()
+    await asyncio.sleep(0.01)
+    assert len(database.connections) == 1
+
+    database.connections[0].raw.closed = True
+    await asyncio.sleep(0.01)
+    assert database.connections[0].released
+    assert len(database.connections) == 2
+    assert bus.stats()['reconnects'] == 1
+    # Anything could have changed while we weren't listening
+    assert seen[0] is None
+
+    await bus._shutdown()
+    assert database.connections[1].released
+
+
+@pytest.mark.asyncio
+async def test_cache_invalidation():
+    bus = InvalidationBus()
+    cache = Cache(backend=MemoryBackend())
+    cache.invalidation_bus = bus
+    bus.subscribe('cache', cache.evict)
+
+    actors = cache.namespace('actors')
+    await actors.set('a', 1)
+    await actors.set('b', 2)
+    await actors.invalidate('a')
+    await asyncio.sleep(0)
+    assert await actors.get_many(['a', 'b']) == {'b': 2}
+
+    bus.dispatch_all()
+    await asyncio.sleep(0)
+    assert await actors.get('b') is None
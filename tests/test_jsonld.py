@@ -0,0 +1,88 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import pytest
+
+from lamia.activitypub.context import LAMIA_CONTEXT
+from lamia.activitypub.jsonld import ContextStore, ContextResolver
+from lamia.activitypub.jsonld import ContextNotFoundException
+from lamia.activitypub.jsonld import document_loader, expand_iri
+
+AS = 'https://www.w3.org/ns/activitystreams#'
+SEC = 'https://w3id.org/security#'
+
+mastodon_context = [
+    'https://www.w3.org/ns/activitystreams',
+    'https://w3id.org/security/v1',
+    {
+        'manuallyApprovesFollowers': 'as:manuallyApprovesFollowers',
+        'toot': 'http://joinmastodon.org/ns#',
+        'featured': {'@id': 'toot:featured', '@type': '@id'},
+        'discoverable': 'toot:discoverable',
+    },
+]
+
+def test_bundled_contexts():
+    store = ContextStore()
+    assert 'https://www.w3.org/ns/activitystreams' in store
+    assert 'http://www.w3.org/ns/activitystreams#' in store
+    assert 'https://w3id.org/security/' in store
+    assert 'Note' in store.get('https://www.w3.org/ns/activitystreams')['@context']
+
+    with pytest.raises(ContextNotFoundException):
+        store.get('https://example.com/context')
+    store.register('https://example.com/context', {'@context': {}})
+    assert store.get('https://example.com/context') == {'@context': {}}
+
+    loaded = document_loader('https://w3id.org/security/v1')
+    assert loaded['documentUrl'] == 'https://w3id.org/security/v1'
+    assert 'publicKeyPem' in loaded['document']['@context']
+
+def test_lamia_context_expansion():
+    assert expand_iri(LAMIA_CONTEXT, 'Note') == AS + 'Note'
+    assert expand_iri(LAMIA_CONTEXT, 'as:Public') == AS + 'Public'
+    assert expand_iri(LAMIA_CONTEXT, 'publicKeyPem') == SEC + 'publicKeyPem'
+    assert expand_iri(LAMIA_CONTEXT, 'publicKeyMultibase') == SEC + 'publicKeyMultibase'
+    assert expand_iri(LAMIA_CONTEXT, 'focalPoint') == 'http://joinmastodon.org/ns#focalPoint'
+    assert expand_iri(LAMIA_CONTEXT, 'id') == '@id'
+    assert expand_iri(LAMIA_CONTEXT, 'https://example.com/x') == 'https://example.com/x'
+
+def test_context_resolution_cache():
+    resolver = ContextResolver(store=ContextStore())
+    first = resolver.resolve(mastodon_context)
+    # The same context in a different object (as every incoming document
+    # will have) comes out of the cache
+    second = resolver.resolve([item for item in mastodon_context])
+    assert first is second
+    assert resolver.stats()['hits'] == 1
+    assert resolver.stats()['misses'] == 1
+
+    assert first.expand('featured') == 'http://joinmastodon.org/ns#featured'
+    assert first.definition('featured')['@type'] == '@id'
+    assert first.expand('manuallyApprovesFollowers') == AS + 'manuallyApprovesFollowers'
+    assert first.unresolved == ()
+
+    unknown = resolver.resolve(['https://www.w3.org/ns/activitystreams', 'https://example.com/ns'])
+    assert unknown.unresolved == ('https://example.com/ns',)
+    assert unknown.expand('Create') == AS + 'Create'
+
+def test_local_context_overrides():
+    resolver = ContextResolver(store=ContextStore())
+    context = resolver.resolve([
+        'https://www.w3.org/ns/activitystreams',
+        {'ex': 'https://example.com/ns#', 'Note': 'ex:Note', 'Create': None},
+    ])
+    assert context.expand('Note') == 'https://example.com/ns#Note'
+    assert context.definition('Create') is None
+
+
+def test_expansion_cache_bounded():
+    from lamia.activitypub.jsonld import EXPANSION_CACHE_SIZE
+
+    active = ContextResolver().resolve(LAMIA_CONTEXT)
+    for index in range(EXPANSION_CACHE_SIZE * 2):
+        active.expand(f'made_up_term_{index}')
+    assert len(active._expanded) == EXPANSION_CACHE_SIZE
+    # Still expanded the same way once forgotten
+    assert active.expand('made_up_term_0') == expand_iri(LAMIA_CONTEXT, 'made_up_term_0')
@@ -0,0 +1,37 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from concurrent.futures import ThreadPoolExecutor
+
+from lamia.utilities.lru import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    # b was the least recently used
+    assert 'b' not in cache
+    assert cache.keys() == ['a', 'c']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_cache_threads():
+    # Small and short lived, so that threads keep evicting and expiring each
+    # other's entries
+    cache = LRUCache(max_size=8, ttl=0.0001)
+
+    def hammer(thread):
+        for index in range(20000):
+            key = (thread + index) % 16
+            cache.set(key, index)
+            cache.get(key)
+            cache.get((key + 1) % 16)
+        return True
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(executor.map(hammer, range(8)))
+    assert len(cache) <= 8
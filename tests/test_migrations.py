@@ -0,0 +1,59 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import sqlalchemy as sa
+
+from lamia.utilities.migrations import compare, plan_migration, is_clean
+from lamia.utilities.migrations import create_index_sql
+
+metadata = sa.MetaData()
+actors = sa.Table(
+    'actors', metadata,
+    sa.Column('id', sa.Integer(), primary_key=True),
+    sa.Column('uri', sa.String()),
+    sa.Column('ed25519_private_key', sa.String(), nullable=True),
+    sa.Index('idx_actor_uri', 'uri', unique=True),
+)
+follows = sa.Table(
+    'follows', metadata,
+    sa.Column('id', sa.Integer(), primary_key=True),
+    sa.Column('actor_id', sa.Integer(), sa.ForeignKey('actors.id')),
+    sa.Column('target_actor_id', sa.Integer(), sa.ForeignKey('actors.id')),
+    sa.Index('idx_follow_target_actor', 'target_actor_id'),
+)
+
+
+def test_create_index_sql():
+    index = list(actors.indexes)[0]
+    assert create_index_sql(index) == \
+        'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_actor_uri ON actors (uri)'
+
+
+def test_up_to_date():
+    report = compare(metadata, {'actors', 'follows'},
+                     {('actors', 'id'), ('actors', 'uri'), ('actors', 'ed25519_private_key'),
+                      ('follows', 'id'), ('follows', 'actor_id'), ('follows', 'target_actor_id')},
+                     {'idx_actor_uri': True, 'idx_follow_target_actor': True})
+    assert is_clean(report)
+    assert plan_migration(metadata, report) == []
+
+
+def test_migration_plan():
+    report = compare(metadata, {'actors'}, {('actors', 'id'), ('actors', 'uri')},
+                     {'idx_actor_uri': False})
+    assert not is_clean(report)
+    assert report.missing_tables == ['follows']
+    assert report.missing_columns == [('actors', 'ed25519_private_key')]
+    assert report.missing_indexes == ['idx_follow_target_actor']
+    assert report.invalid_indexes == ['idx_actor_uri']
+
+    plan = plan_migration(metadata, report)
+    assert plan[0].startswith('CREATE TABLE follows')
+    # Indexes on new tables don't need to be built concurrently
+    assert plan[1] == 'CREATE INDEX idx_follow_target_actor ON follows (target_actor_id)'
+    assert plan[2] == 'ALTER TABLE actors ADD COLUMN IF NOT EXISTS ed25519_private_key VARCHAR'
+    assert plan[3:] == [
+        'DROP INDEX CONCURRENTLY IF EXISTS idx_actor_uri',
+        'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_actor_uri ON actors (uri)',
+    ]
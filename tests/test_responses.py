@@ -0,0 +1,81 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import pytest
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+from lamia.utilities.responses import ResponseCache, cached_response
+from lamia.utilities.responses import etag_matches, make_etag
+
+
+def make_request(headers=None):
+    return Request({
+        'type': 'http',
+        'method': 'GET',
+        'path': '/',
+        'query_string': b'',
+        'headers': [(name.encode(), value.encode())
+                    for name, value in (headers or {}).items()],
+    })
+
+
+def test_etag_matches():
+    etag = make_etag(b'{}')
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+
+
+@pytest.mark.asyncio
+async def test_cached_response():
+    cache = ResponseCache()
+    calls = []
+    versions = [1]
+
+    @cached_response(max_age=30, version=lambda: versions[0], cache=cache)
+    async def view(request):
+        calls.append(request)
+        return JSONResponse({'calls': len(calls)})
+
+    response = await view(make_request())
+    assert response.status_code == 200
+    assert response.body == b'{"calls":1}'
+    assert response.headers['cache-control'] == 'public, max-age=30'
+    assert response.headers['content-type'] == 'application/json'
+    etag = response.headers['etag']
+
+    response = await view(make_request())
+    assert response.body == b'{"calls":1}'
+    assert len(calls) == 1
+
+    response = await view(make_request({'if-none-match': etag}))
+    assert response.status_code == 304
+    assert response.body == b''
+    assert response.headers['etag'] == etag
+    assert cache.stats()['not_modified'] == 1
+
+    # A new version throws the old body away
+    versions[0] = 2
+    response = await view(make_request({'if-none-match': etag}))
+    assert response.status_code == 200
+    assert response.body == b'{"calls":2}'
+    assert response.headers['etag'] != etag
+
+
+@pytest.mark.asyncio
+async def test_cached_response_errors():
+    cache = ResponseCache()
+
+    @cached_response(cache=cache)
+    async def view(request):
+        return Response(b'missing', status_code=404)
+
+    response = await view(make_request())
+    assert response.status_code == 404
+    assert 'etag' not in response.headers
+    assert len(cache.bodies) == 0
@@ -183,3 +183,85 @@ def test_schema_build():
     actor.del_actor_property(all_properties[1].idx)
     assert actor.get_actor_properties()[0].name == 'Are snake women hot?'
     assert actor.validate() == True
+
+
+def test_validate_many():
+    from itertools import compress
+    from lamia.activitypub.schema import validate_many
+
+    missing_url = well_formed_object.copy()
+    del missing_url['url']
+    bad_to = well_formed_object.copy()
+    bad_to['to'] = [1]
+    documents = [well_formed_object, missing_url, 'junk', bad_to, well_formed_object, {}]
+
+    report = validate_many(documents, ObjectSchema)
+    assert list(report.results) == [1, 0, 0, 0, 1, 0]
+    assert list(compress(documents, report.results)) == [well_formed_object] * 2
+    assert [(e.index, e.field, e.reason) for e in report.errors] == [
+        (1, 'url', 'required'),
+        (2, None, 'document'),
+        (3, 'to', 'validation'),
+        (5, 'id', 'required'),
+    ]
+    assert report.counts['url'] == 1
+    assert report.counts['id'] == 1
+
+    report = validate_many(iter([well_formed_actor, well_formed_object]), ActorSchema)
+    assert list(report.results) == [1, 0]
+
+
+def test_slotted_schema():
+    _object = ObjectSchema(well_formed_object.copy())
+    assert not hasattr(_object, '__dict__')
+    assert isinstance(ObjectSchema.content, property)
+    assert _object.content == well_formed_object['content']
+
+    _object.content = '<p>Edited.</p>'
+    assert _object.representation['content'] == '<p>Edited.</p>'
+    with pytest.raises(SchemaValidationException):
+        _object.sensitive = 'yes'
+
+    # Fields outside of the fieldset still go into the representation
+    _object.customField = 'custom'
+    assert _object.customField == 'custom'
+    with pytest.raises(AttributeError):
+        ObjectSchema.__new__(ObjectSchema).db_id
+
+
+def test_from_validated():
+    from lamia.activitypub.schema import validate_many
+
+    documents = [well_formed_object, {}, well_formed_object]
+    report = validate_many(documents, ObjectSchema)
+    from itertools import compress
+    objects = ObjectSchema.many_from_validated(
+        compress(documents, report.results))
+    assert len(objects) == 2
+    assert all(_object.representation is well_formed_object for _object in objects)
+    assert objects[0].validate()
+
+    actor = ActorSchema.from_validated(well_formed_actor)
+    assert actor.fields is ActorSchema.FIELDS
+    assert actor.id == well_formed_actor['id']
+
+
+def test_json_ld_bytes():
+    import ujson
+    from lamia.activitypub.context import LAMIA_CONTEXT
+
+    _object = ObjectSchema(well_formed_object)
+    encoded = _object.to_lamia_json_ld_bytes()
+    assert isinstance(encoded, bytes)
+    assert ujson.loads(encoded) == _object.to_lamia_json_ld()
+    assert encoded.startswith(b'{"@context":["https://www.w3.org/ns/activitystreams"')
+    assert ujson.loads(_object.to_json_ld_bytes()) == well_formed_object
+    # The representation isn't touched
+    assert '@context' not in _object.representation
+
+    assert ujson.loads(ObjectSchema().to_lamia_json_ld_bytes()) == {
+        '@context': LAMIA_CONTEXT}
+
+    # An existing context gets replaced, just like to_lamia_json_ld
+    with_context = ObjectSchema(dict(well_formed_object, **{'@context': 'x'}))
+    assert ujson.loads(with_context.to_lamia_json_ld_bytes())['@context'] == LAMIA_CONTEXT
@@ -75,4 +75,34 @@ def test_validate_list_of_loose_struct():
     assert validation_function(good_data)
     assert validation_function(bad_data_type) == False
     assert validation_function(bad_data_keys) == False
-    
\ No newline at end of file
+    
+
+def test_compiled_fields():
+    from lamia.activitypub.fields import Field, compile_fields
+    from lamia.activitypub.fields import INVALID_REQUIRED, INVALID_TYPE, INVALID_VALIDATION
+
+    compiled = compile_fields({
+        'id': Field((str, ), True, (None, )),
+        'to': Field((list, str), True, (contains_only_strings, None)),
+        'sensitive': Field((bool, ), False, (None, )),
+        'tags': Field((list, ), False, (contains_only_strings, )),
+    })
+
+    assert compiled.validate({'id': 'a', 'to': ['b']}) is None
+    assert compiled.validate({'id': 'a', 'to': 'b', 'sensitive': True}) is None
+    assert compiled.validate({'to': 'b'}) == ('id', INVALID_REQUIRED)
+    assert compiled.validate({'id': 1, 'to': 'b'}) == ('id', INVALID_TYPE)
+    assert compiled.validate({'id': 'a', 'to': [1]}) == ('to', INVALID_VALIDATION)
+    assert compiled.validate({'id': 'a', 'to': 1}) == ('to', INVALID_TYPE)
+    assert compiled.validate({'id': 'a', 'to': 'b', 'tags': [1]}) == ('tags', INVALID_VALIDATION)
+
+    assert compiled.checks['sensitive'](False) is None
+    assert compiled.checks['sensitive']('no') == INVALID_TYPE
+
+
+def test_compiled_field_definitions():
+    from lamia.activitypub.fields import get_compiled_fields
+    from lamia.activitypub.fields import COMPILED_ACTOR_FIELDS
+
+    assert get_compiled_fields(ACTOR_FIELDS) is COMPILED_ACTOR_FIELDS
+    assert set(COMPILED_ACTOR_FIELDS.checks) == set(ACTOR_FIELDS)
@@ -0,0 +1,124 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import pytest
+import sqlalchemy as sa
+
+from lamia.models.administration import Setting
+from lamia.settings import SettingsStore, SettingException, SETTING_DEFINITIONS
+from lamia.settings import build_snapshot, check_setting
+from lamia.utilities.invalidation import InvalidationBus
+
+
+def test_check_setting():
+    assert check_setting('open_registration', False) is False
+    assert check_setting('max_post_length', 500) == 500
+    with pytest.raises(SettingException):
+        check_setting('max_post_length', True)
+    with pytest.raises(SettingException):
+        check_setting('site_name', 5)
+    with pytest.raises(SettingException):
+        check_setting('not_a_setting', 5)
+
+
+def test_build_snapshot():
+    snapshot = build_snapshot({
+        'site_name': 'Muffins',
+        'max_post_length': 'long',
+        'retired_setting': 1,
+    })
+    assert snapshot['site_name'] == 'Muffins'
+    # Stored values of the wrong type read as the default
+    assert snapshot['max_post_length'] == SETTING_DEFINITIONS[
+        'max_post_length'].default
+    assert set(snapshot) == set(SETTING_DEFINITIONS)
+    with pytest.raises(TypeError):
+        snapshot['site_name'] = 'Cupcakes'
+
+
+@pytest.mark.asyncio
+async def test_settings_store():
+    bus = InvalidationBus()
+    store = SettingsStore(invalidation_bus=bus)
+    assert store['open_registration'] is True
+    assert store.get('missing', 1) == 1
+    assert bus.handlers['settings'] == [store._invalidated]
+
+    before = store.snapshot()
+    generation = store.generation
+    store._swap({'open_registration': False})
+    assert store['open_registration'] is False
+    assert store.generation == generation + 1
+    # Whoever held onto the old snapshot still sees it whole
+    assert before['open_registration'] is True
+
+    # Nothing is written when any of the values are bad
+    with pytest.raises(SettingException):
+        await store.update_many({'site_name': 'Muffins', 'max_post_length': 'x'})
+    assert store['site_name'] == SETTING_DEFINITIONS['site_name'].default
+
+
+def test_swap_order():
+    store = SettingsStore()
+    first, second = store._next_sequence(), store._next_sequence()
+    assert store._swap({'site_name': 'Cupcakes'}, second)
+    # A read that started earlier but finished later is ignored
+    assert not store._swap({'site_name': 'Muffins'}, first)
+    assert store['site_name'] == 'Cupcakes'
+    assert store.generation == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_overtaken(monkeypatch):
+    import lamia.settings
+    store = SettingsStore()
+    # Another worker has changed the site name
+    table = {'site_name': 'Muffins'}
+    reads = []
+
+    class FakeDatabase:
+        select = staticmethod(lambda columns: columns)
+
+        async def all(self, query):
+            reads.append(query)
+            rows = list(table.items())
+            if len(reads) == 1:
+                # An update here commits while the first read is under way
+                table['max_post_length'] = 10
+                store._swap({'max_post_length': 10}, store._next_sequence())
+            return rows
+
+    monkeypatch.setattr(lamia.settings, 'db', FakeDatabase())
+    await store.refresh()
+    # Read again, rather than losing the other worker's change
+    assert len(reads) == 2
+    assert store['site_name'] == 'Muffins'
+    assert store['max_post_length'] == 10
+
+
+@pytest.mark.asyncio
+async def test_update_many(gino_db):
+    bus = InvalidationBus()
+    store = SettingsStore(invalidation_bus=bus)
+    reloads = []
+    bus.subscribe('settings', reloads.append)
+
+    await store.update_many({'site_name': 'Muffins', 'max_post_length': 10})
+    generation = store.generation
+    await store.update('site_name', 'Cupcakes')
+    assert store['site_name'] == 'Cupcakes'
+    # Swapped once, and not reloaded again for its own publish
+    assert store.generation == generation + 1
+    assert reloads == []
+    assert bus.stats()['published'] == 2
+
+    # Existing rows are updated rather than duplicated
+    rows = await gino_db.all(sa.select([Setting.key, Setting.value]))
+    assert sorted(rows) == [('max_post_length', 10), ('site_name', 'Cupcakes')]
+
+    other = SettingsStore()
+    assert (await other.refresh())['site_name'] == 'Cupcakes'
+    assert other['max_post_length'] == 10
+    assert other['open_registration'] is True
+    assert other.loaded
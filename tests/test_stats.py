@@ -0,0 +1,101 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from datetime import timedelta
+
+import pendulum
+import pytest
+
+from lamia.config import BASE_URL
+from lamia.stats import SiteStatistics, is_local_uri
+from lamia.utilities.invalidation import InvalidationBus
+
+
+def test_is_local_uri():
+    assert is_local_uri(f'{BASE_URL}/u/lamia')
+    assert not is_local_uri('https://elsewhere.example/u/lamia')
+    assert not is_local_uri(None)
+
+
+def test_counters():
+    stats = SiteStatistics()
+    first = stats.snapshot()
+    assert first.local_users == 0
+    assert first.local_posts == 0
+
+    stats.users_created()
+    stats.objects_created([
+        f'{BASE_URL}/u/lamia', f'{BASE_URL}/u/lamia',
+        'https://elsewhere.example/u/lamia'
+    ])
+    snapshot = stats.snapshot()
+    assert snapshot.local_users == 1
+    assert snapshot.local_posts == 2
+    assert snapshot.active_month == 1
+    assert snapshot.active_halfyear == 1
+    assert snapshot.generation > first.generation
+    # Snapshots don't change underneath whoever is holding onto them
+    assert first.local_users == 0
+
+    # Remote objects don't touch the counters (or the generation)
+    stats.objects_created(['https://elsewhere.example/u/lamia'])
+    assert stats.snapshot() is snapshot
+
+    stats.objects_deleted([f'{BASE_URL}/u/lamia'] * 3)
+    stats.users_deleted(2)
+    assert stats.snapshot().local_posts == 0
+    assert stats.snapshot().local_users == 0
+
+
+def test_active_windows():
+    stats = SiteStatistics()
+    now = pendulum.now('UTC').naive()
+    stats.last_active = {
+        f'{BASE_URL}/u/recent': now,
+        f'{BASE_URL}/u/quiet': now - timedelta(days=90),
+        f'{BASE_URL}/u/gone': now - timedelta(days=365),
+    }
+    stats.users_created(3)
+    assert stats.snapshot().active_month == 1
+    assert stats.snapshot().active_halfyear == 2
+
+
+def test_app_without_config():
+    with pytest.raises(ValueError):
+        SiteStatistics(app=object())
+
+
+def test_other_workers():
+    bus = InvalidationBus()
+    stats = SiteStatistics(invalidation_bus=bus)
+    other = SiteStatistics()
+    published = []
+
+    def publish(*keys, local=True):
+        # This worker has already counted them
+        assert not local
+        published.extend(key.split(':', 1)[1] for key in keys)
+
+    bus.publish = publish
+
+    stats.users_created()
+    stats.users_created()
+    stats.objects_created([f'{BASE_URL}/u/lamia'] * 2 +
+                          ['https://elsewhere.example/u/lamia'])
+    stats.objects_deleted([f'{BASE_URL}/u/lamia'])
+    # Identical changes are still told apart
+    assert len(set(published)) == len(published) == 5
+
+    # Other workers apply the same changes, without touching the database
+    for key in published:
+        other._invalidated(key)
+    snapshot = other.snapshot()
+    assert (snapshot.local_users, snapshot.local_posts) == (2, 1)
+    assert snapshot.active_month == 1
+    assert snapshot[:4] == stats.snapshot()[:4]
+
+    # Missed changes (and nonsense) are left to the next reconciliation
+    other._invalidated(None)
+    other._invalidated('1:followers:3')
+    assert other.snapshot() is snapshot
@@ -0,0 +1,104 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from lamia.timelines import encode_cursor, decode_cursor, TimelineCursorException
+from lamia.timelines import home_query, local_query, tag_query, feed_query
+from lamia.timelines import paginate, to_page
+
+
+def compile_sql(query):
+    return str(query.compile(dialect=postgresql.dialect()))
+
+
+def test_cursor():
+    created = datetime(2018, 11, 5, 2, 31, 49, 1234)
+    cursor = encode_cursor(created, 101)
+    assert '|' not in cursor
+    assert decode_cursor(cursor) == (created, 101)
+
+    with pytest.raises(TimelineCursorException):
+        decode_cursor('not a cursor')
+
+
+def test_timeline_queries():
+    for query in (home_query(1), local_query(), tag_query('lamia'), feed_query(1)):
+        sql = compile_sql(paginate(query))
+        assert 'objects.data' not in sql
+        assert 'OFFSET' not in sql
+        assert sql.endswith('ORDER BY objects.created DESC, objects.id DESC \n LIMIT %(param_1)s')
+
+    sql = compile_sql(paginate(home_query(1, include_data=True),
+                               encode_cursor(datetime(2018, 11, 5), 101)))
+    assert 'objects.data' in sql
+    assert '(objects.created, objects.id) < (' in sql
+
+
+def test_to_page():
+    rows = [(i, f'https://lamia.social/o/{i}', None, None, 'Note', datetime(2018, 11, 5, 0, i))
+            for i in range(5, 0, -1)]
+
+    page = to_page(rows, limit=3)
+    assert [item.id for item in page.items] == [5, 4, 3]
+    assert decode_cursor(page.cursor) == (datetime(2018, 11, 5, 0, 3), 3)
+
+    page = to_page(rows[3:], limit=3)
+    assert [item.id for item in page.items] == [2, 1]
+    assert page.cursor is None
+
+
+def test_memory_timeline_store():
+    from lamia.timelines import MemoryTimelineStore
+
+    store = MemoryTimelineStore(max_entries=3)
+    entries = [(1, i, datetime(2018, 11, 5, 0, i)) for i in range(1, 6)]
+    assert store.push_entries(entries) == 5
+    # Pushing the same entries again doesn't duplicate them
+    assert store.push_entries(entries[3:]) == 0
+
+    # Trimmed to the newest three
+    assert store.page_ids(1, limit=10) == [5, 4, 3]
+    ids = store.page_ids(1, limit=1)
+    assert ids == [5, 4]
+    assert store.page_ids(1, encode_cursor(datetime(2018, 11, 5, 0, 5), 5), limit=1) == [4, 3]
+    assert store.page_ids(2) == []
+
+
+def test_fan_out_queries():
+    from lamia.timelines import PostgresTimelineStore, fan_out_query, backfill_query
+
+    sql = compile_sql(fan_out_query([1, 2]))
+    assert 'JOIN follows ON follows.target_actor_id = actors.id AND follows.approved IS true' in sql
+    assert 'UNION' in sql
+
+    sql = compile_sql(backfill_query(1, 2, 800, target_actor_id=3))
+    assert sql.endswith('ORDER BY objects.created DESC, objects.id DESC \n LIMIT %(param_2)s')
+
+    store = PostgresTimelineStore(max_entries=800)
+    sql = compile_sql(store.trim_statement([1, 2]))
+    assert sql.startswith('DELETE FROM timeline_entries')
+    assert 'row_number() OVER (PARTITION BY timeline_entries.identity_id' in sql
+
+    from lamia.models.features import TimelineEntry
+    sql = compile_sql(paginate(store.read_query(1),
+                               keys=(TimelineEntry.created, TimelineEntry.object_id)))
+    assert 'objects.data' not in sql
+    assert 'ORDER BY timeline_entries.created DESC, timeline_entries.object_id DESC' in sql
+
+
+def test_home_timelines_configure():
+    from lamia.timelines import HomeTimelines, MemoryTimelineStore, PostgresTimelineStore
+
+    timelines = HomeTimelines()
+    assert isinstance(timelines.store, PostgresTimelineStore)
+    assert timelines.store.max_entries == 800
+
+    settings = {'TIMELINE_BACKEND': 'memory', 'TIMELINE_MAX_ENTRIES': 3}
+    timelines.configure(lambda name, cast, default: cast(settings[name]))
+    assert isinstance(timelines.store, MemoryTimelineStore)
+    assert timelines.store.max_entries == 3
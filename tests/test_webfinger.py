@@ -2,7 +2,11 @@ import sys
 import os
 sys.path.append(os.getcwd())
 
+from types import SimpleNamespace
+
+import aiohttp
 import pytest
+import sqlalchemy as sa
 
 from lamia.activitypub.webfinger import normalize
 
@@ -33,4 +37,228 @@ def test_port_identifier_normalization():
     assert normalize('https://lamia.social:8000/users/lamia', True) == ('lamia.social:8000/users/lamia', expected_base_url,)
     assert normalize('https://lamia.social:8000/@lamia', True) == ('lamia.social:8000/@lamia', expected_base_url,)
     assert normalize('lamia@lamia.social:8000', True) == ('lamia@lamia.social:8000', expected_base_url,)
-    assert normalize('acct:lamia.social:8000/lamia', True) == ('lamia.social:8000/lamia', expected_base_url,)
\ No newline at end of file
+    assert normalize('acct:lamia.social:8000/lamia', True) == ('lamia.social:8000/lamia', expected_base_url,)
+
+@pytest.mark.asyncio
+async def test_finger_cache(monkeypatch):
+    import asyncio
+    import lamia.activitypub.webfinger as webfinger
+
+    fetches = []
+
+    async def fake_fetch(uid, url):
+        fetches.append(uid)
+        await asyncio.sleep(0.01)
+        if uid.startswith('nobody'):
+            raise webfinger.WebfingerException(f'{uid} was not found')
+        return ({'subject': f'acct:{uid}'}, 60)
+
+    monkeypatch.setattr(webfinger, '_fetch', fake_fetch)
+    webfinger.FINGER_CACHE.clear()
+
+    # Concurrent lookups share one fetch, later ones come from the cache
+    results = await asyncio.gather(
+        webfinger.finger('acct:lamia@lamia.social'),
+        webfinger.finger('lamia@lamia.social'),
+        webfinger.finger('lamia@lamia.social:8000'))
+    assert [r['subject'] for r in results] == ['acct:lamia@lamia.social'] * 3
+    await webfinger.finger('lamia@lamia.social')
+    assert fetches == ['lamia@lamia.social']
+
+    # Failures are cached too
+    for _ in range(2):
+        with pytest.raises(webfinger.WebfingerException):
+            await webfinger.finger('nobody@lamia.social')
+    assert fetches == ['lamia@lamia.social', 'nobody@lamia.social']
+    assert webfinger.FINGER_CACHE.stats()['negative_hits'] == 1
+
+    assert webfinger.FINGER_CACHE.invalidate('lamia@lamia.social')
+    await webfinger.finger('lamia@lamia.social')
+    assert len(fetches) == 3
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.headers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            request_info = SimpleNamespace(real_url='https://broken.example')
+            raise aiohttp.ClientResponseError(request_info, (),
+                                              status=self.status)
+
+    async def read(self):
+        return b'{"subject": "acct:lamia@lamia.social"}'
+
+
+@pytest.mark.asyncio
+async def test_fetch_failures(monkeypatch):
+    import lamia.activitypub.webfinger as webfinger
+
+    class FakeClient:
+        fetches = 0
+
+        async def request(self, method, url, **kwargs):
+            self.fetches += 1
+            if 'refused' in url:
+                raise aiohttp.ClientConnectionError('Connection refused')
+            return FakeResponse(503 if 'broken' in url else 200)
+
+    client = FakeClient()
+    monkeypatch.setattr(webfinger, 'http_client', client)
+    webfinger.FINGER_CACHE.clear()
+    negative_hits = webfinger.FINGER_CACHE.stats()['negative_hits']
+
+    result, _ = await webfinger._fetch('lamia@lamia.social', 'https://lamia.social')
+    assert result['subject'] == 'acct:lamia@lamia.social'
+
+    # Dead and broken servers are failures like any other, and remembered
+    for identifier in ['lamia@refused.example', 'lamia@broken.example']:
+        with pytest.raises(webfinger.WebfingerException) as info:
+            await webfinger.finger(identifier)
+        assert isinstance(info.value.__cause__, aiohttp.ClientError)
+        with pytest.raises(webfinger.WebfingerException):
+            await webfinger.finger(identifier)
+    assert client.fetches == 3
+    assert webfinger.FINGER_CACHE.stats()['negative_hits'] == negative_hits + 2
+
+
+def test_cache_ttl():
+    from lamia.activitypub.webfinger import cache_ttl
+    from lamia.activitypub.webfinger import FINGER_CACHE_MAX_TTL, FINGER_CACHE_MIN_TTL
+
+    assert cache_ttl({'Cache-Control': 'max-age=600, public'}) == 600
+    assert cache_ttl({'Cache-Control': 'max-age=259200000'}) == FINGER_CACHE_MAX_TTL
+    assert cache_ttl({'Cache-Control': 'max-age=1'}) == FINGER_CACHE_MIN_TTL
+    assert cache_ttl({'Cache-Control': 'no-store'}) == 0
+    assert cache_ttl({'Expires': 'Thu, 01 Jan 1970 00:00:00 GMT'}) == FINGER_CACHE_MIN_TTL
+
+
+@pytest.mark.asyncio
+async def test_finger_many(monkeypatch):
+    import asyncio
+    import lamia.activitypub.webfinger as webfinger
+
+    running = {}
+    most_running = {}
+
+    async def fake_fetch(uid, url):
+        running[url] = running.get(url, 0) + 1
+        most_running[url] = max(most_running.get(url, 0), running[url])
+        await asyncio.sleep(0.01)
+        running[url] -= 1
+        if uid.startswith('nobody'):
+            raise webfinger.WebfingerException(f'{uid} was not found')
+        return ({'subject': f'acct:{uid}'}, 60)
+
+    monkeypatch.setattr(webfinger, '_fetch', fake_fetch)
+    webfinger.FINGER_CACHE.clear()
+
+    identifiers = [f'user{i}@lamia.social' for i in range(10)]
+    identifiers += [f'user{i}@seems.legit' for i in range(3)]
+    identifiers += ['nobody@seems.legit']
+    # Malformed, and reported with everything else
+    identifiers += [None]
+
+    found = [result async for result in webfinger.finger_many(
+        identifiers, concurrency=5, per_domain=2)]
+    assert sorted([f.identifier for f in found], key=str) == sorted(
+        identifiers, key=str)
+    assert most_running['https://lamia.social'] == 2
+    assert sum(most_running.values()) <= 5
+
+    errors = {f.identifier: f.error for f in found if f.error is not None}
+    assert set(errors) == {'nobody@seems.legit', None}
+    assert isinstance(errors['nobody@seems.legit'],
+                      webfinger.WebfingerException)
+
+
+def test_local_webfinger_index():
+    import ujson as json
+    from lamia.activitypub.local_webfinger import LocalWebfingerIndex
+
+    index = LocalWebfingerIndex('https://lamia.social')
+    index.loaded = True
+    index.add('Lamia')
+
+    document = json.loads(index.get('acct:Lamia@lamia.social'))
+    assert document['subject'] == 'acct:Lamia@lamia.social'
+    assert document['links'][0]['href'] == 'https://lamia.social/u/Lamia'
+    assert index.get('Lamia@LAMIA.social') == index.get('acct:Lamia@lamia.social')
+    assert index.get('https://lamia.social/u/Lamia') == index.get('acct:Lamia@lamia.social')
+
+    # Names that only differ by case belong to different users
+    assert index.get('acct:lamia@lamia.social') is None
+    index.add('lamia')
+    assert json.loads(index.get('acct:lamia@lamia.social'))['subject'] == (
+        'acct:lamia@lamia.social')
+    assert json.loads(index.get('acct:Lamia@lamia.social'))['subject'] == (
+        'acct:Lamia@lamia.social')
+
+    assert index.get('acct:lamia@seems.legit') is None
+    assert index.get('https://seems.legit/u/lamia') is None
+    assert index.get('acct:nobody@lamia.social') is None
+
+    index.remove('lamia')
+    assert index.get('acct:lamia@lamia.social') is None
+    assert index.get('acct:Lamia@lamia.social') is not None
+    assert index.get('acct:Lamia@lamia.social') is not None
+
+
+class FakeIdentities:
+    """Stands in for Identity's query, and lets a test act while it runs."""
+    deleted = sa.column('deleted')
+
+    def __init__(self, user_names, during=None):
+        self.user_names = user_names
+        self.during = during
+        self.gino = self
+
+    def select(self, *columns):
+        return self
+
+    def where(self, clause):
+        return self
+
+    async def all(self):
+        if self.during is not None:
+            self.during()
+        return [(user_name, ) for user_name in self.user_names]
+
+
+@pytest.mark.asyncio
+async def test_local_webfinger_load(monkeypatch):
+    from lamia.activitypub import local_webfinger
+
+    index = local_webfinger.LocalWebfingerIndex('https://lamia.social')
+    monkeypatch.setattr(local_webfinger, 'Identity',
+                        FakeIdentities(['Lamia'], during=index.invalidate))
+    # Invalidated while the query ran, so what it read is thrown away
+    assert await index.lookup('acct:Lamia@lamia.social') is None
+    assert not index.loaded
+
+    monkeypatch.setattr(local_webfinger, 'Identity',
+                        FakeIdentities(['Lamia', 'Muffin']))
+    assert await index.lookup('acct:Muffin@lamia.social') is not None
+    assert index.loaded
+
+
+def test_webfinger_changed():
+    from lamia.activitypub.local_webfinger import LOCAL_WEBFINGER
+    from lamia.invalidation import webfinger_changed
+
+    LOCAL_WEBFINGER.loaded = True
+    webfinger_changed('Cupcake')
+    assert LOCAL_WEBFINGER.get(f'{LOCAL_WEBFINGER.base_url}/u/Cupcake')
+    assert LOCAL_WEBFINGER.loaded
+
+    webfinger_changed(None)
+    assert not LOCAL_WEBFINGER.loaded
+    assert LOCAL_WEBFINGER.documents == {}